@@ -34,4 +34,5 @@ setup(
     keywords="neuroscience datajoint ephys",
     packages=find_packages(exclude=["contrib", "docs", "tests*"]),
     install_requires=requirements,
+    extras_require={"columnar": ["pyarrow"]},
 )
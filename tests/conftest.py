@@ -8,7 +8,13 @@ import datajoint as dj
 import pytest
 from element_interface.utils import QuietStdOut, find_full_path, value_to_bool
 
-from workflow_array_ephys.ingest import ingest_lab, ingest_sessions, ingest_subjects
+from workflow_array_ephys.ingest import (
+    ingest_alignment,
+    ingest_events,
+    ingest_lab,
+    ingest_sessions,
+    ingest_subjects,
+)
 from workflow_array_ephys.paths import get_ephys_root_data_dir
 
 # ------------------- SOME CONSTANTS -------------------
@@ -184,6 +190,9 @@ def pipeline():
         "probe": pipeline.probe,
         "ephys_report": pipeline.ephys_report,
         "session": pipeline.session,
+        "trial": pipeline.trial,
+        "event": pipeline.event,
+        "analysis": pipeline.analysis,
         "get_ephys_root_data_dir": pipeline.get_ephys_root_data_dir,
         "ephys_mode": pipeline.ephys_mode,
     }
@@ -494,3 +503,17 @@ def curations(clustering, pipeline):
         if _tear_down:
             with verbose_context:
                 ephys.Curation.delete()
+
+
+@pytest.fixture(scope="session")
+def events(pipeline, ingest_data):
+    """Ingest the behavior recordings, trials, events and alignments of user_data"""
+    ingest_events(verbose=verbose, skip_duplicates=True)
+    ingest_alignment(verbose=verbose, skip_duplicates=True)
+
+    yield
+
+    if _tear_down:
+        with verbose_context:
+            pipeline["event"].AlignmentEvent.delete()
+            pipeline["event"].BehaviorRecording.delete()
@@ -0,0 +1,462 @@
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from workflow_array_ephys import alignment
+
+
+def _align_spike_times_per_trial(unit_spike_times, event_times, min_limit, max_limit):
+    """Reference implementation: one boolean mask per trial and unit"""
+    units_aligned_spikes = []
+    for spikes in unit_spike_times:
+        units_aligned_spikes.append(
+            [
+                spikes[(event - min_limit <= spikes) & (spikes < event + max_limit)]
+                - event
+                for event in event_times
+            ]
+        )
+    return units_aligned_spikes
+
+
+@pytest.fixture(scope="module")
+def synthetic_session():
+    """Poisson spike trains and jittered trial events for a dense probe"""
+    rng = np.random.default_rng(0)
+    unit_count, trial_count, duration = 100, 500, 1500.0
+
+    unit_spike_times = [
+        np.sort(rng.uniform(0, duration, rng.poisson(rate * duration)))
+        for rate in rng.uniform(1, 20, unit_count)
+    ]
+    event_times = np.sort(rng.uniform(5, duration - 5, trial_count))
+    return unit_spike_times, event_times, 1.0, 2.0
+
+
+def test_align_spike_times_equivalence(synthetic_session):
+    unit_spike_times, event_times, min_limit, max_limit = synthetic_session
+    bin_size = 0.04
+
+    expected = _align_spike_times_per_trial(
+        unit_spike_times, event_times, min_limit, max_limit
+    )
+
+    for spikes, expected_trials in zip(unit_spike_times, expected):
+        aligned_spikes, trial_offsets = alignment.align_spike_times(
+            spikes, event_times, min_limit, max_limit
+        )
+        trials = alignment.split_trials(aligned_spikes, trial_offsets)
+
+        assert len(trials) == len(expected_trials)
+        assert all(np.array_equal(a, b) for a, b in zip(trials, expected_trials))
+
+        psth, psth_edges = alignment.compute_psth(
+            aligned_spikes, len(event_times), min_limit, max_limit, bin_size
+        )
+        expected_psth, expected_edges = np.histogram(
+            np.concatenate(expected_trials),
+            bins=np.arange(-min_limit, max_limit, bin_size),
+        )
+        assert np.array_equal(psth, expected_psth / len(event_times) / bin_size)
+        assert np.array_equal(psth_edges, expected_edges[1:])
+
+
+def test_align_spike_times_unsorted_spikes():
+    spikes = np.array([3.5, 0.2, 1.1, 2.9, 1.4])
+    aligned_spikes, trial_offsets = alignment.align_spike_times(
+        spikes, np.array([1.0, 3.0]), 0.5, 0.6
+    )
+    trials = alignment.split_trials(aligned_spikes, trial_offsets)
+    assert np.allclose(trials[0], [0.1, 0.4])
+    assert np.allclose(trials[1], [-0.1, 0.5])
+
+
+def test_aligned_spikes_lazy_trials(synthetic_session):
+    unit_spike_times, event_times, min_limit, max_limit = synthetic_session
+    aligned_spikes, trial_offsets = alignment.align_spike_times(
+        unit_spike_times[0], event_times, min_limit, max_limit
+    )
+    trials = alignment.split_trials(aligned_spikes, trial_offsets)
+    lazy_trials = alignment.AlignedSpikes(
+        aligned_spikes.astype(np.float32), trial_offsets
+    )
+
+    assert len(lazy_trials) == len(trials)
+    assert all(np.allclose(a, b) for a, b in zip(lazy_trials, trials))
+    assert np.allclose(lazy_trials[-1], trials[-1])
+    assert len(lazy_trials[10:20]) == 10
+
+
+def test_align_units_in_parallel(synthetic_session):
+    unit_spike_times, event_times, min_limit, max_limit = synthetic_session
+
+    serial = alignment.iter_aligned_units(
+        unit_spike_times, event_times, min_limit, max_limit, 0.04
+    )
+    parallel = alignment.iter_aligned_units_parallel(
+        unit_spike_times, event_times, min_limit, max_limit, 0.04, n_workers=2
+    )
+    unit_count = 0
+    for serial_unit, parallel_unit in zip(serial, parallel):
+        assert all(np.array_equal(a, b) for a, b in zip(serial_unit, parallel_unit))
+        unit_count += 1
+    assert unit_count == len(unit_spike_times)
+
+
+def test_merge_psths_from_counts(synthetic_session):
+    unit_spike_times, event_times, min_limit, max_limit = synthetic_session
+    bin_size = 0.04
+    spikes = unit_spike_times[0]
+
+    halves = [event_times[:200], event_times[200:]]
+    counts = [
+        alignment.compute_psth_counts(
+            alignment.align_spike_times(spikes, events, min_limit, max_limit)[0],
+            min_limit,
+            max_limit,
+            bin_size,
+        )[0]
+        for events in halves
+    ]
+    psth, spike_counts, trial_count = alignment.merge_psths(
+        counts, [len(events) for events in halves], bin_size
+    )
+
+    expected_psth, _ = alignment.compute_psth(
+        alignment.align_spike_times(spikes, event_times, min_limit, max_limit)[0],
+        len(event_times),
+        min_limit,
+        max_limit,
+        bin_size,
+    )
+    assert trial_count == len(event_times)
+    assert np.allclose(psth, expected_psth)
+    assert spike_counts.sum() == counts[0].sum() + counts[1].sum()
+
+
+def test_smooth_psth_kernels():
+    psth = np.zeros(101)
+    psth[50] = 1.0
+
+    assert alignment.smooth_psth(psth, 0.01) is psth
+
+    gaussian = alignment.smooth_psth(psth, 0.01, "gaussian", 0.05)
+    assert np.isclose(gaussian.sum(), 1.0)
+    assert np.argmax(gaussian) == 50
+    assert np.allclose(gaussian[:50], gaussian[51:][::-1])
+
+    causal = alignment.smooth_psth(psth, 0.01, "causal", 0.05)
+    assert np.isclose(causal.sum(), 1.0)
+    assert np.all(causal[:50] == 0)
+
+    with pytest.raises(ValueError):
+        alignment.smooth_psth(psth, 0.01, "boxcar", 0.05)
+
+
+def test_smooth_psth_kernel_wider_than_psth():
+    """Kernels wider than the PSTH keep its bins and a constant rate"""
+    psth = np.full(25, 10.0)
+
+    for kernel in ("gaussian", "causal"):
+        smoothed = alignment.smooth_psth(psth, 0.04, kernel, 0.2)
+        assert smoothed.shape == psth.shape
+        assert np.allclose(smoothed, 10.0)
+
+    single_bin = alignment.smooth_psth(np.array([3.0]), 0.04, "gaussian", 0.2)
+    assert np.allclose(single_bin, [3.0])
+
+
+def test_align_spike_times_speedup(synthetic_session):
+    """Benchmark the vectorized engine against per-trial masking"""
+    unit_spike_times, event_times, min_limit, max_limit = synthetic_session
+
+    start = time.perf_counter()
+    _align_spike_times_per_trial(unit_spike_times, event_times, min_limit, max_limit)
+    per_trial_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for spikes in unit_spike_times:
+        alignment.split_trials(
+            *alignment.align_spike_times(spikes, event_times, min_limit, max_limit)
+        )
+    vectorized_duration = time.perf_counter() - start
+
+    print(
+        f"\nAlignment of {len(unit_spike_times)} units x {len(event_times)} trials: "
+        + f"per-trial {per_trial_duration:.3f}s, vectorized {vectorized_duration:.3f}s "
+        + f"({per_trial_duration / vectorized_duration:.0f}x)"
+    )
+    assert vectorized_duration < per_trial_duration
+
+
+def test_lru_cache_eviction_and_counters():
+    from workflow_array_ephys.analysis import _LRUCache
+
+    cache = _LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.info() == {"hits": 2, "misses": 1, "size": 2, "maxsize": 2}
+
+
+class _DiscardingTable:
+    """Stand-in for a DataJoint part table that drops inserted rows"""
+
+    def __init__(self):
+        self.row_count = 0
+
+    def insert(self, rows, **kwargs):
+        self.row_count += len(rows)
+
+    def insert1(self, row, **kwargs):
+        self.row_count += 1
+
+
+class _DiscardingAlignment:
+    """Stand-in for SpikesAlignment whose part tables drop inserted rows"""
+
+    def __init__(self):
+        self.AlignedTrialSpikes = _DiscardingTable()
+        self.AlignedUnitSpikes = _DiscardingTable()
+        self.UnitPSTH = _DiscardingTable()
+        self.SpikeCountTensor = _DiscardingTable()
+
+
+class _RecordingTable:
+    """Stand-in for a DataJoint part table that records the size of each insert"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def insert(self, rows, **kwargs):
+        self.batch_sizes.append(len(rows))
+
+
+def test_insert_in_batches_bounds_rows_and_spikes():
+    from workflow_array_ephys.analysis import _insert_in_batches
+
+    spike_counts = [10, 10, 60, 200, 5, 5, 5, 5, 5]
+    rows = ({"aligned_spike_times": np.zeros(count)} for count in spike_counts)
+    table = _RecordingTable()
+
+    assert _insert_in_batches(table, rows, batch_size=4, batch_spikes=50) == 9
+    # A unit with more spikes than the budget is inserted on its own
+    assert table.batch_sizes == [3, 1, 4, 1]
+
+    table = _RecordingTable()
+    rows = ({"aligned_spike_times": np.zeros(count)} for count in spike_counts)
+    _insert_in_batches(table, rows, batch_size=4)
+    assert table.batch_sizes == [4, 4, 1]
+
+
+def _peak_memory_of_alignment(trial_count, streamed=True):
+    """Peak traced memory (MB) of aligning 20 units and inserting their rows
+
+    The streamed path is the `SpikesAlignment.make` insert of every part table, with
+    1000 rows per insert. The accumulated path collects all rows first.
+    """
+    import datajoint as dj
+
+    from workflow_array_ephys.analysis import SpikesAlignment, _iter_aligned_spikes_rows
+
+    rng = np.random.default_rng(0)
+    duration = trial_count * 3.0
+    unit_spike_times = [np.sort(rng.uniform(0, duration, int(5 * duration)))] * 20
+    event_times = np.sort(rng.uniform(2, duration - 2, trial_count))
+    trial_keys = [{"trial_id": trial_id} for trial_id in range(trial_count)]
+    unit_keys = [{"unit": unit} for unit in range(20)]
+    key = {"trial_condition": "benchmark"}
+
+    table = _DiscardingAlignment()
+    tracemalloc.start()
+    if streamed:
+        with dj.config(custom={"analysis.insert_batch_size": 1000}):
+            SpikesAlignment._insert_aligned_units(
+                table,
+                key,
+                unit_keys,
+                unit_spike_times,
+                trial_keys,
+                event_times,
+                (1.0, 2.0),
+                0.04,
+                "trial",
+            )
+    else:
+        tensor_rows = []
+        rows = list(
+            _iter_aligned_spikes_rows(
+                key,
+                unit_keys,
+                alignment.iter_aligned_units(
+                    unit_spike_times, event_times, 1.0, 2.0, 0.04
+                ),
+                trial_keys,
+                0.04,
+                "trial",
+                [],
+                tensor_rows.append,
+            )
+        )
+        table.AlignedTrialSpikes.insert(rows)
+        table.SpikeCountTensor.insert(tensor_rows)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    assert table.AlignedTrialSpikes.row_count == trial_count * len(unit_keys)
+    assert table.SpikeCountTensor.row_count == len(unit_keys)
+    return peak
+
+
+def test_streaming_insert_peak_memory():
+    """Benchmark peak memory of the streamed make insert vs. accumulated rows
+
+    Streaming holds one batch of rows plus the raster and spike counts of the unit
+    being aligned, so its peak does not grow with the rows accumulated across units.
+    The SpikeCountTensor row spans every trial of a unit, so the peak does grow with
+    the trials of one unit: it is bounded by ~12 times the bytes of one unit's spike
+    train (5 Hz over 3 s per trial) on top of a fixed 1 MB for the row batches.
+    """
+    trial_counts = (500, 2000, 8000)
+    streamed = [_peak_memory_of_alignment(n) for n in trial_counts]
+    accumulated = [_peak_memory_of_alignment(n, streamed=False) for n in trial_counts]
+
+    for n, streamed_peak, accumulated_peak in zip(trial_counts, streamed, accumulated):
+        unit_spikes_size = n * 3.0 * 5 * 8 / 1e6
+        print(
+            f"\n{n} trials x 20 units: peak {streamed_peak:.1f} MB streamed, "
+            + f"{accumulated_peak:.1f} MB accumulated, "
+            + f"{unit_spikes_size:.2f} MB spikes per unit"
+        )
+        assert streamed_peak < 1.0 + 12 * unit_spikes_size
+        assert streamed_peak < accumulated_peak / 4
+
+
+def test_bin_trial_spikes_matches_histograms(synthetic_session):
+    unit_spike_times, event_times, min_limit, max_limit = synthetic_session
+    bin_edges = np.arange(-min_limit, max_limit, 0.04)
+    aligned_spikes, trial_offsets = alignment.align_spike_times(
+        unit_spike_times[0], event_times, min_limit, max_limit
+    )
+
+    flat_indices, counts = alignment.bin_trial_spikes(
+        aligned_spikes, trial_offsets, bin_edges
+    )
+    spike_counts = np.zeros((len(event_times), len(bin_edges) - 1), dtype=int)
+    spike_counts.reshape(-1)[flat_indices] = counts
+
+    for trial_spikes, trial_counts in zip(
+        alignment.split_trials(aligned_spikes, trial_offsets), spike_counts
+    ):
+        assert np.array_equal(trial_counts, np.histogram(trial_spikes, bin_edges)[0])
+    assert np.array_equal(
+        spike_counts.sum(axis=0),
+        alignment.compute_psth_counts(aligned_spikes, min_limit, max_limit, 0.04)[0],
+    )
+
+
+def _get_alignment_windows_per_trial(
+    trial_starts, trial_stops, alignment_events, start_events, end_events, shifts
+):
+    """Reference implementation: element-event's per-trial event queries"""
+    windows = []
+    for trial_start, trial_stop in zip(trial_starts, trial_stops):
+        in_trial = alignment_events[
+            (alignment_events >= trial_start) & (alignment_events <= trial_stop)
+        ]
+        if not len(in_trial):
+            windows.append((np.nan, np.nan, np.nan))
+            continue
+        event = in_trial.max()
+        before, after = (
+            start_events[start_events < event],
+            end_events[end_events > event],
+        )
+        start = max(before.max(), trial_start) if len(before) else trial_start
+        end = min(after.min(), trial_stop) if len(after) else trial_stop
+        windows.append((start + shifts[0], event + shifts[1], end + shifts[2]))
+    return tuple(np.array(times) for times in zip(*windows))
+
+
+def test_get_alignment_windows_matches_per_trial_queries():
+    rng = np.random.default_rng(2)
+    trial_starts = np.arange(200) * 10.0
+    trial_stops = trial_starts + 8.0
+    alignment_events = np.sort(rng.uniform(0, 2000, 150))
+    start_events = np.sort(rng.uniform(0, 2000, 300))
+    end_events = np.sort(rng.uniform(0, 2000, 300))
+    shifts = (-0.5, 0.1, 0.5)
+
+    windows = alignment.get_alignment_windows(
+        trial_starts, trial_stops, alignment_events, start_events, end_events, shifts
+    )
+    expected = _get_alignment_windows_per_trial(
+        trial_starts, trial_stops, alignment_events, start_events, end_events, shifts
+    )
+
+    for times, expected_times in zip(windows, expected):
+        np.testing.assert_array_equal(times, expected_times)
+    assert np.isnan(windows[1]).any() and not np.isnan(windows[1]).all()
+
+    # Without start or end events, windows span whole trials
+    starts, events, ends = alignment.get_alignment_windows(
+        trial_starts, trial_stops, alignment_events, [], []
+    )
+    is_aligned = ~np.isnan(events)
+    np.testing.assert_array_equal(starts[is_aligned], trial_starts[is_aligned])
+    np.testing.assert_array_equal(ends[is_aligned], trial_stops[is_aligned])
+
+
+def test_group_event_times_mixed_case_types():
+    """Event types differing in case are grouped with their own times"""
+    from workflow_array_ephys.analysis import _group_event_times
+
+    # As sorted by a case-insensitive ORDER BY event_type, event_start_time
+    event_types = np.array(["lick", "lick", "Reward", "reward"], dtype=object)
+    event_times = np.array([2.0, 1.0, 1.5, 0.5])
+
+    grouped = _group_event_times(event_types, event_times)
+
+    assert list(grouped) == ["Reward", "lick", "reward"]
+    assert np.array_equal(grouped["lick"], [1.0, 2.0])
+    assert np.array_equal(grouped["Reward"], [1.5])
+    assert np.array_equal(grouped["reward"], [0.5])
+    assert _group_event_times([], []) == {}
+
+
+def test_append_trials_to_tensor_row(synthetic_session):
+    """A unit's tensor row with trials appended equals the row of all trials"""
+    from workflow_array_ephys.analysis import (
+        _append_trials_to_tensor,
+        _spike_count_tensor_row,
+    )
+
+    unit_spike_times, event_times, min_limit, max_limit = synthetic_session
+    bin_edges = np.arange(-min_limit, max_limit, 0.04)
+    trial_ids = np.arange(len(event_times))
+
+    def tensor_row(trials):
+        aligned_spikes, trial_offsets = alignment.align_spike_times(
+            unit_spike_times[0], event_times[trials], min_limit, max_limit
+        )
+        bin_counts = alignment.bin_trial_spikes(
+            aligned_spikes, trial_offsets, bin_edges
+        )
+        return _spike_count_tensor_row(
+            {}, {"unit": 0}, trial_ids[trials], bin_edges, bin_counts
+        )
+
+    appended = _append_trials_to_tensor(
+        tensor_row(slice(0, 300)), tensor_row(slice(300, None))
+    )
+    expected = tensor_row(slice(None))
+
+    for field in ("trial_ids", "count_indices", "spike_counts"):
+        assert np.array_equal(appended[field], expected[field])
+        assert appended[field].dtype == expected[field].dtype
@@ -1,7 +1,11 @@
+import csv
 import os
 import pathlib
 import sys
+from types import SimpleNamespace
 
+import numpy as np
+import pytest
 from element_interface.utils import find_full_path, find_root_directory
 
 docker_root = "/main/test_data/workflow_ephys_data1"
@@ -29,6 +33,286 @@ def test_ingest_sessions(pipeline, ingest_data):
     ) == session_info[1]
 
 
+def test_ingest_sessions_rerun(pipeline, ingest_data):
+    """Re-ingesting every session finds them all existing and inserts nothing"""
+    from workflow_array_ephys.ingest import ingest_sessions
+
+    ephys = pipeline["ephys"]
+    probe = pipeline["probe"]
+    session = pipeline["session"]
+
+    ingest_sessions(**ingest_data["sessions.csv"]["args"], incremental=False)
+
+    assert len(session.Session()) == 7
+    assert len(probe.Probe()) == 9
+    assert len(ephys.ProbeInsertion()) == 13
+
+
+def test_ingest_sessions_checkpoint(pipeline, ingest_data, tmp_path, monkeypatch):
+    """Chunked ingest records committed rows and resumes after them"""
+    import json
+
+    from workflow_array_ephys import ingest
+    from workflow_array_ephys.ingest import ingest_sessions
+
+    session = pipeline["session"]
+    checkpoint_path = tmp_path / "checkpoint.json"
+    session_csv_path = ingest_data["sessions.csv"]["args"]["session_csv_path"]
+
+    ingest_sessions(
+        session_csv_path,
+        incremental=False,
+        chunk_size=2,
+        checkpoint_path=checkpoint_path,
+    )
+    checkpoint = json.loads(checkpoint_path.read_text())
+    assert checkpoint["committed_rows"] == 7
+    assert len(session.Session()) == 7
+
+    # Every row is committed, so the rerun scans nothing, even non-incrementally,
+    # and leaves the scan index as it is
+    def fail_discovery(*args, **kwargs):
+        raise AssertionError("Committed sessions scanned again")
+
+    monkeypatch.setattr(ingest, "discover_sessions", fail_discovery)
+    monkeypatch.setattr(ingest, "refresh_scan_index", fail_discovery)
+    ingest_sessions(
+        session_csv_path, incremental=False, checkpoint_path=checkpoint_path
+    )
+    assert len(session.Session()) == 7
+
+
+def test_ingest_sessions_chunk_failure(pipeline, ingest_data, tmp_path, monkeypatch):
+    """A failed chunk is rolled back and the rerun resumes at that chunk"""
+    import datetime
+    import json
+
+    from workflow_array_ephys import ingest
+    from workflow_array_ephys.ingest import ingest_sessions
+
+    session = pipeline["session"]
+    session_csv_path = tmp_path / "sessions.csv"
+    checkpoint_path = tmp_path / "checkpoint.json"
+    session_csv_path.write_text(
+        "subject,session_dir,session_note,user\n"
+        + "".join(f"subject1,chunk_test/session{row},Note,User1\n" for row in range(6))
+    )
+    test_sessions = session.Session & "session_datetime < '2001-01-01'"
+
+    # Sessions discovered without files, at a datetime given by their csv row
+    scanned_dirs = []
+
+    def discover_sessions(input_sessions, n_workers=1):
+        scanned_dirs.extend(row["session_dir"] for row in input_sessions)
+        return [
+            {
+                "session_dir": row["session_dir"],
+                "session_datetimes": [
+                    datetime.datetime(2000, 1, 1, 0, 0, int(row["session_dir"][-1]))
+                ],
+                "probes": [],
+                "insertions": [],
+            }
+            for row in input_sessions
+        ]
+
+    insert_session_entries = ingest._insert_session_entries
+    inserted_chunks = []
+
+    def fail_third_chunk(entries):
+        inserted_chunks.append(entries)
+        insert_session_entries(entries)
+        if len(inserted_chunks) == 3:
+            raise RuntimeError("Connection lost")
+
+    monkeypatch.setattr(ingest, "discover_sessions", discover_sessions)
+    monkeypatch.setattr(ingest, "_insert_session_entries", fail_third_chunk)
+
+    try:
+        with pytest.raises(RuntimeError):
+            ingest_sessions(
+                session_csv_path,
+                incremental=False,
+                chunk_size=2,
+                checkpoint_path=checkpoint_path,
+            )
+        # Chunks before the failure are committed, the failed chunk is rolled back
+        assert len(test_sessions) == 4
+        assert json.loads(checkpoint_path.read_text())["committed_rows"] == 4
+
+        scanned_dirs.clear()
+        ingest_sessions(
+            session_csv_path,
+            incremental=False,
+            chunk_size=2,
+            checkpoint_path=checkpoint_path,
+        )
+        assert scanned_dirs == ["chunk_test/session4", "chunk_test/session5"]
+        assert len(test_sessions) == 6
+        assert json.loads(checkpoint_path.read_text())["committed_rows"] == 6
+
+        # Committed rows edited since the checkpoint: every row is scanned again
+        session_csv_path.write_text(
+            session_csv_path.read_text().replace("session0,Note", "session0,Edited")
+        )
+        scanned_dirs.clear()
+        ingest_sessions(
+            session_csv_path, incremental=False, checkpoint_path=checkpoint_path
+        )
+        assert len(scanned_dirs) == 6
+        assert len(test_sessions) == 6
+    finally:
+        test_sessions.delete()
+
+
+def test_discover_sessions_parallel(pipeline, ingest_data):
+    """Concurrent session discovery matches the serial scan"""
+    from workflow_array_ephys.ingest import discover_sessions
+
+    input_sessions = list(csv.DictReader(ingest_data["sessions.csv"]["content"]))
+
+    assert discover_sessions(input_sessions, n_workers=4) == discover_sessions(
+        input_sessions
+    )
+
+
+def test_filter_ingested_sessions(pipeline, ingest_data):
+    """Already ingested sessions are skipped, in relative or full path form"""
+    from workflow_array_ephys.ingest import filter_ingested_sessions
+
+    get_ephys_root_data_dir = pipeline["get_ephys_root_data_dir"]
+    root_dirs = get_ephys_root_data_dir()
+    root_dir = root_dirs[0] if isinstance(root_dirs, list) else root_dirs
+
+    input_sessions = list(csv.DictReader(ingest_data["sessions.csv"]["content"]))
+    full_path_sessions = [
+        {**this_session, "session_dir": f"{root_dir}/{this_session['session_dir']}/"}
+        for this_session in input_sessions
+    ]
+    new_session = {**input_sessions[0], "session_dir": "subject_new/session_new"}
+
+    assert filter_ingested_sessions(input_sessions) == []
+    assert filter_ingested_sessions(full_path_sessions) == []
+    assert filter_ingested_sessions(input_sessions + [new_session]) == [new_session]
+
+
+class _InsertRecorder:
+    """Stand-in table recording the entries inserted into it"""
+
+    def __init__(self, **attribute_types):
+        attributes = {
+            name: SimpleNamespace(
+                type=attribute_type,
+                numeric=attribute_type.startswith(("int", "smallint", "float")),
+                string=attribute_type.startswith(("varchar", "enum")),
+            )
+            for name, attribute_type in attribute_types.items()
+        }
+        self.heading = SimpleNamespace(names=list(attributes), attributes=attributes)
+        self.inserts = []
+
+    def insert(self, entries, **kwargs):
+        self.inserts.append(entries)
+
+
+def _trial_tables():
+    trial_type = _InsertRecorder(
+        trial_type="varchar(16)", trial_type_description="varchar(256)"
+    )
+    trial_attribute = _InsertRecorder(
+        trial_id="smallint",
+        attribute_name="varchar(32)",
+        attribute_value="varchar(2000)",
+    )
+    return trial_type, trial_attribute
+
+
+def test_stream_file_to_tables(pipeline, tmp_path):
+    """Each chunk of csv rows reaches every table, projected and deduplicated"""
+    from workflow_array_ephys.ingest import stream_file_to_tables
+
+    csv_path = tmp_path / "trials.csv"
+    csv_path.write_text(
+        "trial_id,trial_type,attribute_name,attribute_value\n"
+        + "1,stim,lumen,851\n1,stim,delay,2\n2,ctrl,lumen,762\n3,stim,lumen,10\n"
+    )
+    trial_type, trial_attribute = _trial_tables()
+
+    stream_file_to_tables(
+        csv_path, [trial_type, trial_attribute], chunk_size=3, verbose=False
+    )
+
+    assert trial_type.inserts == [
+        [{"trial_type": "stim"}, {"trial_type": "ctrl"}],
+        [{"trial_type": "stim"}],
+    ]
+    assert [len(entries) for entries in trial_attribute.inserts] == [3, 1]
+    assert trial_attribute.inserts[1] == [
+        {"trial_id": "3", "attribute_name": "lumen", "attribute_value": "10"}
+    ]
+
+
+def test_stream_npz_to_tables(pipeline, tmp_path):
+    """Typed npz columns are inserted as Python values and checked against headings"""
+    from workflow_array_ephys.ingest import stream_file_to_tables
+
+    npz_path = tmp_path / "trials.npz"
+    columns = {
+        "trial_id": np.array([1, 1, 2]),
+        "trial_type": np.array(["stim", "stim", "ctrl"]),
+        "attribute_name": np.array(["lumen", "delay", "lumen"]),
+        "attribute_value": np.array(["851", "2", "762"]),
+    }
+    np.savez(npz_path, **columns)
+    trial_type, trial_attribute = _trial_tables()
+
+    stream_file_to_tables(npz_path, [trial_type, trial_attribute], verbose=False)
+
+    assert trial_type.inserts == [[{"trial_type": "stim"}, {"trial_type": "ctrl"}]]
+    assert trial_attribute.inserts[0][0] == {
+        "trial_id": 1,
+        "attribute_name": "lumen",
+        "attribute_value": "851",
+    }
+    assert type(trial_attribute.inserts[0][0]["trial_id"]) is int
+
+    np.savez(npz_path, **{**columns, "trial_id": columns["trial_type"]})
+    with pytest.raises(TypeError):
+        stream_file_to_tables(npz_path, [trial_attribute], verbose=False)
+
+
+def test_stream_feather_record_batches(pipeline, tmp_path):
+    """Compressed Feather record batches are read one at a time and sliced to chunks"""
+    pyarrow = pytest.importorskip("pyarrow")
+    from pyarrow import feather
+
+    from workflow_array_ephys.ingest import stream_file_to_tables
+
+    feather_path = tmp_path / "trials.feather"
+    feather.write_feather(
+        pyarrow.table(
+            {
+                "trial_id": list(range(1, 8)),
+                "trial_type": ["stim", "ctrl"] * 3 + ["stim"],
+                "attribute_name": ["lumen"] * 7,
+                "attribute_value": [str(value) for value in range(7)],
+            }
+        ),
+        feather_path,
+        compression="lz4",
+        chunksize=4,
+    )
+    trial_type, trial_attribute = _trial_tables()
+
+    stream_file_to_tables(
+        feather_path, [trial_type, trial_attribute], chunk_size=3, verbose=False
+    )
+
+    # Record batches of 4 and 3 rows, in chunks of at most 3 rows
+    assert [len(entries) for entries in trial_attribute.inserts] == [3, 1, 3]
+    assert [entry["trial_id"] for entry in trial_attribute.inserts[1]] == [4]
+
+
 def test_find_valid_full_path(pipeline, ingest_data):
 
     if not os.environ.get("IS_DOCKER", False):
@@ -0,0 +1,48 @@
+import pytest
+
+from workflow_array_ephys import metrics
+
+
+def _record(table_name, wall_time, status="success"):
+    return {
+        "table_name": table_name,
+        "key": f'{{"subject": "subject{wall_time:.0f}"}}',
+        "status": status,
+        "start_time": "2023-01-01T00:00:00",
+        "wall_time": wall_time,
+        "cpu_time": wall_time / 2,
+        "peak_rss": 2_000_000,
+        "bytes_fetched": 1_000_000,
+        "bytes_inserted": 500_000,
+        "rows_inserted": 10,
+        "host": "node1",
+        "pid": 100,
+    }
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".sqlite", ".csv"])
+def test_metrics_sinks_round_trip(tmp_path, suffix):
+    records = [_record("ephys.LFP", 30.0), _record("ephys.Clustering", 5.0, "error")]
+    path = tmp_path / f"metrics{suffix}"
+
+    metrics.write_metrics(records[:1], path)
+    metrics.write_metrics(records[1:], path)
+
+    assert metrics.read_metrics(path) == records
+
+
+def test_metrics_unknown_sink(tmp_path):
+    with pytest.raises(ValueError):
+        metrics.write_metrics([_record("ephys.LFP", 1.0)], tmp_path / "metrics.txt")
+
+
+def test_summarize_metrics_slowest_keys():
+    records = [_record("ephys.LFP", wall_time) for wall_time in (3.0, 40.0, 7.0)]
+    records.append(_record("ephys.WaveformSet", 100.0, "error"))
+
+    lines = metrics.summarize_metrics(records, top=2).splitlines()
+
+    assert lines[0].startswith("ephys.WaveformSet: 1 key(s), 1 failed, 100.0s wall")
+    assert lines[2].startswith("ephys.LFP: 3 key(s), 0 failed, 50.0s wall")
+    assert "subject40" in lines[3] and "subject7" in lines[4]
+    assert len(lines) == 5
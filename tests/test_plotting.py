@@ -0,0 +1,119 @@
+import time
+import tracemalloc
+
+import matplotlib
+import numpy as np
+import pytest
+
+from workflow_array_ephys import alignment
+from workflow_array_ephys.plotting import plot_psth
+
+matplotlib.use("Agg")
+
+
+def _synthetic_raster(spike_count, trial_count=1500):
+    """Aligned spikes of one unit with `spike_count` spikes over `trial_count` trials"""
+    rng = np.random.default_rng(0)
+    aligned_spikes = rng.uniform(-1, 2, spike_count)
+    trial_offsets = np.linspace(0, spike_count, trial_count + 1).astype(np.int64)
+    return alignment.AlignedSpikes(aligned_spikes, trial_offsets)
+
+
+def _synthetic_units(unit_count):
+    """What `plot_psth.plot_units` plots for `unit_count` units of 100 trials"""
+    psth_edges = np.arange(-1, 2, 0.04)
+    return [
+        {
+            "unit": unit,
+            "title": f"unit {unit}",
+            "trial_ids": np.arange(100),
+            "aligned_spikes": _synthetic_raster(5000, trial_count=100),
+            "psth": np.ones(len(psth_edges)),
+            "psth_edges": psth_edges,
+        }
+        for unit in range(unit_count)
+    ]
+
+
+def _render(aligned_spikes, render):
+    """Render time (s) and peak traced memory (MB) of drawing one raster"""
+    import matplotlib.pyplot as plt
+
+    def draw():
+        fig, ax = plt.subplots(1, 1)
+        plot_psth._plot_spike_raster(aligned_spikes, ax=ax, xlim=(-1, 2), render=render)
+        fig.canvas.draw()
+        plt.close(fig)
+
+    start = time.perf_counter()
+    draw()
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    draw()
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return duration, peak
+
+
+def test_raster_positions():
+    aligned_spikes = [np.array([0.1, 0.2]), np.array([]), np.array([-0.3])]
+    raster, trial_ids = plot_psth._get_raster_positions(aligned_spikes, [4, 5, 6])
+    assert np.array_equal(raster, [0.1, 0.2, -0.3])
+    assert np.array_equal(trial_ids, [4, 4, 6])
+
+    lazy_raster, lazy_trial_ids = plot_psth._get_raster_positions(
+        alignment.AlignedSpikes(raster, np.array([0, 2, 2, 3])), [4, 5, 6]
+    )
+    assert np.array_equal(lazy_raster, raster)
+    assert np.array_equal(lazy_trial_ids, trial_ids)
+
+    with pytest.raises(ValueError):
+        plot_psth._plot_spike_raster(aligned_spikes, render="scatter")
+
+
+def test_raster_render_benchmark():
+    """Benchmark render time and memory of each raster rendering
+
+    The LineCollection rendering is only timed up to 100k spikes, where it is
+    already slower than markers with the Agg backend.
+    """
+    for spike_count in (10_000, 100_000, 1_000_000):
+        aligned_spikes = _synthetic_raster(spike_count)
+        renders = ("markers", "lines", "image")
+        if spike_count > 100_000:
+            renders = ("markers", "image")
+        results = {render: _render(aligned_spikes, render) for render in renders}
+        print(
+            f"\n{spike_count} spikes: "
+            + ", ".join(
+                f"{render} {duration:.2f}s / {peak:.1f} MB"
+                for render, (duration, peak) in results.items()
+            )
+        )
+
+    assert results["image"][0] < results["markers"][0]
+    assert results["image"][1] < results["markers"][1]
+
+
+def test_plot_units_to_pdf_and_pngs(tmp_path):
+    units = _synthetic_units(6)
+
+    pdf_paths = plot_psth.plot_units(units, 0.04, tmp_path / "units.pdf")
+    assert pdf_paths == [tmp_path / "units.pdf"] and pdf_paths[0].stat().st_size
+
+    png_paths = plot_psth.plot_units(
+        units, 0.04, tmp_path / "png", "png", n_workers=2, units_per_task=2
+    )
+    assert [path.name for path in png_paths] == [f"unit_{u}.png" for u in range(6)]
+    assert all(path.stat().st_size for path in png_paths)
+
+
+def test_render_unit_figures_to_bytes():
+    units = _synthetic_units(3)
+
+    pngs = plot_psth.render_unit_figures(units, 0.04, "png")
+    svgs = plot_psth.render_unit_figures(units, 0.04, "svg")
+    assert len(pngs) == len(svgs) == 3
+    assert all(png.startswith(b"\x89PNG") for png in pngs)
+    assert all(b"<svg" in svg for svg in svgs)
@@ -2,6 +2,9 @@ import json
 
 import numpy as np
 import pandas as pd
+import pytest
+
+from workflow_array_ephys import alignment
 
 
 def test_ephys_recording_populate(pipeline, ephys_recordings):
@@ -329,6 +332,183 @@ def test_build_electrode_layouts(pipeline):
         ), f"probe type '{probe_type}' electrode layout does not match"
 
 
+def test_trial_event_index_follows_edited_events(pipeline, events):
+    analysis, event, trial = pipeline["analysis"], pipeline["event"], pipeline["trial"]
+    session_key = (
+        pipeline["session"].Session & (event.Event & "event_type='center'")
+    ).fetch("KEY", limit=1)[0]
+
+    def center_event_windows():
+        index = analysis._fetch_trial_event_index(session_key)
+        return alignment.get_alignment_windows(
+            index["trial_starts"],
+            index["trial_stops"],
+            index["event_times"]["center"],
+            index["event_times"]["center"],
+            index["event_times"]["center"],
+        )[1]
+
+    old_events = center_event_windows()
+    trial_index = np.flatnonzero(~np.isnan(old_events))[0]
+    event_key = (
+        event.Event
+        & session_key
+        & {"event_type": "center"}
+        & f"ABS(event_start_time - {old_events[trial_index]}) < 1e-4"
+    ).fetch1("KEY")
+    event_row = (event.Event & event_key).fetch1()
+    trial_event_rows = (trial.TrialEvent & event_key).fetch(as_dict=True)
+
+    # Same number of events, one of them moved later within its trial
+    moved_time = float(event_row["event_start_time"]) + 0.001
+    (event.Event & event_key).delete(safemode=False)
+    event.Event.insert1({**event_row, "event_start_time": moved_time})
+    try:
+        new_events = center_event_windows()
+        assert np.isclose(new_events[trial_index], moved_time)
+        assert np.allclose(
+            np.delete(new_events, trial_index),
+            np.delete(old_events, trial_index),
+            equal_nan=True,
+        )
+    finally:
+        (event.Event & {**event_key, "event_start_time": moved_time}).delete(
+            safemode=False
+        )
+        event.Event.insert1(event_row)
+        trial.TrialEvent.insert(trial_event_rows, allow_direct_insert=True)
+
+
+@pytest.mark.parametrize("raster_layout", ["trial", "unit"])
+def test_update_trials_matches_full_recompute(
+    curations, events, pipeline, testdata_paths, raster_layout, tmp_path
+):
+    """Trials appended with update_trials give the entries of a full populate"""
+    ephys, analysis, trial = pipeline["ephys"], pipeline["analysis"], pipeline["trial"]
+    curation_key = _get_curation_key(testdata_paths["npx3B-p1-ks"], pipeline)
+    ephys.CuratedClustering.populate(curation_key)
+    clustering_key = (ephys.CuratedClustering & curation_key).fetch1("KEY")
+    trial_keys = (trial.Trial & clustering_key).fetch("KEY", order_by="trial_id")
+    first_trials = trial_keys[: len(trial_keys) // 2]
+    added_trials = trial_keys[len(trial_keys) // 2 :]
+
+    updated_key, full_key = (
+        {
+            **clustering_key,
+            "alignment_name": "center_button",
+            "trial_condition": f"update_trials_test_{raster_layout}_{name}",
+        }
+        for name in ("updated", "full")
+    )
+    condition = analysis.SpikesAlignmentCondition
+    try:
+        for condition_key, condition_trials in (
+            (updated_key, first_trials),
+            (full_key, trial_keys),
+        ):
+            condition.insert1({**condition_key, "raster_layout": raster_layout})
+            condition.Trial.insert(
+                [{**condition_key, **trial_key} for trial_key in condition_trials]
+            )
+            analysis.SpikesAlignment.populate(condition_key)
+        condition.Trial.insert(
+            [{**updated_key, **trial_key} for trial_key in added_trials]
+        )
+
+        assert analysis.SpikesAlignment().update_trials(updated_key) == len(
+            added_trials
+        )
+
+        if raster_layout == "unit":
+            aligned_spikes = analysis.SpikesAlignment.AlignedUnitSpikes
+            attributes = ["trial_ids", "trial_offsets", "aligned_spike_times"]
+            order_by = "unit"
+        else:
+            aligned_spikes = analysis.SpikesAlignment.AlignedTrialSpikes
+            attributes = ["trial_id", "aligned_spike_times"]
+            order_by = "unit, trial_id"
+        parts = (
+            (aligned_spikes, attributes, order_by),
+            (
+                analysis.SpikesAlignment.UnitPSTH,
+                ["psth", "psth_edges", "psth_counts", "trial_count"],
+                "unit",
+            ),
+        )
+        for part, part_attributes, part_order in parts:
+            updated, full = (
+                (part & key).fetch("unit", *part_attributes, order_by=part_order)
+                for key in (updated_key, full_key)
+            )
+            assert len(updated[0]) == len(full[0]) > 0
+            for updated_values, full_values in zip(updated, full):
+                for updated_value, full_value in zip(updated_values, full_values):
+                    assert np.allclose(updated_value, full_value)
+
+        for updated, full in zip(
+            analysis.SpikesAlignment().fetch_spike_count_tensor(updated_key),
+            analysis.SpikesAlignment().fetch_spike_count_tensor(full_key),
+        ):
+            assert np.array_equal(updated, full)
+
+        # The memory-mapped tensor, filled one unit at a time, matches the in-memory one
+        for mapped, full in zip(
+            analysis.SpikesAlignment().fetch_spike_count_tensor(
+                full_key, mmap_path=tmp_path / "spike_counts.npy"
+            ),
+            analysis.SpikesAlignment().fetch_spike_count_tensor(full_key),
+        ):
+            assert np.array_equal(mapped, full)
+    finally:
+        (condition & [updated_key, full_key]).delete()
+
+
+def test_update_trials_rejects_changed_window(
+    curations, events, pipeline, testdata_paths
+):
+    """A window widened within its last bin is rejected, and BinnedPSTH ignores it"""
+    ephys, analysis, trial = pipeline["ephys"], pipeline["analysis"], pipeline["trial"]
+    curation_key = _get_curation_key(testdata_paths["npx3B-p1-ks"], pipeline)
+    ephys.CuratedClustering.populate(curation_key)
+    clustering_key = (ephys.CuratedClustering & curation_key).fetch1("KEY")
+    trial_keys = (trial.Trial & clustering_key).fetch("KEY", order_by="trial_id")
+    condition_key = {
+        **clustering_key,
+        "alignment_name": "center_button",
+        "trial_condition": "update_trials_window_test",
+    }
+    condition = analysis.SpikesAlignmentCondition
+    try:
+        condition.insert1(condition_key)
+        condition.Trial.insert(
+            [{**condition_key, **trial_key} for trial_key in trial_keys[:-1]]
+        )
+        analysis.SpikesAlignment.populate(condition_key)
+        # As if the stored trials ended slightly earlier than the added trial
+        max_limit = (analysis.SpikesAlignment & condition_key).fetch1("max_limit")
+        analysis.SpikesAlignment.update1(
+            {**condition_key, "max_limit": max_limit - 1e-6}
+        )
+        condition.Trial.insert1({**condition_key, **trial_keys[-1]})
+
+        with pytest.raises(ValueError):
+            analysis.SpikesAlignment().update_trials(condition_key)
+
+        # BinnedPSTH bins the stored raster over the stored window
+        psth_key = {**condition_key, "psth_param_id": 1}  # the condition's 40 ms bins
+        analysis.BinnedPSTH.populate(psth_key)
+        binned, stored = (
+            (table & condition_key).fetch("psth", "psth_edges", order_by="unit")
+            for table in (analysis.BinnedPSTH.Unit, analysis.SpikesAlignment.UnitPSTH)
+        )
+        for binned_values, stored_values in zip(binned, stored):
+            assert len(binned_values) == len(stored_values) > 0
+            for binned_value, stored_value in zip(binned_values, stored_values):
+                assert np.allclose(binned_value, stored_value)
+    finally:
+        (condition & condition_key).delete()
+
+
 # ---- HELPER FUNCTIONS ----
 
 
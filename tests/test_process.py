@@ -0,0 +1,375 @@
+import datetime
+import os
+import pathlib
+
+import datajoint as dj
+import pytest
+
+# Restrictions of the key sources of the stub tables queried in this process
+_QUERIES = []
+
+
+class _StubQuery:
+    """Keys of a stub table, restricted and subtracted like a DataJoint query"""
+
+    def __init__(self, table_name, keys):
+        self.table_name = table_name
+        self.keys = list(keys)
+
+    def __and__(self, restriction):
+        _QUERIES.append((self.table_name, restriction))
+        if isinstance(restriction, dj.AndList):
+            keys = [
+                key for key in self.keys if all(_matches(key, r) for r in restriction)
+            ]
+        else:
+            restriction = (
+                [restriction] if isinstance(restriction, dict) else restriction
+            )
+            keys = [
+                key for key in self.keys if any(_matches(key, r) for r in restriction)
+            ]
+        return _StubQuery(self.table_name, keys)
+
+    def __sub__(self, table):
+        populated_keys = table.fetch("KEY")
+        return _StubQuery(
+            self.table_name, [key for key in self.keys if key not in populated_keys]
+        )
+
+    def fetch(self, *attributes):
+        return list(self.keys)
+
+
+class _StubTable:
+    """Stand-in for a computed table, populated in files shared by all processes
+
+    Keys are {"recording": int}. Populating `failing_recording` returns an error as
+    `populate(suppress_errors=True)` does, populating `crashing_recording` raises.
+    """
+
+    failing_recording = None
+    crashing_recording = None
+
+    @property
+    def key_source(self):
+        return _StubQuery(type(self).__name__, self._source_keys())
+
+    def fetch(self, *attributes):
+        return [{"recording": int(path.name)} for path in self._directory.iterdir()]
+
+    def populate(self, key, reserve_jobs=False, suppress_errors=False):
+        if key["recording"] == self.crashing_recording:
+            raise RuntimeError("lost connection")
+        if key["recording"] == self.failing_recording:
+            return [(key, "ValueError: corrupt recording")]
+        (self._directory / str(key["recording"])).touch()
+        return []
+
+    @property
+    def _directory(self):
+        directory = pathlib.Path(os.environ["STUB_TABLE_DIR"]) / type(self).__name__
+        directory.mkdir(exist_ok=True)
+        return directory
+
+
+class _Recording(_StubTable):
+    def _source_keys(self):
+        return [{"recording": recording} for recording in range(4)]
+
+
+class _Sorting(_StubTable):
+    failing_recording = 2
+    crashing_recording = 3
+
+    def _source_keys(self):
+        return _Recording().fetch("KEY")
+
+
+def _matches(key, restriction):
+    return all(key[name] == value for name, value in restriction.items())
+
+
+STUB_DEPENDENCIES = {
+    "tests.test_process:_Recording": [],
+    "tests.test_process:_Sorting": ["tests.test_process:_Recording"],
+}
+
+
+@pytest.fixture
+def process(pipeline):
+    from workflow_array_ephys import process
+
+    return process
+
+
+@pytest.fixture
+def stub_tables(tmp_path, monkeypatch):
+    """Directory of the stub tables, inherited by spawned worker processes"""
+    monkeypatch.setenv("STUB_TABLE_DIR", str(tmp_path))
+    _QUERIES.clear()
+    yield tmp_path
+    _QUERIES.clear()
+
+
+def _recording_key(subject, day, insertion_number=0):
+    return {
+        "subject": subject,
+        "session_datetime": datetime.datetime(2023, 1, day),
+        "insertion_number": insertion_number,
+    }
+
+
+def _recording_id(key):
+    return (key["subject"], key["session_datetime"], key["insertion_number"])
+
+
+def test_order_keys_default_keeps_order(process):
+    keys = [_recording_key("subject1", day) for day in (2, 1, 3)]
+
+    assert process.order_keys(keys) == keys
+
+
+def test_order_keys_newest_first(process):
+    keys = [_recording_key("subject1", day) for day in (2, 1, 3)]
+
+    ordered = process.order_keys(keys, "newest_first")
+
+    assert [key["session_datetime"].day for key in ordered] == [3, 2, 1]
+
+
+def test_order_keys_callable(process):
+    keys = [_recording_key("subject1", 1, insertion) for insertion in (0, 1, 2)]
+
+    ordered = process.order_keys(keys, lambda key: key["insertion_number"] % 2)
+
+    assert [key["insertion_number"] for key in ordered] == [1, 0, 2]
+
+
+@pytest.mark.parametrize("key_order", ["longest_first", "largest_first"])
+def test_order_keys_by_recording_cost(process, monkeypatch, key_order):
+    keys = [_recording_key("subject1", day) for day in (1, 2, 3, 4)]
+    clustering_keys = [{**key, "paramset_idx": 0} for key in keys]
+    recording_costs = {_recording_id(keys[0]): 10.0, _recording_id(keys[1]): 30.0}
+    queried = []
+
+    def get_recording_costs(order, recording_keys):
+        queried.append((order, recording_keys))
+        return {_recording_id(keys[2]): 20.0}
+
+    monkeypatch.setattr(process, "_get_recording_costs", get_recording_costs)
+
+    ordered = process.order_keys(clustering_keys, key_order, recording_costs)
+
+    # Unknown costs (day 4) come last, cached costs are not queried again
+    assert [key["session_datetime"].day for key in ordered] == [2, 3, 1, 4]
+    assert queried == [(key_order, keys[2:])]
+    assert recording_costs[_recording_id(keys[2])] == 20.0
+
+    queried.clear()
+    process.order_keys(clustering_keys[:3], key_order, recording_costs)
+    assert queried == []
+
+
+def test_order_keys_unknown_order(process):
+    with pytest.raises(ValueError):
+        process.order_keys([_recording_key("subject1", 1)], "shortest_first")
+
+
+def test_populate_scheduled_stub_tables(process, stub_tables):
+    errors = process.populate_scheduled(
+        table_dependencies=STUB_DEPENDENCIES, n_workers=2, display_progress=False
+    )
+
+    assert sorted(_Recording().fetch("KEY"), key=str) == [
+        {"recording": recording} for recording in range(4)
+    ]
+    assert sorted(_Sorting().fetch("KEY"), key=str) == [
+        {"recording": 0},
+        {"recording": 1},
+    ]
+    assert sorted(errors, key=str) == [
+        (
+            "tests.test_process:_Sorting",
+            {"recording": 2},
+            "ValueError: corrupt recording",
+        ),
+        (
+            "tests.test_process:_Sorting",
+            {"recording": 3},
+            "RuntimeError: lost connection",
+        ),
+    ]
+
+    # Once its parent completes a key, a table only queries the keys it made ready
+    assert _QUERIES
+    for table_name, restriction in _QUERIES:
+        assert table_name == "_Sorting"
+        assert all(key in _Recording().fetch("KEY") for key in restriction)
+
+
+def test_populate_scheduled_stop_event(process, stub_tables):
+    stop_event = process.threading.Event()
+    stop_event.set()
+
+    errors = process.populate_scheduled(
+        table_dependencies=STUB_DEPENDENCIES,
+        n_workers=2,
+        display_progress=False,
+        stop_event=stop_event,
+    )
+
+    assert errors == []
+    assert _Recording().fetch("KEY") == []
+
+
+def test_run_worker_cycles(process, monkeypatch):
+    running_keys = [("ephys.LFP", {"subject": "subject1"})]
+    calls, refreshed, reclaimed = [], [], []
+    entry_counts = iter([0, 1, 1, 1])
+
+    def populate_scheduled(**kwargs):
+        calls.append(kwargs)
+        kwargs["heartbeat"](running_keys)
+        if len(calls) == 2:
+            kwargs["stop_event"].set()
+        return []
+
+    monkeypatch.setattr(process, "populate_scheduled", populate_scheduled)
+    monkeypatch.setattr(process, "_refresh_reservations", refreshed.append)
+    monkeypatch.setattr(process, "_reclaim_stale_reservations", reclaimed.append)
+    monkeypatch.setattr(process, "_count_entries", lambda: next(entry_counts))
+    sigterm_handler = process.signal.getsignal(process.signal.SIGTERM)
+
+    process.run_worker(n_workers=3, min_idle_sleep=0, stale_after=120)
+
+    assert len(calls) == 2
+    assert all(call["reserve_jobs"] and call["n_workers"] == 3 for call in calls)
+    assert refreshed == [running_keys, running_keys]
+    assert reclaimed == [120, 120]
+    assert process.signal.getsignal(process.signal.SIGTERM) == sigterm_handler
+
+
+def test_reservations_of_crashed_workers_go_stale(process, pipeline):
+    ephys = pipeline["ephys"]
+    jobs = ephys.schema.jobs
+    running_key, crashed_key, fresh_key = (
+        {"subject": f"worker_test{index}"} for index in range(3)
+    )
+    key_hashes = [dj.hash.key_hash(key) for key in (running_key, crashed_key)]
+    for key in (running_key, crashed_key, fresh_key):
+        jobs.reserve(ephys.LFP.table_name, key)
+    jobs.connection.query(
+        f"UPDATE {jobs.full_table_name} SET timestamp=NOW() - INTERVAL 1 HOUR "
+        + "WHERE key_hash IN (%s, %s)",
+        args=key_hashes,
+    )
+
+    try:
+        process._refresh_reservations([("ephys.LFP", running_key)])
+        process._reclaim_stale_reservations(stale_after=600)
+
+        test_jobs = jobs & [
+            {"key_hash": dj.hash.key_hash(key)}
+            for key in (running_key, crashed_key, fresh_key)
+        ]
+        assert set(test_jobs.fetch("key_hash")) == {
+            dj.hash.key_hash(running_key),
+            dj.hash.key_hash(fresh_key),
+        }
+    finally:
+        (jobs & [{"key_hash": key_hash} for key_hash in key_hashes]).delete_quick()
+        (jobs & {"key_hash": dj.hash.key_hash(fresh_key)}).delete_quick()
+
+
+def test_main_cli(process, monkeypatch):
+    calls = []
+    monkeypatch.setattr(process, "run", lambda **kwargs: calls.append(("run", kwargs)))
+    monkeypatch.setattr(
+        process, "run_worker", lambda **kwargs: calls.append(("worker", kwargs))
+    )
+
+    process.main([])
+    process.main(
+        [
+            "worker",
+            "--n-workers",
+            "4",
+            "--table-concurrency",
+            "ephys.LFP=2",
+            "ephys.Clustering=1",
+            "--stale-after",
+            "900",
+            "--key-order",
+            "longest_first",
+        ]
+    )
+
+    assert calls[0] == (
+        "run",
+        {
+            "n_workers": None,
+            "table_concurrency": {},
+            "metrics_path": None,
+            "key_order": None,
+        },
+    )
+    mode, worker_kwargs = calls[1]
+    assert mode == "worker"
+    assert worker_kwargs["n_workers"] == 4
+    assert worker_kwargs["table_concurrency"] == {"ephys.LFP": 2, "ephys.Clustering": 1}
+    assert worker_kwargs["stale_after"] == 900
+    assert worker_kwargs["key_order"] == "longest_first"
+
+    with pytest.raises(SystemExit):
+        process.main(["worker", "--key-order", "shortest_first"])
+
+
+def test_peak_rss_sampler_is_per_context(process):
+    if process._get_current_rss() is None:
+        pytest.skip("resident set size is not sampled on this platform")
+
+    with process._PeakRSSSampler(interval=0.01) as large_sampler:
+        baseline = process._get_current_rss()
+        buffer = b"\x01" * 200_000_000
+        process.time.sleep(0.1)
+        del buffer
+    with process._PeakRSSSampler(interval=0.01) as small_sampler:
+        process.time.sleep(0.1)
+
+    assert large_sampler.peak_rss - baseline >= 150_000_000
+    assert small_sampler.peak_rss < large_sampler.peak_rss - 100_000_000
+
+
+def test_populate_parallel_stub_table(process, stub_tables):
+    for recording in range(4):
+        _Recording().populate({"recording": recording})
+
+    errors = process.populate_parallel(
+        "tests.test_process:_Sorting", n_workers=2, display_progress=False
+    )
+
+    assert sorted(_Sorting().fetch("KEY"), key=str) == [
+        {"recording": 0},
+        {"recording": 1},
+    ]
+    # Errors returned by populate and raised in a worker are both reported
+    assert sorted(errors, key=str) == [
+        ({"recording": 2}, "ValueError: corrupt recording"),
+        ({"recording": 3}, "RuntimeError: lost connection"),
+    ]
+
+
+def test_populate_parallel_restrictions(process, stub_tables):
+    for recording in range(4):
+        _Recording().populate({"recording": recording})
+
+    errors = process.populate_parallel(
+        "tests.test_process:_Sorting",
+        {"recording": 1},
+        n_workers=2,
+        display_progress=False,
+    )
+
+    assert errors == []
+    assert _Sorting().fetch("KEY") == [{"recording": 1}]
@@ -0,0 +1,85 @@
+import os
+
+from workflow_array_ephys.scan_index import ScanIndex
+
+
+def _make_tree(root):
+    for probe in ("probe_1", "probe_2"):
+        probe_dir = root / "subject1" / "session1" / probe
+        probe_dir.mkdir(parents=True)
+        (probe_dir / f"{probe}_g0_t0.imec.ap.meta").write_text("meta")
+        (probe_dir / f"{probe}_g0_t0.imec.ap.bin").write_text("data")
+    (root / "subject2" / "session_1").mkdir(parents=True)
+
+
+def _touch_dir(directory):
+    """Advance the mtime of a directory past the resolution of its file system"""
+    mtime = directory.stat().st_mtime + 10
+    os.utime(directory, (mtime, mtime))
+
+
+def test_scan_index_glob_matches_rglob(tmp_path):
+    root = tmp_path / "root"
+    _make_tree(root)
+    index = ScanIndex(tmp_path / "index.sqlite")
+
+    assert index.refresh(root) == 7
+    for directory in (root, root / "subject1" / "session1"):
+        assert index.glob(directory, "*.ap.meta") == sorted(
+            directory.rglob("*.ap.meta")
+        )
+    assert index.glob(root, "*.ap.bin") == []  # not an indexed pattern
+    # "_" is not a wildcard: session_1 must not match session1
+    assert index.glob(root / "subject2" / "session_1", "*.ap.meta") == []
+
+
+def test_scan_index_incremental_refresh(tmp_path):
+    root = tmp_path / "root"
+    _make_tree(root)
+    index = ScanIndex(tmp_path / "index.sqlite")
+    index.refresh(root)
+
+    assert index.refresh(root) == 0
+
+    probe_dir = root / "subject1" / "session1" / "probe_3"
+    probe_dir.mkdir()
+    (probe_dir / "probe_3_g0_t0.imec.ap.meta").write_text("meta")
+    _touch_dir(probe_dir)
+    _touch_dir(probe_dir.parent)
+
+    assert index.refresh(root) == 2  # session1 and the new probe_3
+    assert len(index.glob(root, "*.ap.meta")) == 3
+
+
+def test_scan_index_removed_directories(tmp_path):
+    root = tmp_path / "root"
+    _make_tree(root)
+    index = ScanIndex(tmp_path / "index.sqlite")
+    index.refresh(root)
+
+    session_dir = root / "subject1" / "session1"
+    for meta_file in (session_dir / "probe_2").iterdir():
+        meta_file.unlink()
+    (session_dir / "probe_2").rmdir()
+    _touch_dir(session_dir)
+
+    index.refresh(root)
+    assert index.glob(root, "*.ap.meta") == sorted(root.rglob("*.ap.meta"))
+    assert index.find_full_path(root, "subject1/session1/probe_2") is None
+
+
+def test_scan_index_find_full_path(tmp_path):
+    roots = [tmp_path / "root1", tmp_path / "root2"]
+    _make_tree(roots[1])
+    index = ScanIndex(tmp_path / "index.sqlite")
+    for root in roots:
+        root.mkdir(exist_ok=True)
+        index.refresh(root)
+
+    assert index.find_full_path(roots, "subject1/session1") == (
+        roots[1] / "subject1/session1"
+    )
+    assert index.find_full_path(roots, "subject1/session1/probe_1/") == (
+        roots[1] / "subject1/session1/probe_1"
+    )
+    assert index.find_full_path(roots, "subject3") is None
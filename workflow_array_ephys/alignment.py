@@ -0,0 +1,470 @@
+"""Array routines for aligning spike trains to behavioral events
+
+These helpers operate on NumPy arrays only and are used by the `analysis` schema.
+Aligned spikes are kept in a CSR-style layout: one flat array of spike times for all
+trials plus an index of trial offsets, so a unit is aligned with a few vectorized
+calls instead of one boolean mask per trial.
+"""
+
+import itertools
+import multiprocessing
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def align_spike_times(
+    spike_times: np.ndarray, event_times: np.ndarray, min_limit: float, max_limit: float
+) -> tuple:
+    """Align the spike train of one unit to every event at once
+
+    Each trial window spans [event - min_limit, event + max_limit). Spike times are
+    sorted once (if needed) and window boundaries are located with `np.searchsorted`.
+
+    Args:
+        spike_times (np.ndarray): (s) spike times of one unit
+        event_times (np.ndarray): (s) alignment event time of each trial
+        min_limit (float): (s) window extent before the event
+        max_limit (float): (s) window extent after the event
+
+    Returns:
+        aligned_spikes (np.ndarray): (s) spike times relative to their alignment event,
+            concatenated across trials
+        trial_offsets (np.ndarray): (n_trials + 1) offsets into `aligned_spikes`.
+            Spikes of trial i are aligned_spikes[trial_offsets[i]:trial_offsets[i+1]]
+    """
+    spike_times = np.asarray(spike_times)
+    event_times = np.asarray(event_times, dtype=float)
+
+    if np.any(np.diff(spike_times) < 0):
+        spike_times = np.sort(spike_times, kind="stable")
+
+    window_starts = np.searchsorted(spike_times, event_times - min_limit, side="left")
+    window_ends = np.searchsorted(spike_times, event_times + max_limit, side="left")
+    spike_counts = np.maximum(window_ends - window_starts, 0)
+
+    trial_offsets = np.zeros(len(event_times) + 1, dtype=np.int64)
+    np.cumsum(spike_counts, out=trial_offsets[1:])
+
+    spike_indices = np.arange(trial_offsets[-1]) + np.repeat(
+        window_starts - trial_offsets[:-1], spike_counts
+    )
+    aligned_spikes = spike_times[spike_indices] - np.repeat(event_times, spike_counts)
+
+    return aligned_spikes, trial_offsets
+
+
+def get_alignment_windows(
+    trial_starts: np.ndarray,
+    trial_stops: np.ndarray,
+    alignment_event_times: np.ndarray,
+    start_event_times: np.ndarray,
+    end_event_times: np.ndarray,
+    time_shifts: tuple = (0.0, 0.0, 0.0),
+) -> tuple:
+    """Alignment event and window of every trial, located with `np.searchsorted`
+
+    Follows `trial.get_trialized_alignment_event_times` of element-event, for all
+    trials at once: the alignment event is the last one within the trial, the window
+    starts at the last start event before it (at the earliest at the trial start) and
+    ends at the first end event after it (at the latest at the trial stop).
+
+    Args:
+        trial_starts (np.ndarray): (s) start time of each trial
+        trial_stops (np.ndarray): (s) stop time of each trial
+        alignment_event_times (np.ndarray): (s) sorted times of the alignment events
+        start_event_times (np.ndarray): (s) sorted times of the window start events
+        end_event_times (np.ndarray): (s) sorted times of the window end events
+        time_shifts (tuple, optional): (s) shifts added to the window start, the
+            alignment event and the window end. Defaults to no shift.
+
+    Returns:
+        starts (np.ndarray): (s) window start of each trial, NaN without an alignment
+            event in the trial
+        events (np.ndarray): (s) alignment event time of each trial, or NaN
+        ends (np.ndarray): (s) window end of each trial, or NaN
+    """
+    trial_starts = np.asarray(trial_starts, dtype=float)
+    trial_stops = np.asarray(trial_stops, dtype=float)
+    alignment_event_times = np.asarray(alignment_event_times, dtype=float)
+    start_event_times = np.asarray(start_event_times, dtype=float)
+    end_event_times = np.asarray(end_event_times, dtype=float)
+
+    event_indices = np.searchsorted(alignment_event_times, trial_stops, "right") - 1
+    events = np.full(len(trial_starts), np.nan)
+    has_event = event_indices >= 0
+    events[has_event] = alignment_event_times[event_indices[has_event]]
+    events[events < trial_starts] = np.nan
+
+    start_indices = np.searchsorted(start_event_times, events, "left") - 1
+    has_start = (start_indices >= 0) & ~np.isnan(events)
+    starts = trial_starts.copy()
+    starts[has_start] = np.maximum(
+        start_event_times[start_indices[has_start]], trial_starts[has_start]
+    )
+
+    end_indices = np.searchsorted(end_event_times, events, "right")
+    has_end = (end_indices < len(end_event_times)) & ~np.isnan(events)
+    ends = trial_stops.copy()
+    ends[has_end] = np.minimum(
+        end_event_times[end_indices[has_end]], trial_stops[has_end]
+    )
+
+    is_aligned = ~np.isnan(events)
+    starts[~is_aligned] = ends[~is_aligned] = np.nan
+    start_shift, event_shift, end_shift = time_shifts
+    return starts + start_shift, events + event_shift, ends + end_shift
+
+
+def split_trials(aligned_spikes: np.ndarray, trial_offsets: np.ndarray) -> list:
+    """Split CSR-style aligned spikes into one array per trial
+
+    Args:
+        aligned_spikes (np.ndarray): (s) aligned spike times concatenated across trials
+        trial_offsets (np.ndarray): (n_trials + 1) offsets into `aligned_spikes`
+
+    Returns:
+        aligned_spikes (list): one array of aligned spike times per trial
+    """
+    return np.split(aligned_spikes, trial_offsets[1:-1])
+
+
+class AlignedSpikes(Sequence):
+    """Read-only sequence of per-trial aligned spikes backed by a CSR-style layout
+
+    Per-trial arrays are sliced from the flat array on access, without copying.
+
+    Args:
+        aligned_spikes (np.ndarray): (s) aligned spike times concatenated across trials
+        trial_offsets (np.ndarray): (n_trials + 1) offsets into `aligned_spikes`
+    """
+
+    def __init__(self, aligned_spikes: np.ndarray, trial_offsets: np.ndarray):
+        self.aligned_spikes = aligned_spikes
+        self.trial_offsets = trial_offsets
+
+    def __len__(self):
+        return len(self.trial_offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trial index out of range")
+        return self.aligned_spikes[
+            self.trial_offsets[index] : self.trial_offsets[index + 1]
+        ]
+
+
+def compute_psth_counts(
+    aligned_spikes: np.ndarray, min_limit: float, max_limit: float, bin_size: float
+) -> tuple:
+    """Count the aligned spikes of one unit in PSTH bins, summed over trials
+
+    Args:
+        aligned_spikes (np.ndarray): (s) aligned spike times concatenated across trials
+        min_limit (float): (s) window extent before the event
+        max_limit (float): (s) window extent after the event
+        bin_size (float): (s) PSTH bin size
+
+    Returns:
+        spike_counts (np.ndarray): spike count of each bin
+        bin_edges (np.ndarray): (s) all (n_bins + 1) bin edges
+    """
+    return np.histogram(aligned_spikes, bins=np.arange(-min_limit, max_limit, bin_size))
+
+
+def compute_psth(
+    aligned_spikes: np.ndarray,
+    trial_count: int,
+    min_limit: float,
+    max_limit: float,
+    bin_size: float,
+) -> tuple:
+    """Compute the trial-averaged firing rate of one unit
+
+    Args:
+        aligned_spikes (np.ndarray): (s) aligned spike times concatenated across trials
+        trial_count (int): number of trials the spikes were collected from
+        min_limit (float): (s) window extent before the event
+        max_limit (float): (s) window extent after the event
+        bin_size (float): (s) PSTH bin size
+
+    Returns:
+        psth (np.ndarray): (spikes/s) event-aligned peristimulus time histogram
+        psth_edges (np.ndarray): (s) PSTH bin edges, without the first edge
+    """
+    spike_counts, bin_edges = compute_psth_counts(
+        aligned_spikes, min_limit, max_limit, bin_size
+    )
+    return spike_counts / trial_count / bin_size, bin_edges[1:]
+
+
+def bin_trial_spikes(
+    aligned_spikes: np.ndarray, trial_offsets: np.ndarray, bin_edges: np.ndarray
+) -> tuple:
+    """Count the aligned spikes of one unit in each trial and PSTH bin, in sparse form
+
+    Bins follow `np.histogram`: each includes its left edge, and the last bin also
+    includes the right edge, so summing over trials gives `compute_psth_counts`.
+
+    Args:
+        aligned_spikes (np.ndarray): (s) aligned spike times concatenated across trials
+        trial_offsets (np.ndarray): (n_trials + 1) offsets into `aligned_spikes`
+        bin_edges (np.ndarray): (s) all (n_bins + 1) bin edges
+
+    Returns:
+        flat_indices (np.ndarray): sorted flat indices of non-zero counts into the
+            (n_trials, n_bins) count matrix
+        spike_counts (np.ndarray): non-zero spike counts
+    """
+    bin_count = len(bin_edges) - 1
+    if bin_count < 1:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    bin_indices = np.searchsorted(bin_edges, aligned_spikes, side="right") - 1
+    bin_indices[aligned_spikes == bin_edges[-1]] = bin_count - 1
+    trial_indices = np.repeat(np.arange(len(trial_offsets) - 1), np.diff(trial_offsets))
+    in_range = (bin_indices >= 0) & (bin_indices < bin_count)
+
+    return np.unique(
+        trial_indices[in_range] * bin_count + bin_indices[in_range], return_counts=True
+    )
+
+
+def merge_psths(spike_counts, trial_counts, bin_size: float) -> tuple:
+    """Pool PSTHs computed on the same bins from their counts
+
+    The pooled rate is the mean over every (unit, trial) pair of the inputs, e.g. the
+    PSTH of one unit across conditions or the population PSTH across units.
+
+    Args:
+        spike_counts (array-like): (n_psths, n_bins) spike counts summed over trials
+        trial_counts (array-like): (n_psths,) number of trials of each PSTH
+        bin_size (float): (s) PSTH bin size
+
+    Returns:
+        psth (np.ndarray): (spikes/s) pooled PSTH
+        spike_counts (np.ndarray): spike count of each bin, summed over the inputs
+        trial_count (int): total number of trials
+    """
+    spike_counts = np.sum(np.asarray(spike_counts, dtype=np.int64), axis=0)
+    trial_count = int(np.sum(trial_counts))
+    return spike_counts / trial_count / bin_size, spike_counts, trial_count
+
+
+def iter_aligned_units(
+    unit_spike_times, event_times: np.ndarray, min_limit, max_limit, bin_size
+):
+    """Align units one at a time
+
+    Args:
+        unit_spike_times (list): (s) spike times of each unit
+        event_times (np.ndarray): (s) alignment event time of each trial
+        min_limit (float): (s) window extent before the event
+        max_limit (float): (s) window extent after the event
+        bin_size (float): (s) PSTH bin size
+
+    Yields:
+        aligned_unit (tuple): aligned_spikes, trial_offsets, spike_counts and bin_edges
+            of one unit, see `align_spike_times` and `compute_psth_counts`
+    """
+    for spike_times in unit_spike_times:
+        aligned_spikes, trial_offsets = align_spike_times(
+            spike_times, event_times, min_limit, max_limit
+        )
+        spike_counts, bin_edges = compute_psth_counts(
+            aligned_spikes, min_limit, max_limit, bin_size
+        )
+        yield aligned_spikes, trial_offsets, spike_counts, bin_edges
+
+
+def iter_aligned_units_parallel(
+    unit_spike_times,
+    event_times: np.ndarray,
+    min_limit,
+    max_limit,
+    bin_size,
+    n_workers: int,
+    units_per_task: int = 8,
+):
+    """Align units across worker processes, yielding results in unit order
+
+    Spike trains and event times are copied once into shared memory, which the workers
+    read without pickling. At most two tasks per worker are in flight, so memory for
+    results stays bounded.
+
+    Args:
+        unit_spike_times (list): (s) spike times of each unit
+        event_times (np.ndarray): (s) alignment event time of each trial
+        min_limit (float): (s) window extent before the event
+        max_limit (float): (s) window extent after the event
+        bin_size (float): (s) PSTH bin size
+        n_workers (int): number of worker processes
+        units_per_task (int, optional): units aligned per task. Defaults to 8.
+
+    Yields:
+        aligned_unit (tuple): see `iter_aligned_units`
+    """
+    unit_offsets = np.zeros(len(unit_spike_times) + 1, dtype=np.int64)
+    np.cumsum([len(spikes) for spikes in unit_spike_times], out=unit_offsets[1:])
+
+    shared = []
+    try:
+        spikes_shm, spikes_descriptor = _create_shared_array(
+            (unit_offsets[-1],), np.float64
+        )
+        shared.append(spikes_shm)
+        _, all_spikes = _attach_shared_array(spikes_descriptor, spikes_shm)
+        for spikes, start, stop in zip(
+            unit_spike_times, unit_offsets[:-1], unit_offsets[1:]
+        ):
+            all_spikes[start:stop] = spikes
+        del all_spikes
+
+        descriptors = [spikes_descriptor]
+        for array in (unit_offsets, np.asarray(event_times, dtype=np.float64)):
+            shm, descriptor = _create_shared_array(array.shape, array.dtype)
+            shared.append(shm)
+            _, shared_array = _attach_shared_array(descriptor, shm)
+            shared_array[:] = array
+            del shared_array
+            descriptors.append(descriptor)
+
+        tasks = (
+            (first_unit, min(first_unit + units_per_task, len(unit_spike_times)))
+            for first_unit in range(0, len(unit_spike_times), units_per_task)
+        )
+        with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+
+            def submit(task):
+                return executor.submit(
+                    _align_shared_units,
+                    *descriptors,
+                    *task,
+                    min_limit,
+                    max_limit,
+                    bin_size,
+                )
+
+            pending = deque(
+                submit(task) for task in itertools.islice(tasks, 2 * n_workers)
+            )
+            while pending:
+                aligned_units = pending.popleft().result()
+                pending.extend(submit(task) for task in itertools.islice(tasks, 1))
+                yield from aligned_units
+    finally:
+        for shm in shared:
+            shm.close()
+            shm.unlink()
+
+
+def _create_shared_array(shape: tuple, dtype) -> tuple:
+    """Allocate a shared memory block sized for an array
+
+    Returns:
+        shm (shared_memory.SharedMemory): the block. The caller must unlink it.
+        descriptor (tuple): name, shape and dtype, to attach from other processes
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    return shm, (shm.name, tuple(int(n) for n in shape), dtype.str)
+
+
+def _attach_shared_array(descriptor: tuple, shm=None) -> tuple:
+    """Map an array onto a shared memory block, without copying
+
+    Returns:
+        shm (shared_memory.SharedMemory): the block. Delete the array before closing.
+        array (np.ndarray): array backed by the block
+    """
+    name, shape, dtype = descriptor
+    shm = shm or shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _align_shared_units(
+    spikes_descriptor,
+    unit_offsets_descriptor,
+    event_times_descriptor,
+    first_unit,
+    last_unit,
+    min_limit,
+    max_limit,
+    bin_size,
+) -> list:
+    """Align units [first_unit, last_unit) read from shared memory. Runs in a worker."""
+    blocks, arrays = zip(
+        *(
+            _attach_shared_array(descriptor)
+            for descriptor in (
+                spikes_descriptor,
+                unit_offsets_descriptor,
+                event_times_descriptor,
+            )
+        )
+    )
+    all_spikes, unit_offsets, event_times = arrays
+    try:
+        return list(
+            iter_aligned_units(
+                (
+                    all_spikes[unit_offsets[unit] : unit_offsets[unit + 1]]
+                    for unit in range(first_unit, last_unit)
+                ),
+                event_times,
+                min_limit,
+                max_limit,
+                bin_size,
+            )
+        )
+    finally:
+        del arrays, all_spikes, unit_offsets, event_times
+        for shm in blocks:
+            shm.close()
+
+
+def smooth_psth(
+    psth: np.ndarray, bin_size: float, kernel: str = "none", sigma: float = 0.0
+) -> np.ndarray:
+    """Smooth a PSTH with a Gaussian kernel
+
+    The output has the bins of the input, even for kernels wider than the PSTH. Near
+    the edges, each bin is normalized by the weight of the kernel within the PSTH, so
+    that edges are not biased towards zero.
+
+    Args:
+        psth (np.ndarray): (spikes/s) peristimulus time histogram
+        bin_size (float): (s) PSTH bin size
+        kernel (str, optional): 'none', 'gaussian' (centered) or 'causal' (half-Gaussian
+            weighting only past and current bins). Defaults to 'none'.
+        sigma (float, optional): (s) standard deviation of the kernel. Defaults to 0.
+
+    Returns:
+        psth (np.ndarray): (spikes/s) smoothed PSTH
+    """
+    if kernel == "none" or sigma <= 0 or not len(psth):
+        return psth
+    if kernel not in ("gaussian", "causal"):
+        raise ValueError(f"Unknown smoothing kernel: {kernel}")
+
+    half_width = min(int(np.ceil(4 * sigma / bin_size)), len(psth) - 1)
+    lags = np.arange(-half_width, half_width + 1) * bin_size
+    weights = np.exp(-0.5 * (lags / sigma) ** 2)
+    if kernel == "causal":
+        weights[lags < 0] = 0
+
+    # "full" convolution sliced back to the input bins, around the kernel center
+    centered = slice(half_width, half_width + len(psth))
+    smoothed = np.convolve(psth, weights, mode="full")[centered]
+    coverage = np.convolve(np.ones(len(psth)), weights, mode="full")[centered]
+    return smoothed / coverage
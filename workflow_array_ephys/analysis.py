@@ -1,11 +1,16 @@
+import hashlib
 import importlib
 import inspect
+from collections import OrderedDict
+from datetime import datetime, timezone
 
 import datajoint as dj
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.figure import Figure
 
+from . import alignment
+
 schema = dj.schema()
 
 _linking_module = None
@@ -33,6 +38,10 @@ def activate(
     global _linking_module
     _linking_module = linking_module
 
+    cache_size = dj.config.get("custom", {}).get("analysis.cache_size")
+    if cache_size is not None:
+        set_cache_size(cache_size)
+
     schema.activate(
         schema_name,
         create_schema=create_schema,
@@ -41,6 +50,558 @@ def activate(
     )
 
 
+# ---------------- In-process cache of fetched inputs ----------------
+
+
+class _LRUCache:
+    """Bounded mapping that evicts the least recently used entry
+
+    Args:
+        maxsize (int): maximum number of entries kept. 0 disables caching.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, cache_key):
+        if cache_key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(cache_key)
+            return self._entries[cache_key]
+        self.misses += 1
+        return None
+
+    def put(self, cache_key, value):
+        self._entries[cache_key] = value
+        self._entries.move_to_end(cache_key)
+        self.evict()
+
+    def evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+_caches = {
+    # spike trains of every unit of one ephys.CuratedClustering entry
+    "spike_times": _LRUCache(maxsize=4),
+    # sorted trial and per-event-type times of one session
+    "trial_event_index": _LRUCache(maxsize=16),
+    # aligned spikes of every unit of one SpikesAlignment entry
+    "aligned_spikes": _LRUCache(maxsize=4),
+}
+
+
+def cache_info() -> dict:
+    """Return hit/miss counters and occupancy of the analysis caches
+
+    Returns:
+        info (dict): For each cache, a dict with `hits`, `misses`, `size`, `maxsize`
+    """
+    return {name: cache.info() for name, cache in _caches.items()}
+
+
+def clear_cache():
+    """Empty the analysis caches and reset their counters"""
+    for cache in _caches.values():
+        cache.clear()
+
+
+def set_cache_size(maxsize):
+    """Set the number of entries each analysis cache may hold
+
+    Also configurable as `dj.config["custom"]["analysis.cache_size"]`, read when the
+    schema is activated.
+
+    Args:
+        maxsize (int or dict): entries per cache, or a dict of cache name to entries
+    """
+    if not isinstance(maxsize, dict):
+        maxsize = {name: maxsize for name in _caches}
+    for name, size in maxsize.items():
+        _caches[name].maxsize = int(size)
+        _caches[name].evict()
+
+
+def _fetch_unit_spike_times(key: dict) -> tuple:
+    """Fetch unit keys and spike times of the clustering referenced by key
+
+    Spike trains are reused across conditions of the same clustering. The cache key
+    includes server-side checksums of the `spike_times` blobs, so entries are never
+    stale even if the clustering is re-populated.
+
+    Args:
+        key (dict): key identifying (at least) one ephys.CuratedClustering entry
+
+    Returns:
+        unit_keys (np.ndarray): unit keys ordered by unit
+        unit_spike_times (np.ndarray): spike times of each unit
+    """
+    ephys = _linking_module.ephys
+    clustering_key = {k: key[k] for k in ephys.CuratedClustering.primary_key}
+
+    checksums = (
+        (ephys.CuratedClustering.Unit & clustering_key)
+        .proj(spike_times_checksum="MD5(spike_times)")
+        .fetch("spike_times_checksum", order_by="unit")
+    )
+    cache_key = (
+        tuple(sorted(clustering_key.items())),
+        hashlib.md5("".join(checksums).encode()).hexdigest(),
+    )
+
+    cached = _caches["spike_times"].get(cache_key)
+    if cached is None:
+        cached = (ephys.CuratedClustering.Unit & clustering_key).fetch(
+            "KEY", "spike_times", order_by="unit"
+        )
+        _caches["spike_times"].put(cache_key, cached)
+    return cached
+
+
+def _fetch_trial_event_index(session_key: dict) -> dict:
+    """Fetch the trial and event times of a session as sorted arrays
+
+    The index is fetched with one query per table and cached, so that every
+    AlignmentEvent and trial subset of the session reuses it. The cache key includes
+    server-side checksums of the trial and event times, so trials or events that are
+    added, removed or edited are fetched again.
+
+    Args:
+        session_key (dict): key identifying one session
+
+    Returns:
+        trial_event_index (dict): "trial_ids", "trial_starts" and "trial_stops" ordered
+            by trial_id, and "event_times", a dict of the sorted event times of each
+            event type
+    """
+    trial, event = _linking_module.trial, _linking_module.event
+    session = _linking_module.Session & session_key
+    checksums = tuple(
+        session.aggr(
+            table,
+            row_count="COUNT(*)",
+            checksum=f"BIT_XOR(CRC32(CONCAT_WS(',', {attributes})))",
+            keep_all_rows=True,
+        ).fetch1("row_count", "checksum")
+        for table, attributes in (
+            (trial.Trial, "trial_id, trial_start_time, trial_stop_time"),
+            (event.Event, "event_type, event_start_time"),
+        )
+    )
+    cache_key = (tuple(sorted(session_key.items())), checksums)
+
+    trial_event_index = _caches["trial_event_index"].get(cache_key)
+    if trial_event_index is None:
+        trial_ids, trial_starts, trial_stops = (trial.Trial & session_key).fetch(
+            "trial_id", "trial_start_time", "trial_stop_time", order_by="trial_id"
+        )
+        event_types, event_times = (event.Event & session_key).fetch(
+            "event_type", "event_start_time"
+        )
+        trial_event_index = {
+            "trial_ids": trial_ids,
+            "trial_starts": trial_starts.astype(float),
+            "trial_stops": trial_stops.astype(float),
+            "event_times": _group_event_times(event_types, event_times),
+        }
+        _caches["trial_event_index"].put(cache_key, trial_event_index)
+    return trial_event_index
+
+
+def _group_event_times(event_types, event_times) -> dict:
+    """Sorted event times of each event type
+
+    Grouped in numpy rather than by the database's ORDER BY, whose case-insensitive
+    collation does not sort event types as numpy does.
+
+    Args:
+        event_types (array-like): event type of each event
+        event_times (array-like): (s) start time of each event
+
+    Returns:
+        event_times (dict): sorted event times of each event type
+    """
+    types, type_indices = np.unique(np.asarray(event_types), return_inverse=True)
+    event_times = np.asarray(event_times, dtype=float)
+    order = np.lexsort((event_times, type_indices))
+    type_starts = np.searchsorted(type_indices[order], np.arange(1, len(types)))
+    return dict(zip(types.tolist(), np.split(event_times[order], type_starts)))
+
+
+def _fetch_trialized_event_times(key: dict) -> dict:
+    """Fetch alignment windows of the trials of one SpikesAlignmentCondition
+
+    Windows are computed for all trials at once from the cached trial event index of
+    the session, see `alignment.get_alignment_windows`.
+
+    Args:
+        key (dict): key identifying one SpikesAlignmentCondition
+
+    Returns:
+        trialized_event_times (dict): "session_key", the "trial_ids" of the condition
+            and the (s) "start", "event" and "end" times of their windows, NaN for
+            trials without an alignment event
+    """
+    event = _linking_module.event
+    session_key = {k: key[k] for k in _linking_module.Session.primary_key}
+    alignment_spec = (event.AlignmentEvent & key).fetch1()
+    index = _fetch_trial_event_index(session_key)
+
+    is_condition_trial = np.isin(
+        index["trial_ids"], (SpikesAlignmentCondition.Trial & key).fetch("trial_id")
+    )
+    no_events = np.array([], dtype=float)
+    starts, events, ends = alignment.get_alignment_windows(
+        index["trial_starts"][is_condition_trial],
+        index["trial_stops"][is_condition_trial],
+        index["event_times"].get(alignment_spec["alignment_event_type"], no_events),
+        index["event_times"].get(alignment_spec["start_event_type"], no_events),
+        index["event_times"].get(alignment_spec["end_event_type"], no_events),
+        (
+            alignment_spec["start_time_shift"],
+            alignment_spec["alignment_time_shift"],
+            alignment_spec["end_time_shift"],
+        ),
+    )
+    return {
+        "session_key": session_key,
+        "trial_ids": index["trial_ids"][is_condition_trial],
+        "start": starts,
+        "event": events,
+        "end": ends,
+    }
+
+
+def _get_alignment_window(trialized_event_times: dict) -> tuple:
+    """Alignment events and common window extent of a set of trials
+
+    Trials without an alignment event are left out.
+
+    Args:
+        trialized_event_times (dict): see `_fetch_trialized_event_times`
+
+    Returns:
+        trial_keys (list): keys of the trials with an alignment event
+        event_times (np.ndarray): (s) alignment event time of these trials
+        min_limit (float): (s) window extent before the event, across all trials
+        max_limit (float): (s) window extent after the event, across all trials
+    """
+    event_times = trialized_event_times["event"]
+    is_aligned = ~np.isnan(event_times)
+    if not is_aligned.any():
+        return [], event_times[is_aligned], np.nan, np.nan
+
+    min_limit = (event_times - trialized_event_times["start"])[is_aligned].max()
+    max_limit = (trialized_event_times["end"] - event_times)[is_aligned].max()
+    trial_keys = [
+        {**trialized_event_times["session_key"], "trial_id": trial_id}
+        for trial_id in trialized_event_times["trial_ids"][is_aligned].tolist()
+    ]
+
+    return trial_keys, event_times[is_aligned], min_limit, max_limit
+
+
+def _fetch_aligned_spikes(key: dict) -> tuple:
+    """Fetch the aligned spikes of every unit of one SpikesAlignment
+
+    Works with either raster layout. The cache key includes server-side checksums of
+    the aligned spikes blobs, so recomputed entries are fetched again.
+
+    Args:
+        key (dict): key identifying one SpikesAlignment
+
+    Returns:
+        unit_keys (list): unit keys ordered by unit
+        unit_aligned_spikes (list): (s) aligned spike times of each unit, concatenated
+            across trials
+        trial_count (int): number of aligned trials
+    """
+    alignment_key = (SpikesAlignment & key).fetch1("KEY")
+    checksums = tuple(
+        (SpikesAlignment & alignment_key)
+        .aggr(
+            part,
+            row_count="COUNT(*)",
+            checksum="BIT_XOR(CRC32(aligned_spike_times))",
+            keep_all_rows=True,
+        )
+        .fetch1("row_count", "checksum")
+        for part in (
+            SpikesAlignment.AlignedTrialSpikes,
+            SpikesAlignment.AlignedUnitSpikes,
+        )
+    )
+    cache_key = (tuple(sorted(alignment_key.items())), checksums)
+
+    cached = _caches["aligned_spikes"].get(cache_key)
+    if cached is not None:
+        return cached
+
+    unit_spikes = SpikesAlignment.AlignedUnitSpikes & alignment_key
+    if unit_spikes:
+        unit_keys, trial_ids, unit_aligned_spikes = unit_spikes.fetch(
+            "KEY", "trial_ids", "aligned_spike_times", order_by="unit"
+        )
+        trial_count = len(trial_ids[0])
+    else:
+        units, unit_trial_spikes = (
+            SpikesAlignment.AlignedTrialSpikes & alignment_key
+        ).fetch("unit", "aligned_spike_times", order_by="unit, trial_id")
+        unit_ids, unit_starts, trial_counts = np.unique(
+            units, return_index=True, return_counts=True
+        )
+        unit_keys = [{**alignment_key, "unit": unit} for unit in unit_ids]
+        unit_aligned_spikes = [
+            np.concatenate(unit_trial_spikes[start : start + count])
+            for start, count in zip(unit_starts, trial_counts)
+        ]
+        trial_count = trial_counts[0] if len(trial_counts) else 0
+
+    cached = list(unit_keys), list(unit_aligned_spikes), int(trial_count)
+    _caches["aligned_spikes"].put(cache_key, cached)
+    return cached
+
+
+# ---------------- Streaming insert of aligned spikes ----------------
+
+
+def _get_insert_batch_size() -> int:
+    """Rows per insert statement, see dj.config["custom"]["analysis.insert_batch_size"]
+
+    Returns:
+        batch_size (int): maximum number of rows per insert. Defaults to 10000.
+    """
+    return int(dj.config.get("custom", {}).get("analysis.insert_batch_size", 10000))
+
+
+def _get_insert_batch_spikes() -> int:
+    """Aligned spikes per insert statement, see
+    dj.config["custom"]["analysis.insert_batch_spikes"]
+
+    Returns:
+        batch_spikes (int): aligned spikes after which an insert is sent. Defaults to
+            5,000,000 (40 MB of float64 spike times).
+    """
+    return int(
+        dj.config.get("custom", {}).get("analysis.insert_batch_spikes", 5_000_000)
+    )
+
+
+def _get_n_workers() -> int:
+    """Worker processes aligning units, see dj.config["custom"]["analysis.n_workers"]
+
+    Returns:
+        n_workers (int): number of worker processes. Defaults to 1 (no workers).
+    """
+    return int(dj.config.get("custom", {}).get("analysis.n_workers", 1))
+
+
+def _iter_aligned_spikes_rows(
+    key: dict,
+    unit_keys,
+    aligned_units,
+    trial_keys,
+    bin_size: float,
+    raster_layout: str,
+    unit_psths: list,
+    insert_tensor_row=None,
+):
+    """Yield the aligned spikes rows of units as they are aligned
+
+    Only the spikes and spike counts of the unit being processed are held in memory.
+    The UnitPSTH row of each unit is appended to `unit_psths`, and its
+    SpikeCountTensor row is passed to `insert_tensor_row`, as the unit is processed.
+
+    Args:
+        key (dict): key identifying one SpikesAlignmentCondition
+        unit_keys (list): unit keys
+        aligned_units (iterable): aligned spikes, trial offsets, PSTH counts and bin
+            edges of each unit, see `alignment.iter_aligned_units`
+        trial_keys (list): keys of the aligned trials
+        bin_size (float): (s) PSTH bin size
+        raster_layout (str): 'trial' or 'unit', see SpikesAlignmentCondition
+        unit_psths (list): receives the UnitPSTH row of each unit
+        insert_tensor_row (callable, optional): called with the SpikeCountTensor row
+            of each unit, see `_spike_count_tensor_row`. Defaults to None (no tensor).
+
+    Yields:
+        row (dict): one AlignedTrialSpikes row, or one AlignedUnitSpikes row per unit
+    """
+    trial_ids = np.array([trial_key["trial_id"] for trial_key in trial_keys])
+
+    for unit_key, (aligned_spikes, trial_offsets, spike_counts, bin_edges) in zip(
+        unit_keys, aligned_units
+    ):
+        unit_psths.append(
+            {
+                **key,
+                **unit_key,
+                "psth": spike_counts / len(trial_keys) / bin_size,
+                "psth_edges": bin_edges[1:],
+                "psth_counts": spike_counts.astype(np.int32),
+                "trial_count": len(trial_keys),
+                "psth_bin_edges": bin_edges.astype(np.float32),
+            }
+        )
+        if insert_tensor_row is not None:
+            insert_tensor_row(
+                _spike_count_tensor_row(
+                    key,
+                    unit_key,
+                    trial_ids,
+                    bin_edges,
+                    alignment.bin_trial_spikes(
+                        aligned_spikes, trial_offsets, bin_edges
+                    ),
+                )
+            )
+
+        if raster_layout == "unit":
+            yield {
+                **key,
+                **unit_key,
+                "trial_ids": trial_ids,
+                "trial_offsets": trial_offsets,
+                "aligned_spike_times": aligned_spikes.astype(np.float32),
+            }
+        else:
+            for trial_key, start, stop in zip(
+                trial_keys, trial_offsets[:-1], trial_offsets[1:]
+            ):
+                yield {
+                    **key,
+                    **unit_key,
+                    **trial_key,
+                    "aligned_spike_times": aligned_spikes[start:stop],
+                }
+
+
+def _insert_in_batches(
+    table, rows, batch_size: int, batch_spikes: int = None, **insert_kwargs
+) -> int:
+    """Insert rows from an iterable, at most batch_size rows per statement
+
+    An AlignedUnitSpikes row holds the spikes of a unit in every trial, so a batch of
+    rows is also ended once its rows hold `batch_spikes` aligned spikes. A row with
+    more spikes than that is inserted on its own.
+
+    Args:
+        table (dj.Table): table to insert into
+        rows (iterable): rows to insert, consumed lazily
+        batch_size (int): maximum number of rows held in memory and sent at once
+        batch_spikes (int, optional): aligned spikes after which a batch is sent.
+            Defaults to None (batches are bounded by rows only).
+        insert_kwargs (dict): passed on to `table.insert`
+
+    Returns:
+        row_count (int): number of rows inserted
+    """
+    row_count = 0
+    batch, spike_count = [], 0
+    for row in rows:
+        batch.append(row)
+        spike_count += len(row.get("aligned_spike_times", ()))
+        if len(batch) >= batch_size or (
+            batch_spikes is not None and spike_count >= batch_spikes
+        ):
+            table.insert(batch, **insert_kwargs)
+            row_count += len(batch)
+            batch, spike_count = [], 0
+    if batch:
+        table.insert(batch, **insert_kwargs)
+        row_count += len(batch)
+    return row_count
+
+
+def _spike_count_tensor_row(
+    key: dict, unit_key: dict, trial_ids, bin_edges: np.ndarray, bin_counts: tuple
+) -> dict:
+    """Assemble the sparse (trials, bins) spike count matrix of one unit
+
+    Args:
+        key (dict): key identifying one SpikesAlignment
+        unit_key (dict): unit key
+        trial_ids (array-like): trial ids, along the first axis
+        bin_edges (np.ndarray): (s) all bin edges, along the second axis
+        bin_counts (tuple): flat indices and values of the non-zero counts, see
+            `alignment.bin_trial_spikes`
+
+    Returns:
+        row (dict): SpikesAlignment.SpikeCountTensor row
+    """
+    flat_indices, spike_counts = bin_counts
+    cell_count = len(trial_ids) * (len(bin_edges) - 1)
+
+    return {
+        **key,
+        **unit_key,
+        "trial_ids": np.asarray(trial_ids),
+        "bin_edges": np.asarray(bin_edges, dtype=np.float32),
+        "count_indices": np.asarray(flat_indices).astype(
+            np.uint32 if cell_count <= 2**32 else np.int64
+        ),
+        "spike_counts": np.asarray(spike_counts).astype(
+            np.int16 if np.max(spike_counts, initial=0) <= 2**15 - 1 else np.int32
+        ),
+    }
+
+
+def _append_trials_to_tensor(tensor_row: dict, new_tensor_row: dict) -> dict:
+    """Concatenate two SpikeCountTensor rows of the same unit along the trial axis
+
+    Counts are stored in C order, so the flat indices of the new trials follow those
+    of the stored trials once offset by the number of stored cells.
+
+    Args:
+        tensor_row (dict): stored SpikesAlignment.SpikeCountTensor row
+        new_tensor_row (dict): row of the new trials, see `_spike_count_tensor_row`
+
+    Returns:
+        row (dict): SpikesAlignment.SpikeCountTensor row with the new trials appended
+    """
+    if not np.array_equal(tensor_row["bin_edges"], new_tensor_row["bin_edges"]):
+        raise ValueError("Spike count tensors to concatenate differ in bins")
+
+    bin_count = len(tensor_row["bin_edges"]) - 1
+    trial_ids = np.concatenate([tensor_row["trial_ids"], new_tensor_row["trial_ids"]])
+    count_indices = np.concatenate(
+        [
+            tensor_row["count_indices"].astype(np.int64),
+            new_tensor_row["count_indices"].astype(np.int64)
+            + len(tensor_row["trial_ids"]) * bin_count,
+        ]
+    )
+    spike_counts = np.concatenate(
+        [tensor_row["spike_counts"], new_tensor_row["spike_counts"]]
+    )
+
+    return {
+        **tensor_row,
+        "trial_ids": trial_ids,
+        "count_indices": count_indices.astype(
+            np.uint32 if len(trial_ids) * bin_count <= 2**32 else np.int64
+        ),
+        "spike_counts": spike_counts.astype(
+            np.int16 if spike_counts.max(initial=0) <= 2**15 - 1 else np.int32
+        ),
+    }
+
+
 @schema
 class SpikesAlignmentCondition(dj.Manual):
     """Alignment activity table
@@ -52,6 +613,9 @@ class SpikesAlignmentCondition(dj.Manual):
         condition_description ( varchar(1000), nullable): condition description
         bin_size (float, optional): Bin-size (in second) used to compute the PSTH
             Default 0.04
+        raster_layout (enum, optional): Storage layout of the aligned spikes. 'trial'
+            (default) stores one AlignedTrialSpikes row per unit and trial, 'unit'
+            stores one compact AlignedUnitSpikes row per unit.
     """
 
     definition = """
@@ -61,6 +625,7 @@ class SpikesAlignmentCondition(dj.Manual):
     ---
     condition_description='': varchar(1000)
     bin_size=0.04: float # bin-size (in second) used to compute the PSTH
+    raster_layout='trial': enum('trial', 'unit') # storage layout of aligned spikes
     """
 
     class Trial(dj.Part):
@@ -74,10 +639,19 @@ class SpikesAlignmentCondition(dj.Manual):
 
 @schema
 class SpikesAlignment(dj.Computed):
-    """Spike alignment table pairing AlignedTrialSpikes and by-unit PSTH"""
+    """Spike alignment table pairing AlignedTrialSpikes and by-unit PSTH
+
+    Attributes:
+        SpikesAlignmentCondition (foreign key): SpikesAlignmentCondition primary key
+        min_limit (double, nullable): (s) window extent before the event, across trials
+        max_limit (double, nullable): (s) window extent after the event, across trials
+    """
 
     definition = """
     -> SpikesAlignmentCondition
+    ---
+    min_limit=null: double  # (s) window extent before the event, across trials
+    max_limit=null: double  # (s) window extent after the event, across trials
     """
 
     class AlignedTrialSpikes(dj.Part):
@@ -98,6 +672,31 @@ class SpikesAlignment(dj.Computed):
         aligned_spike_times: longblob # (s) spike times relative to alignment event time
         """
 
+    class AlignedUnitSpikes(dj.Part):
+        """Aligned spike activity of all trials of a unit, in a compact ragged layout
+
+        Used instead of AlignedTrialSpikes when the condition's raster_layout is 'unit'.
+        Spikes of the i-th trial are
+        aligned_spike_times[trial_offsets[i]:trial_offsets[i + 1]].
+
+        Attributes:
+            SpikesAlignment (foreign key): SpikesAlignment foreign key
+            ephys.CuratedClustering.Unit (foreign key): Unit foreign key
+            trial_ids (longblob): trial_id of each trial, in order
+            trial_offsets (longblob): (n_trials + 1) offsets into aligned_spike_times
+            aligned_spike_times (longblob): (s) float32 spike times relative to the
+                alignment event, concatenated across trials
+        """
+
+        definition = """
+        -> master
+        -> ephys.CuratedClustering.Unit
+        ---
+        trial_ids: longblob  # trial_id of each trial, in order
+        trial_offsets: longblob  # (n_trials + 1) offsets into aligned_spike_times
+        aligned_spike_times: longblob  # (s) float32, concatenated across trials
+        """
+
     class UnitPSTH(dj.Part):
         """Event-aligned spike peristimulus time histogram (PSTH) by unit
 
@@ -106,6 +705,11 @@ class SpikesAlignment(dj.Computed):
             ephys.CuratedClustering.Unit (foreign key): Unit foreign key
             psth (longblob): event-aligned spike peristimulus time histogram (PSTH)
             psth_edges (longblob): set of PSTH edges
+            psth_counts (longblob, nullable): int32 spike count of each bin, summed
+                over trials
+            trial_count (int, nullable): number of trials
+            psth_bin_edges (longblob, nullable): (s) float32 bin edges, including the
+                first edge
         """
 
         definition = """
@@ -114,73 +718,380 @@ class SpikesAlignment(dj.Computed):
         ---
         psth: longblob  # event-aligned spike peristimulus time histogram (PSTH)
         psth_edges: longblob
+        psth_counts=null: longblob  # int32 spike count of each bin, summed over trials
+        trial_count=null: int  # number of trials
+        psth_bin_edges=null: longblob  # (s) float32 (n_bins + 1) bin edges
+        """
+
+    class SpikeCountTensor(dj.Part):
+        """Spike counts of one unit in every trial and PSTH bin, in sparse form
+
+        Counts of the unit's (trials, bins) matrix are stored as the flat (C-order)
+        indices and values of its non-zero entries, one row per unit so that units are
+        written as they are aligned. Use SpikesAlignment.fetch_spike_count_tensor to get
+        the dense (units, trials, bins) tensor.
+
+        Attributes:
+            SpikesAlignment (foreign key): SpikesAlignment foreign key
+            ephys.CuratedClustering.Unit (foreign key): Unit foreign key
+            trial_ids (longblob): trial_id along the first axis
+            bin_edges (longblob): (s) float32 bin edges along the second axis
+            count_indices (longblob): flat indices of the non-zero counts
+            spike_counts (longblob): int16 (int32 if needed) non-zero spike counts
+        """
+
+        definition = """
+        -> master
+        -> ephys.CuratedClustering.Unit
+        ---
+        trial_ids: longblob  # trial_id along the first axis
+        bin_edges: longblob  # (s) float32 (n_bins + 1) bin edges along the second axis
+        count_indices: longblob  # flat indices of the non-zero counts
+        spike_counts: longblob  # int16 (int32 if needed) non-zero spike counts
         """
 
     def make(self, key: dict):
-        """Populate SpikesAlignment, AlignedTrialSpikes and UnitPSTH
+        """Populate SpikesAlignment and its part tables
 
         Args:
             key (dict): Dict uniquely identifying one SpikesAlignmentCondition
         """
-        unit_keys, unit_spike_times = (
-            _linking_module.ephys.CuratedClustering.Unit & key
-        ).fetch("KEY", "spike_times", order_by="unit")
-        bin_size = (SpikesAlignmentCondition & key).fetch1("bin_size")
+        unit_keys, unit_spike_times = _fetch_unit_spike_times(key)
+        bin_size, raster_layout = (SpikesAlignmentCondition & key).fetch1(
+            "bin_size", "raster_layout"
+        )
+        trial_keys, event_times, min_limit, max_limit = _get_alignment_window(
+            _fetch_trialized_event_times(key)
+        )
+
+        self.insert1({**key, "min_limit": min_limit, "max_limit": max_limit})
+        self._insert_aligned_units(
+            key,
+            unit_keys,
+            unit_spike_times,
+            trial_keys,
+            event_times,
+            (min_limit, max_limit),
+            bin_size,
+            raster_layout,
+        )
 
-        trialized_event_times = (
-            _linking_module.trial.get_trialized_alignment_event_times(
-                key,
-                _linking_module.trial.Trial & (SpikesAlignmentCondition.Trial & key),
+    def _insert_aligned_units(
+        self,
+        key: dict,
+        unit_keys,
+        unit_spike_times,
+        trial_keys,
+        event_times: np.ndarray,
+        window: tuple,
+        bin_size: float,
+        raster_layout: str,
+    ):
+        """Align every unit and insert the part table rows, one unit at a time
+
+        Args:
+            key (dict): key of the SpikesAlignment entry, already inserted
+            unit_keys (list): unit keys
+            unit_spike_times (list): (s) spike times of each unit
+            trial_keys (list): keys of the aligned trials
+            event_times (np.ndarray): (s) alignment event time of each trial
+            window (tuple): (s) window extent before and after the event
+            bin_size (float): (s) PSTH bin size
+            raster_layout (str): 'trial' or 'unit', see SpikesAlignmentCondition
+        """
+        min_limit, max_limit = window
+
+        # Spike raster, PSTH and spike counts, streamed one unit at a time
+        n_workers = _get_n_workers()
+        if n_workers > 1:
+            aligned_units = alignment.iter_aligned_units_parallel(
+                unit_spike_times, event_times, min_limit, max_limit, bin_size, n_workers
+            )
+        else:
+            aligned_units = alignment.iter_aligned_units(
+                unit_spike_times, event_times, min_limit, max_limit, bin_size
             )
+        unit_psths = []
+        aligned_spikes_rows = _iter_aligned_spikes_rows(
+            key,
+            unit_keys,
+            aligned_units,
+            trial_keys,
+            bin_size,
+            raster_layout,
+            unit_psths,
+            self.SpikeCountTensor.insert1,
         )
 
-        min_limit = (trialized_event_times.event - trialized_event_times.start).max()
-        max_limit = (trialized_event_times.end - trialized_event_times.event).max()
+        _insert_in_batches(
+            (
+                self.AlignedUnitSpikes
+                if raster_layout == "unit"
+                else self.AlignedTrialSpikes
+            ),
+            aligned_spikes_rows,
+            _get_insert_batch_size(),
+            _get_insert_batch_spikes(),
+        )
+        self.UnitPSTH.insert(unit_psths)
 
-        # Spike raster
-        aligned_trial_spikes = []
-        units_spike_raster = {
-            u["unit"]: {**key, **u, "aligned_spikes": []} for u in unit_keys
-        }
-        for _, r in trialized_event_times.iterrows():
-            if np.isnan(r.event):
-                continue
-            alignment_start_time = r.event - min_limit
-            alignment_end_time = r.event + max_limit
-            for unit_key, spikes in zip(unit_keys, unit_spike_times):
-                aligned_spikes = (
-                    spikes[
-                        (alignment_start_time <= spikes) & (spikes < alignment_end_time)
-                    ]
-                    - r.event
-                )
-                aligned_trial_spikes.append(
-                    {
-                        **key,
-                        **unit_key,
-                        **r.trial_key,
-                        "aligned_spike_times": aligned_spikes,
-                    }
-                )
-                units_spike_raster[unit_key["unit"]]["aligned_spikes"].append(
-                    aligned_spikes
+    def update_trials(self, key: dict) -> int:
+        """Align trials added to a SpikesAlignmentCondition after it was populated
+
+        Only the new trials are aligned. UnitPSTH is updated from the stored bin counts
+        and trial count, without reading the stored rasters. With the 'unit' raster
+        layout, the compact row of each unit is rewritten with the new trials appended.
+        SpikeCountTensor gets the new trials appended. Downstream BinnedPSTH and
+        SpikesAlignmentFigure entries are deleted and must be re-populated.
+
+        Args:
+            key (dict): key of one SpikesAlignment entry
+
+        Returns:
+            trial_count (int): number of trials added
+
+        Raises:
+            ValueError: The trials changed in a way that requires a full recompute:
+                trials were removed, or new trials change the stored alignment
+                window limits.
+        """
+        key = (self & key).fetch1("KEY")
+        bin_size, raster_layout = (SpikesAlignmentCondition & key).fetch1(
+            "bin_size", "raster_layout"
+        )
+        trial_keys, event_times, min_limit, max_limit = _get_alignment_window(
+            _fetch_trialized_event_times(key)
+        )
+
+        units, psths, psth_counts, psth_edges = (self.UnitPSTH & key).fetch(
+            "unit", "psth", "psth_counts", "psth_edges"
+        )
+        # Entries populated before the limits were stored (NULL, fetched as NaN)
+        # compare the bin edges instead
+        stored_limits = (self & key).fetch1("min_limit", "max_limit")
+        if not np.isnan(stored_limits).any():
+            window_changed = stored_limits != (min_limit, max_limit)
+        else:
+            window_changed = len(units) and not np.array_equal(
+                psth_edges[0], np.arange(-min_limit, max_limit, bin_size)[1:]
+            )
+        if window_changed:
+            raise ValueError(
+                f"New trials change the alignment window of {key}."
+                + " Delete and re-populate this SpikesAlignment entry instead."
+            )
+
+        if raster_layout == "unit":
+            stored_trial_ids = (self.AlignedUnitSpikes & key).fetch(
+                "trial_ids", limit=1
+            )
+            stored_trial_ids = stored_trial_ids[0] if len(stored_trial_ids) else []
+        else:
+            stored_trial_ids = (
+                dj.U("trial_id") & (self.AlignedTrialSpikes & key)
+            ).fetch("trial_id")
+        stored_trial_ids = set(stored_trial_ids)
+
+        is_new_trial = np.array(
+            [trial_key["trial_id"] not in stored_trial_ids for trial_key in trial_keys],
+            dtype=bool,
+        )
+        if len(trial_keys) - is_new_trial.sum() != len(stored_trial_ids):
+            raise ValueError(
+                f"Trials were removed from {key}."
+                + " Delete and re-populate this SpikesAlignment entry instead."
+            )
+        if not is_new_trial.any():
+            return 0
+
+        new_trial_keys = [k for k, is_new in zip(trial_keys, is_new_trial) if is_new]
+        unit_keys, unit_spike_times = _fetch_unit_spike_times(key)
+        new_unit_psths = []
+        aligned_spikes_rows = _iter_aligned_spikes_rows(
+            key,
+            unit_keys,
+            alignment.iter_aligned_units(
+                unit_spike_times,
+                event_times[is_new_trial],
+                min_limit,
+                max_limit,
+                bin_size,
+            ),
+            new_trial_keys,
+            bin_size,
+            raster_layout,
+            new_unit_psths,
+            self._append_to_tensor_row,
+        )
+
+        with self.connection.transaction:
+            if raster_layout == "unit":
+                aligned_spikes_rows = self._append_to_unit_rows(aligned_spikes_rows)
+            _insert_in_batches(
+                (
+                    self.AlignedUnitSpikes
+                    if raster_layout == "unit"
+                    else self.AlignedTrialSpikes
+                ),
+                aligned_spikes_rows,
+                _get_insert_batch_size(),
+                _get_insert_batch_spikes(),
+                allow_direct_insert=True,
+            )
+
+            # Trial-averaged rate from summed bin counts. Entries populated before
+            # counts were stored recover them from the rate and trial count.
+            trial_count = len(stored_trial_ids) + len(new_trial_keys)
+            stored_counts = {
+                unit: np.rint(psth * len(stored_trial_ids) * bin_size)
+                if counts is None
+                else counts
+                for unit, psth, counts in zip(units, psths, psth_counts)
+            }
+            for unit_psth in new_unit_psths:
+                spike_counts = (
+                    stored_counts[unit_psth["unit"]] + unit_psth["psth_counts"]
+                ).astype(np.int32)
+                unit_psth.update(
+                    psth=spike_counts / trial_count / bin_size,
+                    psth_counts=spike_counts,
+                    trial_count=trial_count,
                 )
 
-        # PSTH
-        for unit_spike_raster in units_spike_raster.values():
-            spikes = np.concatenate(unit_spike_raster["aligned_spikes"])
+            (self.UnitPSTH & key).delete_quick()
+            self.UnitPSTH.insert(new_unit_psths, allow_direct_insert=True)
+            (BinnedPSTH & key).delete(transaction=False, safemode=False)
+            (SpikesAlignmentFigure & key).delete(transaction=False, safemode=False)
+
+        return len(new_trial_keys)
+
+    def _append_to_tensor_row(self, new_tensor_row: dict):
+        """Replace the stored SpikeCountTensor row of a unit with new trials appended
+
+        Units stored without a SpikeCountTensor row are left without one. Call within
+        a transaction.
+        """
+        stored_row = self.SpikeCountTensor & {
+            k: new_tensor_row[k] for k in self.SpikeCountTensor.primary_key
+        }
+        if stored_row:
+            tensor_row = _append_trials_to_tensor(stored_row.fetch1(), new_tensor_row)
+            stored_row.delete_quick()
+            self.SpikeCountTensor.insert1(tensor_row, allow_direct_insert=True)
+
+    def _append_to_unit_rows(self, aligned_unit_spikes_rows):
+        """Merge AlignedUnitSpikes rows of new trials into the stored rows
 
-            psth, edges = np.histogram(
-                spikes, bins=np.arange(-min_limit, max_limit, bin_size)
+        Yields:
+            row (dict): AlignedUnitSpikes row with the new trials appended. The stored
+                row is deleted; call within a transaction.
+        """
+        for row in aligned_unit_spikes_rows:
+            stored_row = self.AlignedUnitSpikes & {
+                k: row[k] for k in self.AlignedUnitSpikes.primary_key
+            }
+            trial_ids, trial_offsets, aligned_spikes = stored_row.fetch1(
+                "trial_ids", "trial_offsets", "aligned_spike_times"
             )
-            unit_spike_raster["psth"] = (
-                psth / len(unit_spike_raster.pop("aligned_spikes")) / bin_size
+            stored_row.delete_quick()
+            yield {
+                **row,
+                "trial_ids": np.concatenate([trial_ids, row["trial_ids"]]),
+                "trial_offsets": np.concatenate(
+                    [trial_offsets, row["trial_offsets"][1:] + trial_offsets[-1]]
+                ),
+                "aligned_spike_times": np.concatenate(
+                    [aligned_spikes, row["aligned_spike_times"]]
+                ),
+            }
+
+    def fetch_spike_count_tensor(self, key: dict, mmap_path=None) -> tuple:
+        """Fetch the spike counts of every unit, trial and bin as a dense array
+
+        Args:
+            key (dict): key of one SpikesAlignment entry
+            mmap_path (str, optional): if given, the tensor is written to this .npy
+                file and returned memory-mapped. Defaults to None (in-memory array).
+
+        Returns:
+            spike_counts (np.ndarray): (n_units, n_trials, n_bins) spike counts
+            units (np.ndarray): unit id along the first axis
+            trial_ids (np.ndarray): trial_id along the second axis
+            bin_edges (np.ndarray): (s) (n_bins + 1) bin edges along the third axis
+
+        Raises:
+            ValueError: The entry was populated without spike count tensor rows
+        """
+        key = (self & key).fetch1("KEY")
+        dtype = np.int32  # counts of some units may not fit the int16 of others
+
+        if mmap_path is None:
+            # Every unit in one query
+            units, unit_trial_ids, unit_bin_edges, unit_indices, unit_counts = (
+                self.SpikeCountTensor & key
+            ).fetch(
+                "unit",
+                "trial_ids",
+                "bin_edges",
+                "count_indices",
+                "spike_counts",
+                order_by="unit",
             )
-            unit_spike_raster["psth_edges"] = edges[1:]
+            if not len(units):
+                raise ValueError(f"No spike count tensor stored for {key}")
+            trial_ids, bin_edges = unit_trial_ids[0], unit_bin_edges[0]
+            spike_counts = np.zeros(
+                (len(units), len(trial_ids), len(bin_edges) - 1), dtype=dtype
+            )
+            for unit_index, (count_indices, counts) in enumerate(
+                zip(unit_indices, unit_counts)
+            ):
+                spike_counts[unit_index].reshape(-1)[count_indices] = counts
+            return spike_counts, units, trial_ids, bin_edges
 
-        self.insert1(key)
-        self.AlignedTrialSpikes.insert(aligned_trial_spikes)
-        self.UnitPSTH.insert(list(units_spike_raster.values()))
+        units = (self.SpikeCountTensor & key).fetch("unit", order_by="unit")
+        if not len(units):
+            raise ValueError(f"No spike count tensor stored for {key}")
+        trial_ids, bin_edges = (
+            self.SpikeCountTensor & key & {"unit": units[0]}
+        ).fetch1("trial_ids", "bin_edges")
+        spike_counts = np.lib.format.open_memmap(
+            mmap_path,
+            mode="w+",
+            dtype=dtype,
+            shape=(len(units), len(trial_ids), len(bin_edges) - 1),
+        )
+        for unit_index, unit in enumerate(units):  # one unit in memory at a time
+            count_indices, counts = (
+                self.SpikeCountTensor & key & {"unit": unit}
+            ).fetch1("count_indices", "spike_counts")
+            spike_counts[unit_index].reshape(-1)[count_indices] = counts
+        spike_counts.flush()
+
+        return spike_counts, units, trial_ids, bin_edges
+
+    def fetch_aligned_spikes(self, key: dict, unit: int) -> tuple:
+        """Fetch the aligned spikes of one unit, whichever raster layout was used
+
+        Args:
+            key (dict): key of SpikesAlignmentCondition master table
+            unit (int): ID of ephys.CuratedClustering.Unit table
+
+        Returns:
+            trial_ids (np.ndarray): trial_id of each trial
+            aligned_spikes (Sequence): (s) aligned spike times of each trial. For the
+                'unit' layout, per-trial arrays are sliced lazily on access.
+        """
+        unit_spikes = self.AlignedUnitSpikes & key & {"unit": unit}
+        if unit_spikes:
+            trial_ids, trial_offsets, aligned_spikes = unit_spikes.fetch1(
+                "trial_ids", "trial_offsets", "aligned_spike_times"
+            )
+            return trial_ids, alignment.AlignedSpikes(aligned_spikes, trial_offsets)
+
+        return (self.AlignedTrialSpikes & key & {"unit": unit}).fetch(
+            "trial_id", "aligned_spike_times", order_by="trial_id"
+        )
 
     def plot(self, key: dict, unit: int, axs: tuple = None) -> Figure:
         """Plot event-aligned and trial-averaged spiking
@@ -201,22 +1112,353 @@ class SpikesAlignment(dj.Computed):
             fig, axs = plt.subplots(2, 1, figsize=(12, 8))
 
         bin_size = (SpikesAlignmentCondition & key).fetch1("bin_size")
-        trial_ids, aligned_spikes = (
-            self.AlignedTrialSpikes & key & {"unit": unit}
-        ).fetch("trial_id", "aligned_spike_times")
+        trial_ids, aligned_spikes = self.fetch_aligned_spikes(key, unit)
         psth, psth_edges = (self.UnitPSTH & key & {"unit": unit}).fetch1(
             "psth", "psth_edges"
         )
 
-        xlim = psth_edges[0], psth_edges[-1]
-
-        plot_psth._plot_spike_raster(
+        plot_psth._plot_unit(
+            axs,
+            trial_ids,
             aligned_spikes,
-            trial_ids=trial_ids,
-            ax=axs[0],
+            psth,
+            psth_edges,
+            bin_size,
             title=f"{dict(**key, unit=unit)}",
-            xlim=xlim,
         )
-        plot_psth._plot_psth(psth, psth_edges, bin_size, ax=axs[1], title="", xlim=xlim)
 
         return fig
+
+    def plot_units(
+        self,
+        key: dict,
+        output_path: str,
+        units: list = None,
+        file_format: str = "pdf",
+        n_workers: int = None,
+    ) -> list:
+        """Plot event-aligned and trial-averaged spiking of many units to files
+
+        The rasters and PSTHs of all units are fetched in one query each, instead of
+        one query per unit and table as with `plot`.
+
+        Args:
+            key (dict): key of one SpikesAlignment entry
+            output_path (str): multi-page PDF file, or directory of PNG files
+            units (list, optional): IDs of ephys.CuratedClustering.Unit to plot.
+                Defaults to all units.
+            file_format (str, optional): "pdf" or "png". Defaults to "pdf".
+            n_workers (int, optional): worker processes rendering PNG files. Defaults
+                to dj.config["custom"]["analysis.n_workers"].
+
+        Returns:
+            file_paths (list): written PDF file or PNG files
+        """
+        from .plotting import plot_psth
+
+        bin_size, unit_figures = self.fetch_unit_figure_data(key, units)
+
+        return plot_psth.plot_units(
+            unit_figures,
+            bin_size,
+            output_path,
+            file_format=file_format,
+            n_workers=n_workers or _get_n_workers(),
+        )
+
+    def fetch_unit_figure_data(self, key: dict, units: list = None) -> tuple:
+        """Fetch what is plotted for many units, in one query per table
+
+        Args:
+            key (dict): key of one SpikesAlignment entry
+            units (list, optional): IDs of ephys.CuratedClustering.Unit to fetch.
+                Defaults to all units.
+
+        Returns:
+            bin_size (float): (s) PSTH bin size
+            unit_figures (list): one dict per unit with "unit", "title", "trial_ids",
+                "aligned_spikes", "psth" and "psth_edges", see `plot_psth.plot_units`
+        """
+        key = (self & key).fetch1("KEY")
+        unit_restriction = [{"unit": unit} for unit in units] if units else {}
+        bin_size = (SpikesAlignmentCondition & key).fetch1("bin_size")
+
+        unit_spikes = self.AlignedUnitSpikes & key & unit_restriction
+        if unit_spikes:
+            unit_ids, unit_trial_ids, trial_offsets, aligned_spikes = unit_spikes.fetch(
+                "unit",
+                "trial_ids",
+                "trial_offsets",
+                "aligned_spike_times",
+                order_by="unit",
+            )
+            unit_aligned_spikes = [
+                alignment.AlignedSpikes(spikes, offsets)
+                for spikes, offsets in zip(aligned_spikes, trial_offsets)
+            ]
+        else:
+            spike_units, trial_ids, trial_spikes = (
+                self.AlignedTrialSpikes & key & unit_restriction
+            ).fetch(
+                "unit", "trial_id", "aligned_spike_times", order_by="unit, trial_id"
+            )
+            unit_ids, unit_starts = np.unique(spike_units, return_index=True)
+            unit_ends = np.append(unit_starts[1:], len(spike_units))
+            unit_trial_ids = [trial_ids[a:b] for a, b in zip(unit_starts, unit_ends)]
+            unit_aligned_spikes = [
+                trial_spikes[a:b] for a, b in zip(unit_starts, unit_ends)
+            ]
+
+        psths, psth_edges = (self.UnitPSTH & key & unit_restriction).fetch(
+            "psth", "psth_edges", order_by="unit"
+        )
+
+        return bin_size, [
+            {
+                "unit": unit,
+                "title": f"{dict(**key, unit=unit)}",
+                "trial_ids": trial_ids,
+                "aligned_spikes": aligned_spikes,
+                "psth": psth,
+                "psth_edges": edges,
+            }
+            for unit, trial_ids, aligned_spikes, psth, edges in zip(
+                unit_ids, unit_trial_ids, unit_aligned_spikes, psths, psth_edges
+            )
+        ]
+
+
+_FIGURE_FORMATS = ("png", "svg")
+
+
+def _get_figure_formats() -> tuple:
+    """Figure formats, see dj.config["custom"]["analysis.figure_formats"]
+
+    Returns:
+        file_formats (tuple): "png" and/or "svg". Defaults to "png" only.
+    """
+    file_formats = dj.config.get("custom", {}).get("analysis.figure_formats", "png")
+    if isinstance(file_formats, str):
+        file_formats = (file_formats,)
+    unknown_formats = set(file_formats) - set(_FIGURE_FORMATS)
+    if unknown_formats:
+        raise ValueError(f"Unknown figure formats: {sorted(unknown_formats)}")
+    return tuple(file_formats)
+
+
+@schema
+class SpikesAlignmentFigure(dj.Computed):
+    """Rendered raster and PSTH figure of each unit of a SpikesAlignment
+
+    Figures are rendered once in bulk so that viewers fetch image bytes instead of
+    fetching the rasters and re-rendering. Entries are deleted along with their
+    SpikesAlignment entry, and by `SpikesAlignment.update_trials`, and are re-rendered
+    by populate. Formats are set by dj.config["custom"]["analysis.figure_formats"].
+
+    Attributes:
+        SpikesAlignment (foreign key): SpikesAlignment foreign key
+        execution_time (datetime): time the figures were rendered
+    """
+
+    definition = """
+    -> SpikesAlignment
+    ---
+    execution_time: datetime  # time the figures were rendered
+    """
+
+    class Unit(dj.Part):
+        """Rendered figure of one unit
+
+        Attributes:
+            SpikesAlignmentFigure (foreign key): SpikesAlignmentFigure foreign key
+            ephys.CuratedClustering.Unit (foreign key): Unit foreign key
+            png (longblob, optional): PNG image bytes
+            svg (longblob, optional): SVG image bytes
+        """
+
+        definition = """
+        -> master
+        -> ephys.CuratedClustering.Unit
+        ---
+        png=null: longblob  # PNG image bytes
+        svg=null: longblob  # SVG image bytes
+        """
+
+    def make(self, key: dict):
+        """Render the figure of every unit of one SpikesAlignment
+
+        Args:
+            key (dict): Dict uniquely identifying one SpikesAlignment
+        """
+        from .plotting import plot_psth
+
+        file_formats = _get_figure_formats()
+        bin_size, unit_figures = SpikesAlignment().fetch_unit_figure_data(key)
+        execution_time = datetime.now(timezone.utc)
+
+        unit_rows = [{**key, "unit": unit["unit"]} for unit in unit_figures]
+        for file_format in file_formats:
+            for row, figure in zip(
+                unit_rows,
+                plot_psth.render_unit_figures(unit_figures, bin_size, file_format),
+            ):
+                row[file_format] = figure
+
+        self.insert1({**key, "execution_time": execution_time})
+        self.Unit.insert(unit_rows)
+
+    @classmethod
+    def fetch_figure(cls, key: dict, unit: int, file_format: str = "png") -> bytes:
+        """Fetch the rendered figure of one unit
+
+        Args:
+            key (dict): key of one SpikesAlignment entry
+            unit (int): ID of ephys.CuratedClustering.Unit table
+            file_format (str, optional): "png" or "svg". Defaults to "png".
+
+        Returns:
+            figure (bytes): image bytes
+        """
+        if file_format not in _FIGURE_FORMATS:
+            raise ValueError(f"Unknown figure format: {file_format}")
+        return (cls.Unit & key & {"unit": unit}).fetch1(file_format)
+
+
+@schema
+class PSTHParameters(dj.Lookup):
+    """Bin size and smoothing used to compute a PSTH from aligned spikes
+
+    Attributes:
+        psth_param_id (smallint): unique id of the PSTH parameter set
+        bin_size (float): (s) PSTH bin size
+        smoothing (enum, optional): 'none' (default), 'gaussian' (centered) or 'causal'
+            (half-Gaussian, weighting only past and current bins)
+        smoothing_sigma (float, optional): (s) standard deviation of the kernel
+        psth_param_description ( varchar(1000), optional ): description
+    """
+
+    definition = """
+    psth_param_id: smallint
+    ---
+    bin_size: float # (s) bin size of the PSTH
+    smoothing='none': enum('none', 'gaussian', 'causal') # smoothing kernel
+    smoothing_sigma=0: float # (s) standard deviation of the smoothing kernel
+    psth_param_description='': varchar(1000)
+    """
+
+    contents = [
+        (0, 0.01, "none", 0, "10 ms bins"),
+        (1, 0.04, "none", 0, "40 ms bins"),
+        (2, 0.2, "none", 0, "200 ms bins"),
+    ]
+
+
+@schema
+class BinnedPSTH(dj.Computed):
+    """PSTH of each unit of a SpikesAlignment at other bin sizes and smoothing
+
+    Computed from the aligned spikes stored by SpikesAlignment, so adding a resolution
+    only histograms the existing raster.
+    """
+
+    definition = """
+    -> SpikesAlignment
+    -> PSTHParameters
+    """
+
+    class Unit(dj.Part):
+        """Event-aligned PSTH of one unit
+
+        Attributes:
+            BinnedPSTH (foreign key): BinnedPSTH foreign key
+            ephys.CuratedClustering.Unit (foreign key): Unit foreign key
+            psth (longblob): (spikes/s) event-aligned PSTH
+            psth_edges (longblob): (s) PSTH bin edges, without the first edge
+        """
+
+        definition = """
+        -> master
+        -> ephys.CuratedClustering.Unit
+        ---
+        psth: longblob  # (spikes/s) event-aligned PSTH
+        psth_edges: longblob  # (s) PSTH bin edges, without the first edge
+        """
+
+    def make(self, key: dict):
+        """Populate BinnedPSTH from the aligned spikes of SpikesAlignment
+
+        Args:
+            key (dict): Dict uniquely identifying one SpikesAlignment and PSTHParameters
+
+        Raises:
+            ValueError: The SpikesAlignment entry has no stored window limits
+        """
+        bin_size, smoothing, smoothing_sigma = (PSTHParameters & key).fetch1(
+            "bin_size", "smoothing", "smoothing_sigma"
+        )
+        # The window the raster was aligned with, not that of the current trials
+        min_limit, max_limit = (SpikesAlignment & key).fetch1("min_limit", "max_limit")
+        if np.isnan([min_limit, max_limit]).any():
+            raise ValueError(
+                f"SpikesAlignment {key} has no stored alignment window."
+                + " Re-populate it first."
+            )
+        unit_keys, unit_aligned_spikes, trial_count = _fetch_aligned_spikes(key)
+
+        unit_psths = []
+        for unit_key, aligned_spikes in zip(unit_keys, unit_aligned_spikes):
+            psth, psth_edges = alignment.compute_psth(
+                aligned_spikes, trial_count, min_limit, max_limit, bin_size
+            )
+            unit_psths.append(
+                {
+                    **key,
+                    **unit_key,
+                    "psth": alignment.smooth_psth(
+                        psth, bin_size, smoothing, smoothing_sigma
+                    ),
+                    "psth_edges": psth_edges,
+                }
+            )
+
+        self.insert1(key)
+        self.Unit.insert(unit_psths)
+
+
+def pool_unit_psth(restriction) -> tuple:
+    """Pool SpikesAlignment.UnitPSTH entries from their stored bin counts
+
+    For example, the PSTH of one unit across conditions, or the population PSTH of a
+    probe or of several sessions. All entries must share the same bins.
+
+    Args:
+        restriction: restriction on SpikesAlignment.UnitPSTH selecting entries to pool
+
+    Returns:
+        psth (np.ndarray): (spikes/s) mean PSTH over every pooled (unit, trial) pair
+        psth_edges (np.ndarray): (s) PSTH bin edges, without the first edge, as in
+            SpikesAlignment.UnitPSTH
+
+    Raises:
+        ValueError: The entries do not share the same bins or predate stored counts
+    """
+    psth_counts, trial_counts, bin_edges, bin_sizes = (
+        SpikesAlignment.UnitPSTH * SpikesAlignmentCondition & restriction
+    ).fetch("psth_counts", "trial_count", "psth_bin_edges", "bin_size")
+
+    if not len(psth_counts):
+        raise ValueError(f"No UnitPSTH entries match {restriction}")
+    if any(counts is None for counts in psth_counts):
+        raise ValueError(
+            "Some UnitPSTH entries have no stored counts. Re-populate them first."
+        )
+    if any(
+        len(edges) != len(bin_edges[0]) or not np.allclose(edges, bin_edges[0])
+        for edges in bin_edges
+    ):
+        raise ValueError("UnitPSTH entries to pool must share the same bins")
+
+    psth, _, _ = alignment.merge_psths(
+        np.stack(psth_counts), trial_counts, bin_sizes[0]
+    )
+    return psth, bin_edges[0][1:].astype(float)
@@ -1,15 +1,25 @@
 import csv
+import hashlib
+import itertools
+import json
 import logging
+import pathlib
 import re
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from element_array_ephys.readers import openephys, spikeglx
 from element_interface.utils import (
-    find_full_path,
     find_root_directory,
     ingest_csv_to_table,
 )
 
-from workflow_array_ephys.paths import get_ephys_root_data_dir
+from workflow_array_ephys.paths import (
+    find_ephys_path,
+    get_ephys_root_data_dir,
+    get_scan_index,
+    refresh_scan_index,
+)
 from workflow_array_ephys.pipeline import (
     ephys,
     event,
@@ -21,6 +31,13 @@ from workflow_array_ephys.pipeline import (
     trial,
 )
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet as parquet
+except ImportError:  # optional, for Parquet and Feather inputs
+    pyarrow = parquet = None
+
 logger = logging.getLogger("datajoint")
 
 
@@ -130,15 +147,38 @@ def ingest_subjects(
 
 
 def ingest_sessions(
-    session_csv_path: str = "./user_data/sessions.csv", verbose: bool = True, **_
+    session_csv_path: str = "./user_data/sessions.csv",
+    verbose: bool = True,
+    n_workers: int = 1,
+    incremental: bool = True,
+    chunk_size: int = None,
+    checkpoint_path: str = None,
+    **_,
 ):
     """Ingest SpikeGLX and OpenEphys files from directories listed in csv
 
+    Sessions are scanned and inserted in chunks of `chunk_size` csv rows. The entries
+    of each chunk are inserted in one transaction, so a failure leaves the sessions of
+    the previous chunks committed and none of the failed chunk. A rerun resumes after
+    the last committed chunk, tracked by the checkpoint file or, in incremental mode,
+    by session.SessionDirectory.
+
     Args:
         session_csv_path (str, optional): List of sessions.
             Defaults to "./user_data/sessions.csv".
         verbose (bool, optional): Print number inserted (i.e., table length change).
             Defaults to True.
+        n_workers (int, optional): Threads scanning session directories and parsing
+            recording metadata concurrently. Defaults to 1 (serial).
+        incremental (bool, optional): Skip rows whose session directory is already in
+            session.SessionDirectory before scanning the file system. Defaults to
+            True.
+        chunk_size (int, optional): csv rows scanned and inserted per transaction.
+            Defaults to None (all rows in one transaction).
+        checkpoint_path (str, optional): JSON file recording the csv rows committed,
+            whose rows are skipped by the next run on the same csv. The checkpoint
+            also records a checksum of these rows and is discarded if they were
+            edited since. Defaults to None (no checkpoint).
 
     Raises:
         FileNotFoundError: Neither SpikeGLX nor OpenEphys recording files found in dir
@@ -150,124 +190,373 @@ def ingest_sessions(
     with open(session_csv_path, newline="") as f:
         input_sessions = list(csv.DictReader(f, delimiter=","))
 
-    # Folder structure: root / subject / session / probe / .ap.meta
-    (session_list, session_dir_list) = ([], [])
-    session_note_list, session_experimenter_list, lab_user_list = [], [], []
-    probe_list, probe_insertion_list = [], []
+    committed_rows = _read_checkpoint(checkpoint_path, session_csv_path, input_sessions)
+    root_dirs = get_ephys_root_data_dir()
+    ingested_dirs = _get_ingested_session_dirs() if incremental else set()
+    pending_rows = [
+        row
+        for row in range(committed_rows, len(input_sessions))
+        if _normalize_session_dir(input_sessions[row]["session_dir"], root_dirs)
+        not in ingested_dirs
+    ]
+    if verbose:
+        logger.info(
+            f"---- Skipping {len(input_sessions) - len(pending_rows)} of "
+            + f"{len(input_sessions)} session(s) already ingested ----"
+        )
+    if not pending_rows:
+        return
+
+    refresh_scan_index()
+
+    # Existence checks against hash sets fetched once, instead of one query each
+    known_probes = set(probe.Probe.fetch("probe"))
+    known_sessions = set(zip(*session.Session.fetch("subject", "session_datetime")))
+    existence_checks = 0
+    insert_counts = dict.fromkeys(
+        ["session.Session", "probe.Probe", "ephys.ProbeInsertion"], 0
+    )
 
-    for this_session in input_sessions:
-        session_dir = find_full_path(
-            get_ephys_root_data_dir(), this_session["session_dir"]
+    chunk_size = chunk_size or max(len(pending_rows), 1)
+    for chunk_start in range(0, len(pending_rows), chunk_size):
+        chunk_rows = pending_rows[chunk_start : chunk_start + chunk_size]
+        chunk_sessions = [input_sessions[row] for row in chunk_rows]
+        entries, chunk_checks = _get_session_entries(
+            chunk_sessions,
+            discover_sessions(chunk_sessions, n_workers=n_workers),
+            known_probes,
+            known_sessions,
         )
-        session_datetimes, insertions = [], []
+        existence_checks += chunk_checks
 
-        # search session dir and determine acquisition software
-        for ephys_pattern, ephys_acq_type in zip(
-            ["*.ap.meta", "*.oebin"], ["SpikeGLX", "OpenEphys"]
-        ):
-            ephys_meta_filepaths = [fp for fp in session_dir.rglob(ephys_pattern)]
-            if len(ephys_meta_filepaths):
-                acq_software = ephys_acq_type
-                break
-        else:
-            raise FileNotFoundError(
-                "Ephys recording data not found! Neither SpikeGLX "
-                + "nor OpenEphys recording files found in: "
-                + f"{session_dir}"
+        with session.Session().connection.transaction:
+            _insert_session_entries(entries)
+        _write_checkpoint(
+            checkpoint_path, session_csv_path, input_sessions, chunk_rows[-1] + 1
+        )
+
+        for table_name in insert_counts:
+            insert_counts[table_name] += len(entries[table_name])
+        if verbose and chunk_size < len(pending_rows):
+            logger.info(
+                f"---- Committed {chunk_start + len(chunk_rows)} of "
+                + f"{len(pending_rows)} session(s) ----"
             )
 
-        if acq_software == "SpikeGLX":
-            for meta_filepath in ephys_meta_filepaths:
-                spikeglx_meta = spikeglx.SpikeGLXMeta(meta_filepath)
+    _write_checkpoint(
+        checkpoint_path, session_csv_path, input_sessions, len(input_sessions)
+    )
+
+    log_string = "---- Inserting %d entry(s) into %s ----"
+
+    if verbose:
+        logger.info(
+            f"---- Checked {existence_checks} probe(s) and session(s) with 2 "
+            + f"queries instead of {existence_checks} ----"
+        )
+        for table_name, insert_count in insert_counts.items():
+            logger.info(log_string % (insert_count, table_name))
+        logger.info("---- Successfully completed ingest_subjects ----")
 
-                probe_key = {
-                    "probe_type": spikeglx_meta.probe_model,
-                    "probe": spikeglx_meta.probe_SN,
-                }
-                if (
-                    probe_key["probe"] not in [p["probe"] for p in probe_list]
-                    and probe_key not in probe.Probe()
-                ):
-                    probe_list.append(probe_key)
-
-                probe_dir = meta_filepath.parent
-                probe_number = re.search("(imec)?\d{1}$", probe_dir.name).group()
-                probe_number = int(probe_number.replace("imec", ""))
-
-                insertions.append(
-                    {
-                        "probe": spikeglx_meta.probe_SN,
-                        "insertion_number": int(probe_number),
-                    }
-                )
-                session_datetimes.append(spikeglx_meta.recording_time)
-        elif acq_software == "OpenEphys":
-            loaded_oe = openephys.OpenEphys(session_dir)
-            session_datetimes.append(loaded_oe.experiment.datetime)
-            for probe_idx, oe_probe in enumerate(loaded_oe.probes.values()):
-                probe_key = {
-                    "probe_type": oe_probe.probe_model,
-                    "probe": oe_probe.probe_SN,
-                }
-                if (
-                    probe_key["probe"] not in [p["probe"] for p in probe_list]
-                    and probe_key not in probe.Probe()
-                ):
-                    probe_list.append(probe_key)
-                insertions.append(
-                    {"probe": oe_probe.probe_SN, "insertion_number": probe_idx}
-                )
-        else:
-            raise NotImplementedError(
-                "Unknown acquisition software: " + f"{acq_software}"
-            )
+
+def _get_session_entries(
+    input_sessions: list,
+    discovered_sessions: list,
+    known_probes: set,
+    known_sessions: set,
+):
+    """Entries of the new sessions and probes, by table
+
+    Args:
+        input_sessions (list): rows of the sessions csv
+        discovered_sessions (list): `discover_sessions` result of each row
+        known_probes (set): probe serials already inserted or pending, updated with
+            the new probes
+        known_sessions (set): (subject, session_datetime) of the sessions already
+            inserted or pending, updated with the new sessions
+
+    Returns:
+        entries (dict): entries to insert into each table, by table name
+        existence_checks (int): probes and sessions looked up in the known sets
+    """
+    entries = {
+        table_name: []
+        for table_name in (
+            "session.Session",
+            "lab.User",
+            "session.SessionDirectory",
+            "session.SessionNote",
+            "session.SessionExperimenter",
+            "probe.Probe",
+            "ephys.ProbeInsertion",
+        )
+    }
+    existence_checks = 0
+
+    for this_session, discovered in zip(input_sessions, discovered_sessions):
+        for probe_key in discovered["probes"]:
+            existence_checks += 1
+            if probe_key["probe"] not in known_probes:
+                known_probes.add(probe_key["probe"])
+                entries["probe.Probe"].append(probe_key)
 
         # new session/probe-insertion
         session_key = {
             "subject": this_session["subject"],
-            "session_datetime": min(session_datetimes),
+            "session_datetime": min(discovered["session_datetimes"]),
         }
-        if session_key not in session.Session():
-            session_list.append(session_key)
-            root_dir = find_root_directory(get_ephys_root_data_dir(), session_dir)
-            session_dir_list.append(
-                {
-                    **session_key,
-                    "session_dir": session_dir.relative_to(root_dir).as_posix(),
-                }
+        existence_checks += 1
+        if tuple(session_key.values()) not in known_sessions:
+            known_sessions.add(tuple(session_key.values()))
+            entries["session.Session"].append(session_key)
+            entries["session.SessionDirectory"].append(
+                {**session_key, "session_dir": discovered["session_dir"]}
             )
-            session_note_list.append(
+            entries["session.SessionNote"].append(
                 {**session_key, "session_note": this_session["session_note"]}
             )
-            session_experimenter_list.append(
+            entries["session.SessionExperimenter"].append(
                 {**session_key, "user": this_session["user"]}
             )
-            lab_user_list.append(
+            entries["lab.User"].append(
                 (this_session["user"], "", "", "")
             )  # empty email/phone/name
-            probe_insertion_list.extend(
-                [{**session_key, **insertion} for insertion in insertions]
+            entries["ephys.ProbeInsertion"].extend(
+                [{**session_key, **insertion} for insertion in discovered["insertions"]]
             )
 
-    session.Session.insert(session_list)
-    lab.User.insert(lab_user_list, skip_duplicates=True)
-    session.SessionDirectory.insert(session_dir_list)
-    session.SessionNote.insert(session_note_list)
-    session.SessionExperimenter.insert(session_experimenter_list)
+    return entries, existence_checks
 
-    log_string = "---- Inserting %d entry(s) into %s ----"
 
-    if verbose:
-        logger.info(log_string % (len(session_list), "session.Session"))
+def _insert_session_entries(entries: dict):
+    """Insert the `_get_session_entries` entries, parents first"""
+    session.Session.insert(entries["session.Session"])
+    lab.User.insert(entries["lab.User"], skip_duplicates=True)
+    session.SessionDirectory.insert(entries["session.SessionDirectory"])
+    session.SessionNote.insert(entries["session.SessionNote"])
+    session.SessionExperimenter.insert(entries["session.SessionExperimenter"])
+    probe.Probe.insert(entries["probe.Probe"])
+    ephys.ProbeInsertion.insert(entries["ephys.ProbeInsertion"])
 
-    probe.Probe.insert(probe_list)
-    if verbose:
-        logger.info(log_string % (len(probe_list), "probe.Probe"))
 
-    ephys.ProbeInsertion.insert(probe_insertion_list)
-    if verbose:
-        logger.info(log_string % (len(probe_insertion_list), "ephys.ProbeInsertion"))
-        logger.info("---- Successfully completed ingest_subjects ----")
+def _read_checkpoint(
+    checkpoint_path: str, session_csv_path: str, input_sessions: list
+) -> int:
+    """Number of csv rows committed by previous runs, 0 without a valid checkpoint
+
+    A checkpoint of another csv, or whose committed rows changed since, is ignored.
+    """
+    if not checkpoint_path or not pathlib.Path(checkpoint_path).exists():
+        return 0
+
+    checkpoint = json.loads(pathlib.Path(checkpoint_path).read_text())
+    if checkpoint["session_csv_path"] != pathlib.Path(session_csv_path).as_posix():
+        logger.warning(
+            f"Ignoring checkpoint {checkpoint_path} of another sessions csv: "
+            + checkpoint["session_csv_path"]
+        )
+        return 0
+
+    committed_rows = checkpoint["committed_rows"]
+    rows_checksum = _get_rows_checksum(input_sessions[:committed_rows])
+    if checkpoint.get("rows_checksum") != rows_checksum:
+        logger.warning(
+            f"Ignoring checkpoint {checkpoint_path}: the {committed_rows} committed "
+            + f"row(s) of {session_csv_path} changed since"
+        )
+        return 0
+    return committed_rows
+
+
+def _write_checkpoint(
+    checkpoint_path: str,
+    session_csv_path: str,
+    input_sessions: list,
+    committed_rows: int,
+):
+    """Record the number and checksum of the csv rows committed, replacing the
+    checkpoint file"""
+    if not checkpoint_path:
+        return
+
+    checkpoint_path = pathlib.Path(checkpoint_path)
+    temp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+    temp_path.write_text(
+        json.dumps(
+            {
+                "session_csv_path": pathlib.Path(session_csv_path).as_posix(),
+                "committed_rows": committed_rows,
+                "rows_checksum": _get_rows_checksum(input_sessions[:committed_rows]),
+            }
+        )
+    )
+    temp_path.replace(checkpoint_path)
+
+
+def _get_rows_checksum(rows: list) -> str:
+    """MD5 checksum of the content of csv rows"""
+    return hashlib.md5(json.dumps(rows, sort_keys=True).encode()).hexdigest()
+
+
+def filter_ingested_sessions(input_sessions: list) -> list:
+    """Drop the rows of the sessions csv whose directory is already ingested
+
+    Compares the "session_dir" of each row with every session.SessionDirectory entry,
+    fetched in one query, without accessing the file system.
+
+    Args:
+        input_sessions (list): rows of the sessions csv, with a "session_dir" column
+
+    Returns:
+        new_sessions (list): rows whose session directory is not ingested yet
+    """
+    root_dirs = get_ephys_root_data_dir()
+    ingested_dirs = _get_ingested_session_dirs()
+    return [
+        this_session
+        for this_session in input_sessions
+        if _normalize_session_dir(this_session["session_dir"], root_dirs)
+        not in ingested_dirs
+    ]
+
+
+def _get_ingested_session_dirs() -> set:
+    """Every session.SessionDirectory entry, normalized by `_normalize_session_dir`"""
+    root_dirs = get_ephys_root_data_dir()
+    return {
+        _normalize_session_dir(session_dir, root_dirs)
+        for session_dir in session.SessionDirectory.fetch("session_dir")
+    }
+
+
+def _normalize_session_dir(session_dir: str, root_dirs) -> str:
+    """Session directory relative to its root directory, as a posix path
+
+    Full paths are made relative to the first root directory containing them by
+    comparing path components only, without accessing the file system.
+    """
+    session_dir = pathlib.PurePath(session_dir.replace("\\", "/"))
+    if session_dir.is_absolute():
+        if not isinstance(root_dirs, list):
+            root_dirs = [root_dirs] if root_dirs else []
+        for root_dir in root_dirs:
+            root_dir = pathlib.PurePath(str(root_dir).replace("\\", "/"))
+            if root_dir.parts == session_dir.parts[: len(root_dir.parts)]:
+                return session_dir.relative_to(root_dir).as_posix()
+    return session_dir.as_posix()
+
+
+def discover_sessions(input_sessions: list, n_workers: int = 1) -> list:
+    """Scan session directories and parse their recording metadata
+
+    Only reads the file system, so sessions are scanned by a pool of `n_workers`
+    threads, which overlap the latency of network file systems. Results are returned
+    in the order of `input_sessions`, as with serial scanning.
+
+    Args:
+        input_sessions (list): rows of the sessions csv, with a "session_dir" column
+        n_workers (int, optional): Threads scanning sessions. Defaults to 1 (serial).
+
+    Returns:
+        sessions (list): one dict per session, see `_discover_session`
+    """
+    scan_index = get_scan_index()
+    if n_workers <= 1:
+        return [
+            _discover_session(this_session, scan_index)
+            for this_session in input_sessions
+        ]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(
+            executor.map(
+                _discover_session, input_sessions, [scan_index] * len(input_sessions)
+            )
+        )
+
+
+def _discover_session(this_session: dict, scan_index=None) -> dict:
+    """Find the recording files of one session and parse their metadata
+
+    Folder structure: root / subject / session / probe / .ap.meta
+
+    Args:
+        this_session (dict): row of the sessions csv
+        scan_index (ScanIndex, optional): index of the ephys root directories
+            searched instead of the file system. Defaults to None.
+
+    Returns:
+        session (dict): "session_dir" relative to the root directory, "acq_software",
+            "probes" (probe keys), "insertions" (probe and insertion_number) and
+            "session_datetimes" of the session's recordings
+    """
+    session_dir = find_ephys_path(this_session["session_dir"])
+    session_datetimes, probes, insertions = [], [], []
+
+    # search session dir and determine acquisition software
+    for ephys_pattern, ephys_acq_type in zip(
+        ["*.ap.meta", "*.oebin"], ["SpikeGLX", "OpenEphys"]
+    ):
+        if scan_index is not None:
+            ephys_meta_filepaths = scan_index.glob(session_dir, ephys_pattern)
+        else:
+            ephys_meta_filepaths = [fp for fp in session_dir.rglob(ephys_pattern)]
+        if len(ephys_meta_filepaths):
+            acq_software = ephys_acq_type
+            break
+    else:
+        raise FileNotFoundError(
+            "Ephys recording data not found! Neither SpikeGLX "
+            + "nor OpenEphys recording files found in: "
+            + f"{session_dir}"
+        )
+
+    if acq_software == "SpikeGLX":
+        for meta_filepath in ephys_meta_filepaths:
+            spikeglx_meta = spikeglx.SpikeGLXMeta(meta_filepath)
+
+            probes.append(
+                {
+                    "probe_type": spikeglx_meta.probe_model,
+                    "probe": spikeglx_meta.probe_SN,
+                }
+            )
+
+            probe_dir = meta_filepath.parent
+            probe_number = re.search("(imec)?\d{1}$", probe_dir.name).group()
+            probe_number = int(probe_number.replace("imec", ""))
+
+            insertions.append(
+                {
+                    "probe": spikeglx_meta.probe_SN,
+                    "insertion_number": int(probe_number),
+                }
+            )
+            session_datetimes.append(spikeglx_meta.recording_time)
+    elif acq_software == "OpenEphys":
+        loaded_oe = openephys.OpenEphys(session_dir)
+        session_datetimes.append(loaded_oe.experiment.datetime)
+        for probe_idx, oe_probe in enumerate(loaded_oe.probes.values()):
+            probes.append(
+                {
+                    "probe_type": oe_probe.probe_model,
+                    "probe": oe_probe.probe_SN,
+                }
+            )
+            insertions.append(
+                {"probe": oe_probe.probe_SN, "insertion_number": probe_idx}
+            )
+    else:
+        raise NotImplementedError("Unknown acquisition software: " + f"{acq_software}")
+
+    root_dir = find_root_directory(get_ephys_root_data_dir(), session_dir)
+    return {
+        "session_dir": session_dir.relative_to(root_dir).as_posix(),
+        "acq_software": acq_software,
+        "probes": probes,
+        "insertions": insertions,
+        "session_datetimes": session_datetimes,
+    }
 
 
 def ingest_events(
@@ -277,6 +566,7 @@ def ingest_events(
     event_csv_path: str = "./user_data/events.csv",
     skip_duplicates: bool = True,
     verbose: bool = True,
+    chunk_size: int = 10_000,
 ):
     """Ingest each level of experiment hierarchy for element-trial
 
@@ -284,6 +574,10 @@ def ingest_events(
         recording, block (i.e., phases of trials), trials (repeated units),
         events (optionally 0-duration occurrences within trial).
 
+    Each file is read once and streamed in chunks of rows to all of its tables, see
+    `stream_file_to_tables`. Besides csv, every file can be a Parquet (.parquet),
+    Feather (.feather, .arrow) or NumPy (.npz) file with the same columns.
+
     Note: This ingestion function is duplicated across wf-array-ephys and wf-calcium-imaging
 
     Args:
@@ -298,42 +592,196 @@ def ingest_events(
         skip_duplicates (bool, optional): See DataJoint `insert` function. Default True.
         verbose (bool, optional): Print number inserted (i.e., table length change).
             Defaults to True.
+        chunk_size (int, optional): rows held in memory and inserted at once.
+            Defaults to 10,000.
     """
-    csvs = [
-        recording_csv_path,
-        recording_csv_path,
-        block_csv_path,
-        block_csv_path,
-        trial_csv_path,
-        trial_csv_path,
-        trial_csv_path,
-        trial_csv_path,
-        event_csv_path,
-        event_csv_path,
-        event_csv_path,
-    ]
-    tables = [
-        event.BehaviorRecording(),
-        event.BehaviorRecording.File(),
-        trial.Block(),
-        trial.Block.Attribute(),
-        trial.TrialType(),
-        trial.Trial(),
-        trial.Trial.Attribute(),
-        trial.BlockTrial(),
-        event.EventType(),
-        event.Event(),
-        trial.TrialEvent(),
+    file_tables = [
+        (
+            recording_csv_path,
+            [event.BehaviorRecording(), event.BehaviorRecording.File()],
+        ),
+        (block_csv_path, [trial.Block(), trial.Block.Attribute()]),
+        (
+            trial_csv_path,
+            [
+                trial.TrialType(),
+                trial.Trial(),
+                trial.Trial.Attribute(),
+                trial.BlockTrial(),
+            ],
+        ),
+        (event_csv_path, [event.EventType(), event.Event(), trial.TrialEvent()]),
     ]
 
     # Allow direct insert required because element-event has Imported that should be Manual
-    ingest_csv_to_table(
-        csvs,
-        tables,
-        skip_duplicates=skip_duplicates,
-        verbose=verbose,
-        allow_direct_insert=True,
-    )
+    for file_path, tables in file_tables:
+        stream_file_to_tables(
+            file_path,
+            tables,
+            chunk_size=chunk_size,
+            skip_duplicates=skip_duplicates,
+            verbose=verbose,
+            allow_direct_insert=True,
+        )
+
+
+def stream_file_to_tables(
+    file_path: str,
+    tables: list,
+    chunk_size: int = 10_000,
+    skip_duplicates: bool = True,
+    verbose: bool = True,
+    allow_direct_insert: bool = False,
+):
+    """Insert the rows of one file into several tables, reading the file once
+
+    Rows are read in chunks of `chunk_size` and each chunk is inserted into every
+    table in order, so parent tables must precede their children. Only the columns of
+    each table's heading are inserted, and rows repeating the same entry within a
+    chunk (e.g. the trial type of every trial) are inserted once.
+
+    Memory is bounded by the chunk size for csv and Parquet files, and by the
+    record batches the file was written with for Feather files. Arrays of npz files
+    are loaded whole and then inserted in chunks.
+
+    Columns of Parquet, Feather and npz files are typed arrays, checked against the
+    attribute types of each table before inserting.
+
+    Args:
+        file_path (str): csv with a header row, Parquet (.parquet), Feather (.feather,
+            .arrow) or NumPy (.npz, one array per column) file
+        tables (list): tables receiving the rows, parents first
+        chunk_size (int, optional): rows read and inserted at once. Defaults to
+            10,000.
+        skip_duplicates (bool, optional): See DataJoint `insert` function. Default True.
+        verbose (bool, optional): Print number inserted (i.e., table length change).
+            Defaults to True.
+        allow_direct_insert (bool, optional): See DataJoint `insert` function.
+            Defaults to False.
+
+    Raises:
+        TypeError: A column's type does not match the attribute of a table
+        ValueError: Unknown file type
+    """
+    if verbose:
+        previous_lengths = [len(table) for table in tables]
+
+    table_fields = None
+    for columns in _read_column_chunks(file_path, chunk_size):
+        if table_fields is None:
+            table_fields = [
+                [name for name in table.heading.names if name in columns]
+                for table in tables
+            ]
+            for table, fields in zip(tables, table_fields):
+                _check_column_types(table, {name: columns[name] for name in fields})
+
+        values = {name: _column_values(column) for name, column in columns.items()}
+        for table, fields in zip(tables, table_fields):
+            entries = dict.fromkeys(zip(*(values[field] for field in fields)))
+            table.insert(
+                [dict(zip(fields, entry)) for entry in entries],
+                skip_duplicates=skip_duplicates,
+                allow_direct_insert=allow_direct_insert,
+            )
+
+    if verbose:
+        for table, previous_length in zip(tables, previous_lengths):
+            logger.info(
+                f"---- Inserting {len(table) - previous_length} entry(s) into "
+                + f"{table.__class__.__qualname__} ----"
+            )
+
+
+def _read_column_chunks(file_path: str, chunk_size: int):
+    """Read a csv, Parquet, Feather or npz file in chunks of rows
+
+    Yields:
+        columns (dict): values of each column in a chunk of rows, as lists of strings
+            for csv files and as arrays otherwise
+    """
+    suffix = pathlib.Path(file_path).suffix
+
+    if suffix == ".csv":
+        with open(file_path, newline="") as f:
+            reader = csv.DictReader(f, delimiter=",")
+            while True:
+                rows = list(itertools.islice(reader, chunk_size))
+                if not rows:
+                    break
+                yield {name: [row[name] for row in rows] for name in reader.fieldnames}
+    elif suffix == ".npz":
+        with np.load(file_path) as data:
+            columns = {name: data[name] for name in data.files}
+        row_count = min((len(column) for column in columns.values()), default=0)
+        for start in range(0, row_count, chunk_size):
+            yield {
+                name: column[start : start + chunk_size]
+                for name, column in columns.items()
+            }
+    elif suffix in (".parquet", ".feather", ".arrow"):
+        if pyarrow is None:
+            raise ImportError(f"Reading {suffix} files requires pyarrow")
+        for batch in _read_arrow_batches(file_path, chunk_size):
+            yield {
+                name: column.to_numpy(zero_copy_only=False)
+                for name, column in zip(batch.schema.names, batch.columns)
+            }
+    else:
+        raise ValueError(f"Unknown file type: {suffix}")
+
+
+def _read_arrow_batches(file_path: str, chunk_size: int):
+    """Read a Parquet or Feather (V2, i.e. Arrow IPC) file in record batches
+
+    Feather files are memory-mapped and read one record batch at a time, so that
+    only that batch is decompressed. Batches larger than `chunk_size` rows are
+    sliced, without copies.
+
+    Yields:
+        batch (pyarrow.RecordBatch): at most `chunk_size` rows
+    """
+    if pathlib.Path(file_path).suffix == ".parquet":
+        yield from parquet.ParquetFile(file_path).iter_batches(batch_size=chunk_size)
+        return
+
+    with pyarrow.memory_map(str(file_path)) as source:
+        reader = pyarrow.ipc.open_file(source)
+        for batch_index in range(reader.num_record_batches):
+            batch = reader.get_batch(batch_index)
+            for start in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(start, chunk_size)
+
+
+def _check_column_types(table, columns: dict):
+    """Raise a TypeError if a typed column does not match its table attribute"""
+    for name, column in columns.items():
+        if not isinstance(column, np.ndarray):
+            continue  # csv strings, converted by the database
+
+        attribute = table.heading.attributes[name]
+        if attribute.numeric:
+            expected_kinds = "iufb"
+        elif attribute.type.startswith(("date", "time")):
+            expected_kinds = "MOUS"
+        elif attribute.string:
+            expected_kinds = "OUS"
+        else:
+            continue
+        if column.dtype.kind not in expected_kinds:
+            raise TypeError(
+                f"Column {name} of type {column.dtype} does not match "
+                + f"{table.__class__.__qualname__}.{name} of type {attribute.type}"
+            )
+
+
+def _column_values(column) -> list:
+    """Python values of a column, datetimes as datetime.datetime"""
+    if isinstance(column, np.ndarray):
+        if column.dtype.kind == "M":
+            column = column.astype("datetime64[us]")
+        return column.tolist()
+    return column
 
 
 def ingest_alignment(
@@ -346,17 +794,20 @@ def ingest_alignment(
     Note: This is duplicated across wf-array-ephys and wf-calcium-imaging
 
     Args:
-        alignment_csv_path (str, optional): Relative path to event alignment csv.
+        alignment_csv_path (str, optional): Relative path to event alignment csv, or
+            Parquet, Feather or npz file, see `stream_file_to_tables`.
             Defaults to "./user_data/alignments.csv".
         skip_duplicates (bool, optional): See DataJoint `insert` function. Default True.
         verbose (bool, optional): Print number inserted (i.e., table length change).
             Defaults to True.
     """
 
-    csvs = [alignment_csv_path]
-    tables = [event.AlignmentEvent()]
-
-    ingest_csv_to_table(csvs, tables, skip_duplicates=skip_duplicates, verbose=verbose)
+    stream_file_to_tables(
+        alignment_csv_path,
+        [event.AlignmentEvent()],
+        skip_duplicates=skip_duplicates,
+        verbose=verbose,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+"""Sinks and summary of per-key populate metrics
+
+`process` measures each populated key as one record with the fields of
+METRIC_FIELDS. Records are appended to a JSON lines (.jsonl), SQLite (.sqlite, .db)
+or CSV (.csv) file, chosen by the file suffix.
+"""
+
+import csv
+import json
+import sqlite3
+from pathlib import Path
+
+# Fields of a metrics record and their SQLite column types
+METRIC_FIELDS = {
+    "table_name": "TEXT",  # pipeline table, e.g. "ephys.LFP"
+    "key": "TEXT",  # JSON-encoded primary key
+    "status": "TEXT",  # "success", "error" or "skipped" (e.g. reserved elsewhere)
+    "start_time": "TEXT",  # ISO 8601 time the key was started
+    "wall_time": "REAL",  # (s) elapsed time
+    "cpu_time": "REAL",  # (s) CPU time of the populating process
+    "peak_rss": "INTEGER",  # (bytes) peak resident set size while populating the key
+    "bytes_fetched": "INTEGER",  # bytes sent by the database server
+    "bytes_inserted": "INTEGER",  # bytes received by the database server
+    "rows_inserted": "INTEGER",  # entries of the table and its parts added for the key
+    "host": "TEXT",
+    "pid": "INTEGER",
+}
+
+
+def write_metrics(records: list, path: str):
+    """Append metrics records to a JSON lines, SQLite or CSV file
+
+    Args:
+        records (list): metrics records, dicts with the fields of METRIC_FIELDS
+        path (str): .jsonl, .sqlite, .db or .csv file, created if needed
+    """
+    path = Path(path)
+    records = [
+        {field: record.get(field) for field in METRIC_FIELDS} for record in records
+    ]
+
+    if path.suffix == ".jsonl":
+        with open(path, "a") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+    elif path.suffix in (".sqlite", ".db"):
+        with sqlite3.connect(path) as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS populate_metrics ("
+                + ", ".join(f"{field} {kind}" for field, kind in METRIC_FIELDS.items())
+                + ")"
+            )
+            placeholders = ", ".join("?" * len(METRIC_FIELDS))
+            connection.executemany(
+                f"INSERT INTO populate_metrics VALUES ({placeholders})",
+                [tuple(record.values()) for record in records],
+            )
+        connection.close()
+    elif path.suffix == ".csv":
+        write_header = not path.exists() or not path.stat().st_size
+        with open(path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(METRIC_FIELDS))
+            if write_header:
+                writer.writeheader()
+            writer.writerows(records)
+    else:
+        raise ValueError(f"Unknown metrics file type: {path.suffix}")
+
+
+def read_metrics(path: str) -> list:
+    """Read the metrics records of a JSON lines, SQLite or CSV file
+
+    Args:
+        path (str): .jsonl, .sqlite, .db or .csv file written by `write_metrics`
+
+    Returns:
+        records (list): metrics records, dicts with the fields of METRIC_FIELDS
+    """
+    path = Path(path)
+
+    if path.suffix == ".jsonl":
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if path.suffix in (".sqlite", ".db"):
+        with sqlite3.connect(path) as connection:
+            connection.row_factory = sqlite3.Row
+            records = [
+                dict(row)
+                for row in connection.execute("SELECT * FROM populate_metrics")
+            ]
+        connection.close()
+        return records
+    if path.suffix == ".csv":
+        with open(path, newline="") as f:
+            return [
+                {
+                    field: _parse_csv_value(value, METRIC_FIELDS[field])
+                    for field, value in record.items()
+                }
+                for record in csv.DictReader(f)
+            ]
+    raise ValueError(f"Unknown metrics file type: {path.suffix}")
+
+
+def _parse_csv_value(value: str, kind: str):
+    """Convert a CSV string back to the type of its METRIC_FIELDS column"""
+    if value == "" or kind == "TEXT":
+        return value or None
+    return float(value) if kind == "REAL" else int(value)
+
+
+def summarize_metrics(records: list, top: int = 5) -> str:
+    """Report the time spent in each table and its slowest keys
+
+    Args:
+        records (list): metrics records, e.g. from `read_metrics`
+        top (int, optional): slowest keys listed per table. Defaults to 5.
+
+    Returns:
+        report (str): one section per table, the slowest table first
+    """
+    table_records = {}
+    for record in records:
+        table_records.setdefault(record["table_name"], []).append(record)
+
+    lines = []
+    for table_name, key_records in sorted(
+        table_records.items(),
+        key=lambda item: -sum(record["wall_time"] for record in item[1]),
+    ):
+        wall_time = sum(record["wall_time"] for record in key_records)
+        error_count = sum(record["status"] == "error" for record in key_records)
+        lines.append(
+            f"{table_name}: {len(key_records)} key(s), {error_count} failed, "
+            + f"{wall_time:.1f}s wall, {wall_time / len(key_records):.1f}s per key"
+        )
+        key_records = sorted(key_records, key=lambda record: -record["wall_time"])
+        for record in key_records[:top]:
+            lines.append(
+                f"  {record['wall_time']:8.1f}s wall"
+                + f" {record['cpu_time'] or 0:8.1f}s cpu"
+                + f" {(record['peak_rss'] or 0) / 1e6:7.0f} MB rss"
+                + f" {(record['bytes_fetched'] or 0) / 1e6:7.1f} MB fetched"
+                + f" {(record['bytes_inserted'] or 0) / 1e6:7.1f} MB inserted"
+                + f" {record['rows_inserted'] or 0:7d} rows  {record['key']}"
+            )
+
+    return "\n".join(lines)
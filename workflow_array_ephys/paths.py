@@ -1,8 +1,13 @@
+import logging
 import pathlib
 
 import datajoint as dj
 from element_interface.utils import find_full_path
 
+from .scan_index import ScanIndex
+
+logger = logging.getLogger("datajoint")
+
 
 def get_ephys_root_data_dir():
     """Return root directory for ephys from 'ephys_root_data_dir' in dj.config
@@ -13,6 +18,49 @@ def get_ephys_root_data_dir():
     return dj.config.get("custom", {}).get("ephys_root_data_dir", None)
 
 
+def get_scan_index():
+    """Return the index of ephys files from 'ephys_scan_index' in dj.config
+
+    Returns:
+        scan_index (ScanIndex): index of the files under the ephys root directories,
+            or None if no index file is configured
+    """
+    index_path = dj.config.get("custom", {}).get("ephys_scan_index", None)
+    return ScanIndex(index_path) if index_path else None
+
+
+def refresh_scan_index():
+    """Bring the index of ephys files up to date for every ephys root directory"""
+    scan_index = get_scan_index()
+    if scan_index is None:
+        return
+
+    root_dirs = get_ephys_root_data_dir()
+    for root_dir in root_dirs if isinstance(root_dirs, list) else [root_dirs]:
+        rescanned = scan_index.refresh(root_dir)
+        logger.info(f"Scan index of {root_dir}: {rescanned} directory(s) rescanned")
+
+
+def find_ephys_path(relative_path) -> pathlib.Path:
+    """Return the full path of a path relative to one of the ephys root directories
+
+    Looks the path up in the scan index if one is configured, and otherwise (or if the
+    path is not in the index) searches the root directories.
+
+    Args:
+        relative_path (str): path relative to one of the ephys root directories
+
+    Returns:
+        path (pathlib.Path): full path
+    """
+    scan_index = get_scan_index()
+    if scan_index is not None:
+        full_path = scan_index.find_full_path(get_ephys_root_data_dir(), relative_path)
+        if full_path is not None:
+            return full_path
+    return find_full_path(get_ephys_root_data_dir(), relative_path)
+
+
 def get_session_directory(session_key: dict) -> str:
     """Return relative path from SessionDirectory table given key
 
@@ -49,13 +97,11 @@ def get_electrode_localization_dir(probe_insertion_key: dict) -> str:
                 & 'file_path LIKE "%.ap.meta"'
             ).fetch1("file_path")
         )
-        probe_dir = find_full_path(
-            get_ephys_root_data_dir(), spikeglx_meta_filepath.parent
-        )
+        probe_dir = find_ephys_path(spikeglx_meta_filepath.parent)
     elif acq_software == "Open Ephys":
         probe_path = (ephys.EphysRecording.EphysFile & probe_insertion_key).fetch1(
             "file_path"
         )
-        probe_dir = find_full_path(get_ephys_root_data_dir(), probe_path)
+        probe_dir = find_ephys_path(probe_path)
 
     return probe_dir
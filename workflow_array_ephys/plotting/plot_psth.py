@@ -1,24 +1,115 @@
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+# Above this many spikes, "auto" rendering bins the raster into an image
+IMAGE_RASTER_THRESHOLD = 100_000
+
+
+def _get_raster_positions(aligned_spikes, trial_ids=None):
+    """Flatten per-trial aligned spikes into (spike time, trial id) positions
+
+    Args:
+        aligned_spikes (Sequence): (s) aligned spike times of each trial, or an
+            `alignment.AlignedSpikes` whose flat array is used without copying
+        trial_ids (Sequence, optional): trial id of each trial. Defaults to the
+            trial index.
+
+    Returns:
+        raster (np.ndarray): (s) aligned time of every spike
+        trial_ids (np.ndarray): trial id of every spike
+    """
+    if hasattr(aligned_spikes, "trial_offsets"):
+        raster = aligned_spikes.aligned_spikes
+        spike_counts = np.diff(aligned_spikes.trial_offsets)
+    else:
+        raster = np.concatenate(aligned_spikes) if len(aligned_spikes) else np.empty(0)
+        spike_counts = [len(spikes) for spikes in aligned_spikes]
+
+    if trial_ids is None:
+        trial_ids = np.arange(len(spike_counts))
+
+    return raster, np.repeat(np.asarray(trial_ids, dtype=int), spike_counts)
 
 
 def _plot_spike_raster(
-    aligned_spikes, trial_ids=None, vlines=[0], ax=None, title="", xlim=None
+    aligned_spikes,
+    trial_ids=None,
+    vlines=[0],
+    ax=None,
+    title="",
+    xlim=None,
+    render="auto",
+    image_bins=None,
 ):
+    """Plot a spike raster with one row per trial
+
+    Args:
+        aligned_spikes (Sequence): (s) aligned spike times of each trial
+        trial_ids (Sequence, optional): trial id of each trial. Defaults to the index.
+        vlines (list, optional): (s) times of dashed vertical lines. Defaults to [0].
+        ax (matplotlib.axes.Axes, optional): axes to draw on. Defaults to a new figure.
+        title (str, optional): axes title. Defaults to "".
+        xlim (tuple, optional): (s) x-axis limits. Defaults to None.
+        render (str, optional): "markers" draws one marker per spike in a single
+            line, "lines" one tick per spike in a LineCollection, and "image" bins
+            spikes into a rasterized image of `image_bins` time bins per trial.
+            "auto" uses "markers" up to IMAGE_RASTER_THRESHOLD spikes and "image"
+            above. Defaults to "auto".
+        image_bins (int, optional): time bins of the "image" rendering. Defaults to
+            the width of the axes in pixels.
+    """
     if not ax:
         fig, ax = plt.subplots(1, 1)
 
-    raster = np.concatenate(aligned_spikes)
-    if trial_ids is None:
-        trial_ids = range(len(aligned_spikes))
+    raster, trial_ids = _get_raster_positions(aligned_spikes, trial_ids)
 
-    trial_ids = np.concatenate(
-        [[t] * len(s) for t, s in zip(trial_ids, aligned_spikes)]
-    ).astype(int)
+    if render == "auto":
+        render = "markers" if len(raster) <= IMAGE_RASTER_THRESHOLD else "image"
 
-    assert len(raster) == len(trial_ids)
+    if render == "markers":
+        ax.plot(raster, trial_ids, "ro", markersize=4)
+    elif render == "lines":
+        segments = np.empty((len(raster), 2, 2))
+        segments[:, :, 0] = raster[:, None]
+        segments[:, 0, 1] = trial_ids - 0.4
+        segments[:, 1, 1] = trial_ids + 0.4
+        ax.add_collection(LineCollection(segments, colors="r", linewidths=1))
+        ax.autoscale_view()
+    elif render == "image":
+        image_bins = image_bins or max(int(ax.bbox.width), 1)
+        time_range = xlim or (raster.min(initial=0), raster.max(initial=0))
+        first_trial = trial_ids.min(initial=0)
+        trial_count = trial_ids.max(initial=0) - first_trial + 1
+        bin_width = (time_range[1] - time_range[0]) / image_bins or 1.0
 
-    ax.plot(raster, trial_ids, "ro", markersize=4)
+        in_range = (raster >= time_range[0]) & (raster <= time_range[1])
+        time_bins = ((raster[in_range] - time_range[0]) / bin_width).astype(int)
+        image = np.bincount(
+            (trial_ids[in_range] - first_trial) * image_bins
+            + np.minimum(time_bins, image_bins - 1),
+            minlength=trial_count * image_bins,
+        ).reshape(trial_count, image_bins)
+        # Color-map to 8-bit RGBA through a lookup table to avoid float images
+        colors = plt.get_cmap("Reds")(np.linspace(0, 1, 256), bytes=True)
+        image = colors[(image * 255 // max(image.max(), 1)).astype(np.uint8)]
+        ax.imshow(
+            image,
+            aspect="auto",
+            origin="lower",
+            interpolation="nearest",
+            extent=(*time_range, first_trial - 0.5, first_trial + trial_count - 0.5),
+            rasterized=True,
+        )
+    else:
+        raise ValueError(f"Unknown raster rendering: {render}")
 
     for x in vlines:
         ax.axvline(x=x, linestyle="--", color="k")
@@ -46,3 +137,146 @@ def _plot_psth(psth, psth_edges, bin_size, vlines=[0], ax=None, title="", xlim=N
         ax.set_xlim(xlim)
     ax.set_xlabel("Time (s)")
     ax.set_title(title)
+
+
+def _plot_unit(axs, trial_ids, aligned_spikes, psth, psth_edges, bin_size, title=""):
+    """Plot the spike raster and PSTH of one unit on a pair of axes"""
+    xlim = psth_edges[0], psth_edges[-1]
+
+    _plot_spike_raster(
+        aligned_spikes, trial_ids=trial_ids, ax=axs[0], title=title, xlim=xlim
+    )
+    _plot_psth(psth, psth_edges, bin_size, ax=axs[1], title="", xlim=xlim)
+
+
+def _replot_unit(axs, unit, bin_size):
+    """Clear a reused pair of axes and plot one unit of `plot_units` on them"""
+    for ax in axs:
+        ax.cla()
+    _plot_unit(
+        axs,
+        unit["trial_ids"],
+        unit["aligned_spikes"],
+        unit["psth"],
+        unit["psth_edges"],
+        bin_size,
+        title=unit["title"],
+    )
+
+
+def render_unit_figures(units, bin_size, file_format="png", figsize=(12, 8), dpi=100):
+    """Render the raster and PSTH figure of each unit to image bytes
+
+    One figure is created without pyplot, so it is drawn by the non-interactive Agg
+    canvas, and is reused for every unit.
+
+    Args:
+        units (list): one dict per unit, see `plot_units`
+        bin_size (float): (s) PSTH bin size
+        file_format (str, optional): image format, e.g. "png" or "svg". Defaults to
+            "png".
+        figsize (tuple, optional): figure size in inches. Defaults to (12, 8).
+        dpi (int, optional): resolution of raster formats. Defaults to 100.
+
+    Returns:
+        figures (list): image bytes of each unit
+    """
+    fig = Figure(figsize=figsize)
+    axs = fig.subplots(2, 1)
+
+    figures = []
+    for unit in units:
+        _replot_unit(axs, unit, bin_size)
+        with io.BytesIO() as buffer:
+            fig.savefig(buffer, format=file_format, dpi=dpi)
+            figures.append(buffer.getvalue())
+
+    return figures
+
+
+def _render_unit_pngs(units, bin_size, output_dir, figsize, dpi):
+    """Render the figure of each unit to a PNG file. Runs in a worker process.
+
+    Returns:
+        file_paths (list): path of each PNG file
+    """
+    file_paths = []
+    for unit, figure in zip(
+        units, render_unit_figures(units, bin_size, "png", figsize, dpi)
+    ):
+        file_paths.append(Path(output_dir) / f"unit_{unit['unit']}.png")
+        file_paths[-1].write_bytes(figure)
+
+    return file_paths
+
+
+def plot_units(
+    units,
+    bin_size,
+    output_path,
+    file_format="pdf",
+    n_workers=1,
+    units_per_task=16,
+    figsize=(12, 8),
+    dpi=100,
+):
+    """Write the raster and PSTH figure of many units to a PDF or a PNG directory
+
+    PNG files are rendered in a pool of `n_workers` processes, each reusing one
+    figure for all units of a task. A multi-page PDF has a single writer, so its pages
+    are rendered in this process, reusing one figure.
+
+    Args:
+        units (list): one dict per unit with "unit", "title", "trial_ids",
+            "aligned_spikes", "psth" and "psth_edges"
+        bin_size (float): (s) PSTH bin size
+        output_path (str): PDF file, or directory of the PNG files
+        file_format (str, optional): "pdf" or "png". Defaults to "pdf".
+        n_workers (int, optional): worker processes rendering PNG files. Defaults to
+            1 (no workers).
+        units_per_task (int, optional): units rendered per worker task. Defaults to
+            16.
+        figsize (tuple, optional): figure size in inches. Defaults to (12, 8).
+        dpi (int, optional): resolution of PNG files. Defaults to 100.
+
+    Returns:
+        file_paths (list): written PDF file or PNG files
+    """
+    output_path = Path(output_path)
+
+    if file_format == "pdf":
+        fig = Figure(figsize=figsize)
+        axs = fig.subplots(2, 1)
+        with PdfPages(output_path) as pdf:
+            for unit in units:
+                _replot_unit(axs, unit, bin_size)
+                pdf.savefig(fig)
+        return [output_path]
+
+    if file_format != "png":
+        raise ValueError(f"Unknown figure file format: {file_format}")
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    tasks = [
+        units[start : start + units_per_task]
+        for start in range(0, len(units), units_per_task)
+    ]
+    if n_workers <= 1:
+        return [
+            file_path
+            for task in tasks
+            for file_path in _render_unit_pngs(
+                task, bin_size, output_path, figsize, dpi
+            )
+        ]
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                _render_unit_pngs, task, bin_size, output_path, figsize, dpi
+            )
+            for task in tasks
+        ]
+        return [file_path for future in futures for file_path in future.result()]
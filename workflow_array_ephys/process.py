@@ -1,18 +1,97 @@
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from datetime import datetime
+
+import datajoint as dj
+from element_interface.utils import find_full_path
+from tqdm import tqdm
+
+from workflow_array_ephys import metrics, pipeline
+from workflow_array_ephys.paths import get_ephys_root_data_dir
 from workflow_array_ephys.pipeline import ephys
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger("datajoint")
+
+# Parents of each table populated by `run` and the scheduler, listed in populate
+# order. A key of a table is ready once its entry in the table's key source exists,
+# i.e. once its parents populated it.
+TABLE_DEPENDENCIES = {
+    "ephys.EphysRecording": [],
+    "ephys.LFP": ["ephys.EphysRecording"],
+    "ephys.Clustering": ["ephys.EphysRecording"],
+    "ephys.CuratedClustering": ["ephys.Clustering"],
+    "ephys.WaveformSet": ["ephys.CuratedClustering"],
+    "analysis.SpikesAlignment": ["ephys.CuratedClustering"],
+}
+
 
 def run(
     display_progress: bool = True,
     reserve_jobs: bool = False,
     suppress_errors: bool = False,
+    n_workers: int = None,
+    table_concurrency: dict = None,
+    metrics_path: str = None,
+    key_order=None,
 ):
     """Execute all populate commands in Element Array Ephys
 
+    By default, the tables of TABLE_DEPENDENCIES are populated one after the other in
+    this process. Besides the ephys tables, this populates analysis.SpikesAlignment
+    for the conditions inserted into analysis.SpikesAlignmentCondition. With
+    `n_workers`, keys are instead dispatched to a pool of worker processes as soon as
+    they are ready, see `populate_scheduled`.
+
     Args:
         display_progress (bool, optional): See DataJoint `populate`. Defaults to True.
         reserve_jobs (bool, optional): See DataJoint `populate`. Defaults to False.
         suppress_errors (bool, optional): See DataJoint `populate`. Defaults to False.
+        n_workers (int, optional): number of worker processes. Defaults to None
+            (populate in this process).
+        table_concurrency (dict, optional): maximum number of keys of a table
+            populated at once, e.g. {"ephys.LFP": 2}. Defaults to `n_workers`.
+        metrics_path (str, optional): .jsonl, .sqlite or .csv file receiving the
+            metrics of every key, see `metrics.write_metrics`. Defaults to None (no
+            metrics). Tables are then populated key by key.
+        key_order (str or callable, optional): order in which keys are populated,
+            see `order_keys`. Defaults to None (database order). Tables are then
+            populated key by key.
     """
+    if n_workers is not None:
+        errors = populate_scheduled(
+            n_workers=n_workers,
+            table_concurrency=table_concurrency,
+            display_progress=display_progress,
+            reserve_jobs=reserve_jobs,
+            metrics_path=metrics_path,
+            key_order=key_order,
+        )
+        if errors and not suppress_errors:
+            table_name, key, error = errors[0]
+            raise RuntimeError(
+                f"{len(errors)} key(s) failed to populate. {table_name} {key}: {error}"
+            )
+        return
 
     populate_settings = {
         "display_progress": display_progress,
@@ -20,21 +99,775 @@ def run(
         "suppress_errors": suppress_errors,
     }
 
-    print("\n---- Populate ephys.EphysRecording ----")
-    ephys.EphysRecording.populate(**populate_settings)
+    if metrics_path is not None or key_order is not None:
+        populate_settings["display_progress"] = False
+        records, recording_costs = [], {}
+        for table_name in TABLE_DEPENDENCIES:
+            print(f"\n---- Populate {table_name} ----")
+            table = _get_table(table_name)
+            for key in tqdm(
+                order_keys(
+                    (table.key_source - table).fetch("KEY"), key_order, recording_costs
+                ),
+                desc=table_name,
+                disable=not display_progress,
+            ):
+                _, record = _populate_key(
+                    table_name, key, populate_settings, metrics_path is not None
+                )
+                _record_metrics(records, record, metrics_path)
+
+        if display_progress and records:
+            print(metrics.summarize_metrics(records))
+        return
+
+    for table_name in TABLE_DEPENDENCIES:
+        print(f"\n---- Populate {table_name} ----")
+        _get_table(table_name).populate(**populate_settings)
+
+
+def populate_parallel(
+    table_name: str,
+    *restrictions,
+    n_workers: int = None,
+    display_progress: bool = True,
+    reserve_jobs: bool = True,
+    metrics_path: str = None,
+    key_order=None,
+) -> list:
+    """Populate the pending keys of one table across a pool of worker processes
+
+    Each worker process imports the pipeline and so opens its own DataJoint
+    connection. With `reserve_jobs`, keys already reserved by other workers or other
+    machines are skipped, as in DataJoint `populate`.
+
+    Example:
+        > populate_parallel("analysis.SpikesAlignment", n_workers=32)
+
+    Args:
+        table_name (str): table name within the pipeline, e.g. "ephys.LFP", see
+            `_get_table`
+        restrictions (list): restrictions on the table's key source
+        n_workers (int, optional): number of worker processes. Defaults to CPU count.
+        display_progress (bool, optional): Report progress. Defaults to True.
+        reserve_jobs (bool, optional): See DataJoint `populate`. Defaults to True.
+        metrics_path (str, optional): file receiving the metrics of every key, see
+            `run`. Defaults to None (no metrics).
+        key_order (str or callable, optional): order in which keys are submitted,
+            see `order_keys`. Defaults to None (database order).
+
+    Returns:
+        errors (list): (key, error message) of every key that failed
+    """
+    table = _get_table(table_name)
+    keys = ((table.key_source & dj.AndList(restrictions)) - table).fetch("KEY")
+    keys = order_keys(keys, key_order)
+
+    populate_settings = {"reserve_jobs": reserve_jobs, "suppress_errors": True}
+    measure = metrics_path is not None
+    errors, records = [], []
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            executor.submit(
+                _populate_key, table_name, key, populate_settings, measure
+            ): key
+            for key in keys
+        }
+        for future in tqdm(
+            as_completed(futures),
+            total=len(futures),
+            desc=table_name,
+            disable=not display_progress,
+        ):
+            key_errors, record = _get_key_result(future, futures[future])
+            errors.extend(key_errors)
+            _record_metrics(records, record, metrics_path)
+
+    if display_progress:
+        print(f"{table_name}: {len(keys)} key(s) processed, {len(errors)} failed")
+        if measure:
+            print(metrics.summarize_metrics(records))
+
+    return errors
+
+
+def populate_scheduled(
+    table_dependencies: dict = None,
+    n_workers: int = None,
+    table_concurrency: dict = None,
+    display_progress: bool = True,
+    reserve_jobs: bool = True,
+    stop_event: threading.Event = None,
+    heartbeat=None,
+    heartbeat_interval: float = 60,
+    metrics_path: str = None,
+    key_order=None,
+) -> list:
+    """Populate dependent tables across a pool of worker processes
+
+    Keys of every table are dispatched as soon as they are ready, instead of one table
+    after the other: LFP extraction of one session does not hold back clustering of
+    another. When a key completes, the key sources of the tables depending on its
+    table are queried again for keys it made ready, restricted to the completed key.
+    Each key is attempted once.
+
+    Example:
+        > populate_scheduled(n_workers=16, table_concurrency={"ephys.LFP": 2})
+
+    Args:
+        table_dependencies (dict, optional): parent table names of each table to
+            populate. Defaults to TABLE_DEPENDENCIES.
+        n_workers (int, optional): number of worker processes. Defaults to CPU count.
+        table_concurrency (dict, optional): maximum number of keys of a table
+            populated at once, e.g. to limit I/O-heavy tables. Defaults to
+            `n_workers` for every table.
+        display_progress (bool, optional): Report progress. Defaults to True.
+        reserve_jobs (bool, optional): See DataJoint `populate`. Defaults to True.
+        stop_event (threading.Event, optional): once set, no more keys are
+            dispatched and the keys being populated are let to finish. Worker
+            processes then ignore SIGTERM and SIGINT, which are left to the caller.
+            Defaults to None.
+        heartbeat (callable, optional): called with the (table name, key) of the keys
+            being populated, at least every `heartbeat_interval` seconds while keys
+            are being populated. Defaults to None.
+        heartbeat_interval (float, optional): (s) Defaults to 60.
+        metrics_path (str, optional): file receiving the metrics of every key, see
+            `run`. Defaults to None (no metrics).
+        key_order (str or callable, optional): order in which the ready keys of a
+            table are dispatched, see `order_keys`. Defaults to None (database
+            order).
+
+    Returns:
+        errors (list): (table name, key, error message) of every key that failed
+    """
+    table_dependencies = table_dependencies or TABLE_DEPENDENCIES
+    n_workers = n_workers or os.cpu_count()
+    table_concurrency = {
+        table_name: (table_concurrency or {}).get(table_name, n_workers)
+        for table_name in table_dependencies
+    }
+    child_tables = {
+        table_name: [
+            child_name
+            for child_name, parent_names in table_dependencies.items()
+            if table_name in parent_names
+        ]
+        for table_name in table_dependencies
+    }
+
+    populate_settings = {"reserve_jobs": reserve_jobs, "suppress_errors": True}
+    measure = metrics_path is not None
+    records, recording_costs = [], {}
+    attempted_keys = {table_name: set() for table_name in table_dependencies}
+    ready_keys = {table_name: [] for table_name in table_dependencies}
+    running = {}  # future: (table name, key)
+    # Keys of the completed parents of each table to query, None for all keys
+    stale_keys = {table_name: None for table_name in table_dependencies}
+    completed_counts = {table_name: 0 for table_name in table_dependencies}
+    errors = []
+    progress = tqdm(total=0, desc="populate", disable=not display_progress)
+    last_heartbeat = time.monotonic()
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=None if stop_event is None else _ignore_stop_signals,
+    ) as executor:
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                stale_keys.clear()
+                ready_keys = {table_name: [] for table_name in table_dependencies}
+
+            progress.total += _refresh_ready_keys(
+                stale_keys, ready_keys, attempted_keys, key_order, recording_costs
+            )
+            stale_keys.clear()
+            progress.refresh()
+
+            _submit_ready_keys(
+                executor,
+                ready_keys,
+                running,
+                n_workers,
+                table_concurrency,
+                (populate_settings, measure),
+            )
+
+            if not running:
+                break
+
+            done, _ = wait(
+                running,
+                timeout=heartbeat_interval if heartbeat else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if heartbeat and time.monotonic() - last_heartbeat >= heartbeat_interval:
+                heartbeat(list(running.values()))
+                last_heartbeat = time.monotonic()
+
+            for future in done:
+                table_name, key = running.pop(future)
+                key_errors, record = _get_key_result(future, key)
+                errors.extend((table_name, *key_error) for key_error in key_errors)
+                _record_metrics(records, record, metrics_path)
+                for child_name in child_tables[table_name]:
+                    stale_keys.setdefault(child_name, []).append(key)
+                completed_counts[table_name] += 1
+                progress.update()
+
+    progress.close()
+    if display_progress:
+        for table_name, key_count in completed_counts.items():
+            table_errors = sum(error[0] == table_name for error in errors)
+            print(f"{table_name}: {key_count} key(s) processed, {table_errors} failed")
+        if measure:
+            print(metrics.summarize_metrics(records))
+
+    return errors
+
+
+def _refresh_ready_keys(
+    stale_keys: dict,
+    ready_keys: dict,
+    attempted_keys: dict,
+    key_order,
+    recording_costs: dict,
+) -> int:
+    """Add the keys made ready since the last refresh to `ready_keys`, in order
+
+    Args:
+        stale_keys (dict): keys of the completed parents of each table to query, None
+            to query all keys of the table
+        ready_keys (dict): keys of each table waiting for a worker, updated
+        attempted_keys (dict): key ids of each table already made ready, updated
+        key_order (str or callable): see `order_keys`
+        recording_costs (dict): cache of recording costs, see `order_keys`
+
+    Returns:
+        key_count (int): number of keys added
+    """
+    key_count = 0
+    for table_name, completed_keys in stale_keys.items():
+        table = _get_table(table_name)
+        key_source = table.key_source
+        if completed_keys is not None:
+            key_source = key_source & completed_keys
+        for key in (key_source - table).fetch("KEY"):
+            key_id = tuple(sorted(key.items()))
+            if key_id not in attempted_keys[table_name]:
+                attempted_keys[table_name].add(key_id)
+                ready_keys[table_name].append(key)
+                key_count += 1
+        ready_keys[table_name] = order_keys(
+            ready_keys[table_name], key_order, recording_costs
+        )
+    return key_count
+
+
+def _submit_ready_keys(
+    executor,
+    ready_keys: dict,
+    running: dict,
+    n_workers: int,
+    table_concurrency: dict,
+    populate_args: tuple,
+):
+    """Hand out free workers one key per table at a time, within table limits
+
+    Args:
+        executor (ProcessPoolExecutor): worker pool
+        ready_keys (dict): keys of each table waiting for a worker, updated
+        running (dict): (table name, key) of each submitted future, updated
+        n_workers (int): number of worker processes
+        table_concurrency (dict): maximum number of running keys of each table
+        populate_args (tuple): populate settings and measure of `_populate_key`
+    """
+    submitted = True
+    while submitted and len(running) < n_workers:
+        submitted = False
+        for table_name, keys in ready_keys.items():
+            table_running = sum(
+                running_table == table_name for running_table, _ in running.values()
+            )
+            if (
+                keys
+                and table_running < table_concurrency[table_name]
+                and len(running) < n_workers
+            ):
+                key = keys.pop(0)
+                future = executor.submit(_populate_key, table_name, key, *populate_args)
+                running[future] = table_name, key
+                submitted = True
+
+
+def _get_key_result(future, key: dict) -> tuple:
+    """Errors and metrics record of a completed `_populate_key` future
+
+    Returns:
+        errors (list): (key, error message) if populating the key failed, including
+            an exception raised in the worker
+        record (dict): metrics record of the key, or None
+    """
+    try:
+        return future.result()
+    except Exception as error:
+        return [(key, _format_error(error))], None
+
+
+def run_worker(
+    n_workers: int = None,
+    table_concurrency: dict = None,
+    min_idle_sleep: float = 10,
+    max_idle_sleep: float = 600,
+    heartbeat_interval: float = 60,
+    stale_after: float = 1800,
+    display_progress: bool = False,
+    metrics_path: str = None,
+    key_order=None,
+):
+    """Populate the pipeline as a long-lived worker, one per cluster node
+
+    Every cycle populates all tables of TABLE_DEPENDENCIES with `populate_scheduled`
+    and job reservation, so workers on many nodes share one database without
+    duplicated work. Cycles that populate nothing are followed by an exponentially
+    growing sleep. SIGTERM or SIGINT stops dispatching keys, lets the keys being
+    populated finish and returns.
+
+    The worker refreshes the timestamp of the reservations of the keys it is
+    populating every `heartbeat_interval` seconds. Reservations older than `stale_after` seconds are
+    left by nodes that died and are deleted so that their keys are populated again.
+    `stale_after` must also exceed the longest key reserved outside of a worker,
+    e.g. by `populate(reserve_jobs=True)`, which does not refresh its reservations.
+
+    Example:
+        > python -m workflow_array_ephys.process worker --table-concurrency ephys.LFP=2
+
+    Args:
+        n_workers (int, optional): worker processes on this node. Defaults to CPU
+            count.
+        table_concurrency (dict, optional): maximum number of keys of a table
+            populated at once on this node, see `populate_scheduled`.
+        min_idle_sleep (float, optional): (s) sleep after the first idle cycle.
+            Defaults to 10.
+        max_idle_sleep (float, optional): (s) longest sleep between idle cycles.
+            Defaults to 600.
+        heartbeat_interval (float, optional): (s) Defaults to 60.
+        stale_after (float, optional): (s) age of a reservation without heartbeat
+            after which it is reclaimed. Defaults to 1800.
+        display_progress (bool, optional): Report progress. Defaults to False.
+        metrics_path (str, optional): file receiving the metrics of every key, see
+            `run`. Defaults to None (no metrics).
+        key_order (str or callable, optional): order in which keys are dispatched,
+            see `order_keys`. Defaults to None (database order).
+    """
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, finishing keys being populated")
+        stop_event.set()
+
+    previous_handlers = {
+        signum: signal.signal(signum, request_stop)
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+
+    try:
+        idle_sleep = min_idle_sleep
+        while not stop_event.is_set():
+            _reclaim_stale_reservations(stale_after)
+
+            entry_count = _count_entries()
+            errors = populate_scheduled(
+                n_workers=n_workers,
+                table_concurrency=table_concurrency,
+                display_progress=display_progress,
+                reserve_jobs=True,
+                stop_event=stop_event,
+                heartbeat=_refresh_reservations,
+                heartbeat_interval=heartbeat_interval,
+                metrics_path=metrics_path,
+                key_order=key_order,
+            )
+            for table_name, key, error in errors:
+                logger.error(f"{table_name} {key}: {error}")
+
+            if _count_entries() > entry_count:
+                idle_sleep = min_idle_sleep
+            else:
+                logger.info(f"No key populated, sleeping {idle_sleep:.0f}s")
+                stop_event.wait(idle_sleep)
+                idle_sleep = min(idle_sleep * 2, max_idle_sleep)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    logger.info("Worker stopped")
+
+
+def order_keys(keys: list, key_order=None, recording_costs: dict = None) -> list:
+    """Order keys to populate so that large jobs start early
+
+    Starting the longest keys first shortens the time until the last worker finishes.
+    Keys without a known cost, e.g. those of EphysRecording itself, come last.
+
+    Args:
+        keys (list): keys to populate, e.g. of the key source of a table
+        key_order (str or callable, optional): one of
+            "longest_first": by EphysRecording recording_duration, descending
+            "largest_first": by the size of the files in the directories of
+                EphysRecording.EphysFile, descending
+            "newest_first": by session_datetime, descending
+            or a callable returning the priority of a key, highest first.
+            Defaults to None (keys are returned in their order).
+        recording_costs (dict, optional): cache of the recording costs of
+            `key_order`, see `_get_recording_costs`. Costs of recordings missing from
+            it are queried and added to it, so that keys ordered again, e.g. by
+            `populate_scheduled`, do not query their recordings again. Defaults to
+            None (costs are queried for these keys only).
+
+    Returns:
+        keys (list): keys in populate order. Ties keep their order.
+    """
+    if key_order is None:
+        return list(keys)
+
+    if callable(key_order):
+        priorities = [key_order(key) for key in keys]
+    elif key_order == "newest_first":
+        priorities = [key.get("session_datetime") for key in keys]
+    elif key_order in ("longest_first", "largest_first"):
+        recording_costs = {} if recording_costs is None else recording_costs
+        recording_attributes = ephys.EphysRecording().primary_key
+        recording_ids = [
+            tuple(key.get(attribute) for attribute in recording_attributes)
+            for key in keys
+        ]
+        missing_keys = [
+            dict(zip(recording_attributes, recording_id))
+            for recording_id in dict.fromkeys(recording_ids)
+            if recording_id not in recording_costs
+        ]
+        if missing_keys:
+            recording_costs.update(_get_recording_costs(key_order, missing_keys))
+        priorities = [
+            recording_costs.get(recording_id) for recording_id in recording_ids
+        ]
+    else:
+        raise ValueError(f"Unknown key order: {key_order}")
+
+    known = [index for index, priority in enumerate(priorities) if priority is not None]
+    unknown = [index for index, priority in enumerate(priorities) if priority is None]
+    known.sort(key=lambda index: priorities[index], reverse=True)
+    return [keys[index] for index in known + unknown]
+
+
+def _get_recording_costs(key_order: str, recording_keys: list = None) -> dict:
+    """Cost of populating each EphysRecording, keyed by its primary key values
+
+    Args:
+        key_order (str): "longest_first" (recording duration in s) or
+            "largest_first" (bytes in the directories of the recording files)
+        recording_keys (list, optional): restrict to these recordings. Defaults to
+            None (all recordings).
+
+    Returns:
+        recording_costs (dict): cost of each recording. Recordings not populated yet
+            are missing.
+    """
+    recording_attributes = ephys.EphysRecording().primary_key
+    restriction = recording_keys if recording_keys is not None else {}
+
+    if key_order == "longest_first":
+        recordings = (ephys.EphysRecording & restriction).fetch(
+            *recording_attributes, "recording_duration", as_dict=True
+        )
+        return {
+            tuple(recording[a] for a in recording_attributes): float(
+                recording["recording_duration"]
+            )
+            for recording in recordings
+        }
+
+    recording_costs = {}
+    directory_sizes = {}
+    for recording_file in (ephys.EphysRecording.EphysFile & restriction).fetch(
+        as_dict=True
+    ):
+        recording_id = tuple(recording_file[a] for a in recording_attributes)
+        try:
+            directory = find_full_path(
+                get_ephys_root_data_dir(), recording_file["file_path"]
+            ).parent
+        except FileNotFoundError:
+            continue
+        if directory not in directory_sizes:
+            directory_sizes[directory] = sum(
+                path.stat().st_size for path in directory.iterdir() if path.is_file()
+            )
+        recording_costs[recording_id] = max(
+            recording_costs.get(recording_id, 0), directory_sizes[directory]
+        )
+    return recording_costs
+
+
+def _refresh_reservations(running_keys: list):
+    """Refresh the timestamp of the reservations of the keys being populated
+
+    Only the reservations of these keys are refreshed: those left by a crashed worker
+    of the same host grow stale and are reclaimed.
+
+    Args:
+        running_keys (list): (table name, key) of the keys being populated
+    """
+    for table_name, key in running_keys:
+        jobs_table = _get_jobs_table(table_name)
+        jobs_table.connection.query(
+            f"UPDATE {jobs_table.full_table_name} SET timestamp=CURRENT_TIMESTAMP "
+            + "WHERE table_name=%s AND key_hash=%s AND status='reserved'",
+            args=(_get_table(table_name).table_name, dj.hash.key_hash(key)),
+        )
+
+
+def _reclaim_stale_reservations(stale_after: float):
+    """Delete the reservations not refreshed for `stale_after` seconds, see
+    `run_worker`"""
+    jobs_tables = {
+        table_name.split(".")[0]: _get_jobs_table(table_name)
+        for table_name in TABLE_DEPENDENCIES
+    }
+    for jobs_table in jobs_tables.values():
+        stale_jobs = jobs_table & (
+            "status='reserved' AND "
+            + f"timestamp < NOW() - INTERVAL {int(stale_after)} SECOND"
+        )
+        if stale_jobs:
+            logger.info(f"Reclaiming {len(stale_jobs)} stale reservation(s)")
+            stale_jobs.delete_quick()
+
+
+def _count_entries() -> int:
+    """Number of entries of every table populated by the worker"""
+    return sum(len(_get_table(table_name)) for table_name in TABLE_DEPENDENCIES)
+
+
+def _get_jobs_table(table_name: str):
+    """Return the jobs table of the schema of a pipeline table, e.g. "ephys.LFP" """
+    return getattr(pipeline, table_name.split(".")[0]).schema.jobs
+
+
+def _ignore_stop_signals():
+    """Let worker processes finish their key when the node is asked to stop"""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _get_table(table_name: str):
+    """Return the pipeline table named e.g. "ephys.LFP"
+
+    Tables outside of the pipeline, e.g. of a downstream package, are named
+    "module:Table", e.g. "my_lab.analysis:Decoding".
+    """
+    table = pipeline
+    if ":" in table_name:
+        module_name, table_name = table_name.split(":")
+        table = importlib.import_module(module_name)
+    for name in table_name.split("."):
+        table = getattr(table, name)
+    return table()
+
+
+def _populate_key(
+    table_name: str, key: dict, populate_settings: dict, measure: bool = False
+) -> tuple:
+    """Populate one key of a pipeline table. Runs in a worker process.
+
+    Returns:
+        errors (list): (key, error message) if populating the key failed
+        record (dict): metrics record of the key if `measure`, see
+            `metrics.METRIC_FIELDS`. Otherwise None.
+    """
+    table = _get_table(table_name)
+    if not measure:
+        return _get_error_list(table.populate(key, **populate_settings)), None
+
+    start_time = datetime.now()
+    rows_before = _count_key_rows(table, key)
+    bytes_before = _get_connection_bytes(table.connection)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    with _PeakRSSSampler() as rss_sampler:
+        errors = _get_error_list(table.populate(key, **populate_settings))
+
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+    bytes_after = _get_connection_bytes(table.connection)
+    rows_inserted = _count_key_rows(table, key) - rows_before
+
+    return errors, {
+        "table_name": table_name,
+        "key": json.dumps(key, default=str),
+        "status": "error" if errors else "success" if rows_inserted else "skipped",
+        "start_time": start_time.isoformat(),
+        "wall_time": wall_time,
+        "cpu_time": cpu_time,
+        "peak_rss": rss_sampler.peak_rss,
+        "bytes_fetched": bytes_after["Bytes_sent"] - bytes_before["Bytes_sent"],
+        "bytes_inserted": (
+            bytes_after["Bytes_received"] - bytes_before["Bytes_received"]
+        ),
+        "rows_inserted": rows_inserted,
+        "host": platform.node(),
+        "pid": os.getpid(),
+    }
+
+
+def _get_error_list(result) -> list:
+    """Return the error list of the result of DataJoint `populate`"""
+    if isinstance(result, dict):  # DataJoint >= 0.14.2 also reports success count
+        result = result["error_list"]
+    return result or []
+
+
+def _format_error(error: Exception) -> str:
+    """Error message reported for a key whose worker raised"""
+    return f"{error.__class__.__name__}: {error}"
+
+
+def _get_connection_bytes(connection) -> dict:
+    """Bytes sent and received by the database server over this connection"""
+    return {
+        name: int(value)
+        for name, value in connection.query(
+            "SHOW SESSION STATUS "
+            + "WHERE Variable_name IN ('Bytes_sent', 'Bytes_received')"
+        ).fetchall()
+    }
+
+
+def _count_key_rows(table, key: dict) -> int:
+    """Entries of a master table and its parts for a key"""
+    return sum(len(part & key) for part in [table, *_get_part_tables(table)])
+
+
+class _PeakRSSSampler:
+    """Peak resident set size of this process in bytes while in the context
+
+    The current resident set size is sampled every `interval` seconds in a thread,
+    where available (Linux). If the process peak grew in the context, it is the
+    exact peak of the context and is reported instead. Elsewhere, `peak_rss` is None
+    unless the process peak grew.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._process_peak = _get_peak_rss()
+        self.peak_rss = _get_current_rss()
+        if self.peak_rss is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread.is_alive():
+            self._stop_event.set()
+            self._thread.join()
+        process_peak = _get_peak_rss()
+        if process_peak is not None and process_peak != self._process_peak:
+            self.peak_rss = process_peak
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, _get_current_rss() or 0)
+
+
+def _get_current_rss():
+    """Resident set size of this process in bytes, None where unavailable"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _get_peak_rss():
+    """Peak resident set size of this process in bytes, None where unavailable"""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024  # Linux: KiB
+
+
+def _get_part_tables(table) -> list:
+    """Part tables of a master table"""
+    return [
+        part()
+        for part in vars(type(table)).values()
+        if isinstance(part, type) and issubclass(part, dj.Part)
+    ]
+
+
+def _record_metrics(records: list, record: dict, metrics_path: str):
+    """Append a metrics record to `records` and to the metrics file"""
+    if record is not None:
+        records.append(record)
+        metrics.write_metrics([record], metrics_path)
 
-    print("\n---- Populate ephys.LFP ----")
-    ephys.LFP.populate(**populate_settings)
 
-    print("\n---- Populate ephys.Clustering ----")
-    ephys.Clustering.populate(**populate_settings)
+def main(argv: list = None):
+    """Command line entry point: `python -m workflow_array_ephys.process [worker]`"""
+    parser = argparse.ArgumentParser(
+        description="Populate the pipeline once (run) or as a long-lived worker"
+    )
+    parser.add_argument("mode", nargs="?", choices=("run", "worker"), default="run")
+    parser.add_argument("--n-workers", type=int, help="worker processes on this node")
+    parser.add_argument(
+        "--table-concurrency",
+        nargs="*",
+        default=[],
+        metavar="TABLE=N",
+        help="maximum number of keys of a table populated at once",
+    )
+    parser.add_argument("--heartbeat-interval", type=float, default=60)
+    parser.add_argument("--stale-after", type=float, default=1800)
+    parser.add_argument("--max-idle-sleep", type=float, default=600)
+    parser.add_argument(
+        "--metrics-path", help=".jsonl, .sqlite or .csv file of per-key metrics"
+    )
+    parser.add_argument(
+        "--key-order", choices=("longest_first", "largest_first", "newest_first")
+    )
+    args = parser.parse_args(argv)
 
-    print("\n---- Populate ephys.CuratedClustering ----")
-    ephys.CuratedClustering.populate(**populate_settings)
+    table_concurrency = {}
+    for table_limit in args.table_concurrency:
+        table_name, limit = table_limit.split("=")
+        table_concurrency[table_name] = int(limit)
 
-    print("\n---- Populate ephys.WaveformSet ----")
-    ephys.WaveformSet.populate(**populate_settings)
+    if args.mode == "worker":
+        logging.basicConfig(level=logging.INFO)
+        run_worker(
+            n_workers=args.n_workers,
+            table_concurrency=table_concurrency,
+            max_idle_sleep=args.max_idle_sleep,
+            heartbeat_interval=args.heartbeat_interval,
+            stale_after=args.stale_after,
+            metrics_path=args.metrics_path,
+            key_order=args.key_order,
+        )
+    else:
+        run(
+            n_workers=args.n_workers,
+            table_concurrency=table_concurrency,
+            metrics_path=args.metrics_path,
+            key_order=args.key_order,
+        )
 
 
 if __name__ == "__main__":
-    run()
+    main()
@@ -0,0 +1,202 @@
+"""On-disk index of the recording and spike sorting files under ephys root directories
+
+Recursive scans of large data trees on network file systems are slow. `ScanIndex`
+keeps the directories and the files matching INDEXED_PATTERNS of each scanned tree in
+a local SQLite database. A refresh lists only the directories whose mtime changed
+since the last scan, as adding, removing or renaming an entry updates the mtime of
+its directory. Files modified in place keep a stale size and mtime until their
+directory changes.
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+# Names of the files recorded in the index
+INDEXED_PATTERNS = (
+    "*.ap.meta",
+    "*.lf.meta",
+    "*.oebin",
+    "params.py",
+    "spike_times.npy",
+    "spike_clusters.npy",
+    "cluster_group.tsv",
+    "cluster_KSLabel.tsv",
+)
+
+
+def _subtree_clause(column: str) -> str:
+    """SQL condition selecting paths strictly below a directory, given as 2 args
+
+    Compares strings instead of using LIKE, where "_" and "%" of paths are wildcards.
+    """
+    return f"({column} > ? AND {column} < ?)"
+
+
+def _subtree_args(directory: str) -> tuple:
+    """Arguments of `_subtree_clause`: every path starting with directory + "/" """
+    return directory.rstrip("/") + "/", directory.rstrip("/") + "0"  # "0" follows "/"
+
+
+class ScanIndex:
+    """SQLite index of directories and recording files below scanned root directories
+
+    Each method opens its own connection, so an index can be used from several
+    threads.
+
+    Args:
+        index_path (str): SQLite file of the index, created if needed
+        patterns (tuple, optional): names of the files recorded in the index.
+            Defaults to INDEXED_PATTERNS.
+    """
+
+    def __init__(self, index_path, patterns: tuple = INDEXED_PATTERNS):
+        self.index_path = Path(index_path)
+        self.patterns = tuple(patterns)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS directories "
+                + "(path TEXT PRIMARY KEY, parent TEXT, mtime REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS directory_parent ON directories (parent)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+                + "directory TEXT, name TEXT, size INTEGER, mtime REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS file_directory ON files (directory)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Connection committing on exit, or rolling back on error, then closed"""
+        connection = sqlite3.connect(self.index_path, timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def refresh(self, root_dir) -> int:
+        """Bring the index of a directory tree up to date
+
+        Args:
+            root_dir (str): root of the directory tree
+
+        Returns:
+            rescanned (int): number of directories listed because they were new or
+                their mtime changed
+        """
+        root_dir = Path(root_dir).absolute()
+        root = root_dir.as_posix()
+        rescanned, seen = 0, set()
+
+        with self._connect() as connection:
+            stored_mtimes = dict(
+                connection.execute(
+                    "SELECT path, mtime FROM directories WHERE path = ? OR "
+                    + _subtree_clause("path"),
+                    (root, *_subtree_args(root)),
+                )
+            )
+
+            directories = [root_dir]
+            while directories:
+                directory = directories.pop()
+                path = directory.as_posix()
+                try:
+                    mtime = directory.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                seen.add(path)
+
+                if stored_mtimes.get(path) == mtime:
+                    directories.extend(
+                        Path(subdirectory)
+                        for subdirectory, in connection.execute(
+                            "SELECT path FROM directories WHERE parent = ?", (path,)
+                        )
+                    )
+                    continue
+
+                rescanned += 1
+                file_rows = []
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(Path(entry.path))
+                        elif any(fnmatchcase(entry.name, p) for p in self.patterns):
+                            stat = entry.stat()
+                            file_rows.append(
+                                (
+                                    Path(entry.path).as_posix(),
+                                    path,
+                                    entry.name,
+                                    stat.st_size,
+                                    stat.st_mtime,
+                                )
+                            )
+                connection.execute("DELETE FROM files WHERE directory = ?", (path,))
+                connection.executemany(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?)", file_rows
+                )
+                connection.execute(
+                    "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+                    (path, directory.parent.as_posix(), mtime),
+                )
+
+            removed = [(path,) for path in stored_mtimes if path not in seen]
+            connection.executemany("DELETE FROM directories WHERE path = ?", removed)
+            connection.executemany("DELETE FROM files WHERE directory = ?", removed)
+
+        return rescanned
+
+    def glob(self, directory, pattern: str) -> list:
+        """Indexed files below a directory whose name matches a pattern
+
+        Equivalent to `Path(directory).rglob(pattern)` for indexed file names, once
+        the tree containing `directory` is refreshed.
+
+        Args:
+            directory (str): directory to search
+            pattern (str): file name pattern, e.g. "*.ap.meta"
+
+        Returns:
+            paths (list): sorted matching paths
+        """
+        directory = Path(directory).absolute().as_posix()
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT path, name FROM files WHERE " + _subtree_clause("path"),
+                _subtree_args(directory),
+            ).fetchall()
+
+        return sorted(Path(path) for path, name in rows if fnmatchcase(name, pattern))
+
+    def find_full_path(self, root_dirs, relative_path):
+        """Find an indexed directory or file under one of the root directories
+
+        Args:
+            root_dirs (str or list): root directories, e.g. get_ephys_root_data_dir()
+            relative_path (str): path relative to one of the root directories
+
+        Returns:
+            full_path (pathlib.Path): full path, or None if not in the index
+        """
+        if not isinstance(root_dirs, (list, tuple)):
+            root_dirs = [root_dirs]
+
+        with self._connect() as connection:
+            for root_dir in root_dirs:
+                full_path = Path(root_dir) / relative_path
+                path = full_path.absolute().as_posix().rstrip("/")
+                if connection.execute(
+                    "SELECT 1 FROM directories WHERE path = ? "
+                    + "UNION ALL SELECT 1 FROM files WHERE path = ?",
+                    (path, path),
+                ).fetchone():
+                    return full_path